@@ -0,0 +1,155 @@
+"""
+Micro-benchmark of the ESL frame parser.
+
+Compares the line based header reader used up to version 1.0.1 against
+ESLFrameParser on a recorded session consisting of a `show calls as json`
+response followed by one `uuid_set_media_stats` and one `uuid_dump`
+response per call. Every body is passed through json.loads() the same way
+the channel collector does.
+
+Usage: python benchmarks/esl_parser.py [calls] [rounds]
+"""
+
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+
+from freeswitch_exporter.esl import READ_SIZE, ESLFrameParser
+
+# Bytes handed to the reader at once, independent of READ_SIZE.
+SEGMENT_SIZE = 65536
+
+
+def frame(body: bytes) -> bytes:
+    """
+    Returns an api/response frame with the given body.
+    """
+    return (f'Content-Type: api/response\nContent-Length: {len(body)}\n\n'
+            .encode() + body)
+
+
+def record(calls: int) -> bytes:
+    """
+    Returns the byte stream FreeSWITCH sends while scraping the given number
+    of calls.
+    """
+    uuids = [str(uuid.UUID(int=i)) for i in range(calls)]
+    rows = [{'uuid': call, 'name': f'sofia/internal/{i}@example.com'}
+            for i, call in enumerate(uuids)]
+    chunks = [frame(json.dumps({'row_count': calls, 'rows': rows}).encode())]
+
+    for call in uuids:
+        dump = {f'variable_var_{i}': f'value {i}' for i in range(300)}
+        dump.update({f'variable_rtp_audio_in_{i}': str(i) for i in range(30)})
+        dump['Unique-ID'] = call
+        chunks.append(frame(b'+OK\n'))
+        chunks.append(frame(json.dumps(dump).encode()))
+
+    return b''.join(chunks)
+
+
+async def replay(reader: asyncio.StreamReader, stream: bytes):
+    """
+    Feeds the stream to the reader in chunks, like a socket would.
+    """
+    for offset in range(0, len(stream), SEGMENT_SIZE):
+        reader.feed_data(stream[offset:offset + SEGMENT_SIZE])
+        await asyncio.sleep(0)
+    reader.feed_eof()
+
+
+async def legacy(stream: bytes) -> int:
+    """
+    Reads all frames with the line based reader. Returns the frame count.
+    """
+    reader = asyncio.StreamReader(limit=2 ** 24)
+    producer = asyncio.ensure_future(replay(reader, stream))
+
+    frames = 0
+    while not reader.at_eof():
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\n', b''):
+                break
+            name, value = line.decode().split(':', 1)
+            headers[name.strip()] = value.strip()
+        if not headers:
+            break
+
+        body = ''
+        if 'Content-Length' in headers:
+            size = int(headers['Content-Length'])
+            body = (await reader.readexactly(size)).decode()
+        if body.startswith('{'):
+            json.loads(body)
+        frames += 1
+
+    await producer
+    return frames
+
+
+async def buffered(stream: bytes) -> int:
+    """
+    Reads all frames with ESLFrameParser. Returns the frame count.
+    """
+    reader = asyncio.StreamReader(limit=2 ** 24)
+    producer = asyncio.ensure_future(replay(reader, stream))
+
+    parser = ESLFrameParser()
+    frames = 0
+    while True:
+        result = parser.next_frame()
+        if result is None:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            continue
+
+        (_, body) = result
+        if body.startswith(b'{'):
+            json.loads(body)
+        frames += 1
+
+    await producer
+    return frames
+
+
+def measure(name, func, stream, rounds):
+    """
+    Runs func over the stream and prints throughput and the peak of memory
+    allocated while parsing.
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        frames = asyncio.run(func(stream))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    asyncio.run(func(stream))
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:>10}: {frames * rounds / elapsed:12.0f} frames/s '
+          f'{peak / 1024:10.0f} KiB peak allocated')
+
+
+def main():
+    """
+    Main entry point.
+    """
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    stream = record(calls)
+    print(f'{calls} calls, {len(stream) / 2 ** 20:.1f} MiB, {rounds} rounds')
+    measure('legacy', legacy, stream, rounds)
+    measure('buffered', buffered, stream, rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the channel metric exposition.
+
+Renders the per-channel families of the given number of calls once through
+GaugeMetricFamily and generate_latest() the way the channel collector did up
+to version 1.0.1, and through the precompiled gauge table, rendered at once
+and in chunks. Exits with an error if the outputs are not identical byte for
+byte. CI runs it as a regression test of the exposition.
+
+Usage: python benchmarks/exposition.py [calls] [rounds]
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+from prometheus_client.core import GaugeMetricFamily
+
+from freeswitch_exporter.collector import CHANNEL_INFO, CHANNEL_METRICS
+from freeswitch_exporter.exposition import _generate, iter_render, render
+
+
+def record(calls: int):
+    """
+    Returns (uuid, name, user agent, channel variables) for every call. Some
+    names and user agents contain characters which need escaping.
+    """
+    rand = random.Random(calls)
+    specials = ['', '"quoted"', 'back\\slash', 'new\nline']
+    result = []
+    for i in range(calls):
+        channelvars = {key: str(rand.choice([
+            rand.randint(0, 2 ** 40), rand.random() * 100,
+            rand.randint(0, 10 ** 17), 0]))
+            for key in CHANNEL_METRICS}
+        result.append((str(uuid.UUID(int=i)),
+                       f'sofia/internal/{i}@example.com{specials[i % 4]}',
+                       f'UA {specials[(i // 4) % 4]}', channelvars))
+    return result
+
+
+def legacy(channels) -> bytes:
+    """
+    Renders through GaugeMetricFamily and generate_latest().
+    """
+    families = {key: GaugeMetricFamily(definition.name,
+                                       definition.documentation,
+                                       labels=definition.labels)
+                for key, definition in CHANNEL_METRICS.items()}
+    info = GaugeMetricFamily(CHANNEL_INFO.name, CHANNEL_INFO.documentation,
+                             labels=CHANNEL_INFO.labels)
+    for (call, name, user_agent, channelvars) in channels:
+        for key, value in channelvars.items():
+            families[key].add_metric([call], value)
+        info.add_metric([call, name, user_agent], 1)
+    return _generate(list(families.values()) + [info])
+
+
+def table(channels) -> bytes:
+    """
+    Renders through the precompiled gauge table.
+    """
+    return render(_table_families(channels))
+
+
+def chunked(channels) -> bytes:
+    """
+    Renders through the precompiled gauge table in chunks, the way streamed
+    responses are.
+    """
+    return b''.join(iter_render(_table_families(channels)))
+
+
+def _table_families(channels):
+    families = {key: definition.family()
+                for key, definition in CHANNEL_METRICS.items()}
+    info = CHANNEL_INFO.family()
+    for (call, name, user_agent, channelvars) in channels:
+        for key, value in channelvars.items():
+            families[key].add_metric([call], value)
+        info.add_metric([call, name, user_agent], 1)
+    return list(families.values()) + [info]
+
+
+def measure(name, func, channels, rounds):
+    """
+    Runs func over the channels and prints time and peak memory allocated.
+    """
+    start = time.process_time()
+    for _ in range(rounds):
+        output = func(channels)
+    elapsed = (time.process_time() - start) / rounds
+
+    tracemalloc.start()
+    func(channels)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:>8}: {elapsed * 1000:10.1f} ms CPU per scrape '
+          f'{peak / 1024:10.0f} KiB peak allocated')
+    return output
+
+
+def main():
+    """
+    Main entry point.
+    """
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    channels = record(calls)
+    print(f'{calls} calls, {rounds} rounds')
+    expected = measure('legacy', legacy, channels, rounds)
+    actual = measure('table', table, channels, rounds)
+    streamed = measure('chunked', chunked, channels, rounds)
+
+    if actual != expected:
+        sys.exit('Output differs from generate_latest()')
+    if streamed != expected:
+        sys.exit('Chunked output differs from generate_latest()')
+    print(f'Output identical ({len(actual) / 2 ** 20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
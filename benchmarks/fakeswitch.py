@@ -0,0 +1,571 @@
+"""
+Stand-in for the FreeSWITCH event socket.
+
+Speaks enough of the inbound event socket protocol for the exporter: the
+auth/request and command/reply handshake, api commands answered with
+api/response frames, bgapi jobs and json event subscriptions. Synthesizes
+the given number of calls with show calls and uuid_dump payloads shaped
+like the ones of FreeSWITCH 1.10. Optionally spreads the calls over
+conference rooms and callcenter queues, delays api responses, answers
+channel commands with -ERR as if the call just hung up, drops connections
+and replaces calls over time while emitting channel events.
+
+Usage: python benchmarks/fakeswitch.py [-h] [--calls N] [--port PORT] ...
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+import uuid
+
+# Channel variables exported by the channel collector, with a generator for
+# plausible values.
+RTP_VARIABLES = {
+    'variable_rtp_audio_in_raw_bytes': lambda rand: rand.randint(0, 10 ** 8),
+    'variable_rtp_audio_out_raw_bytes': lambda rand: rand.randint(0, 10 ** 8),
+    'variable_rtp_audio_in_media_bytes':
+        lambda rand: rand.randint(0, 10 ** 8),
+    'variable_rtp_audio_out_media_bytes':
+        lambda rand: rand.randint(0, 10 ** 8),
+    'variable_rtp_audio_in_packet_count':
+        lambda rand: rand.randint(0, 10 ** 6),
+    'variable_rtp_audio_out_packet_count':
+        lambda rand: rand.randint(0, 10 ** 6),
+    'variable_rtp_audio_in_media_packet_count':
+        lambda rand: rand.randint(0, 10 ** 6),
+    'variable_rtp_audio_out_media_packet_count':
+        lambda rand: rand.randint(0, 10 ** 6),
+    'variable_rtp_audio_in_skip_packet_count': lambda rand: rand.randint(0, 50),
+    'variable_rtp_audio_out_skip_packet_count':
+        lambda rand: rand.randint(0, 50),
+    'variable_rtp_audio_in_jitter_packet_count':
+        lambda rand: rand.randint(0, 50),
+    'variable_rtp_audio_in_dtmf_packet_count': lambda rand: rand.randint(0, 20),
+    'variable_rtp_audio_out_dtmf_packet_count':
+        lambda rand: rand.randint(0, 20),
+    'variable_rtp_audio_in_cng_packet_count': lambda rand: 0,
+    'variable_rtp_audio_out_cng_packet_count': lambda rand: 0,
+    'variable_rtp_audio_in_flush_packet_count': lambda rand: rand.randint(0, 5),
+    'variable_rtp_audio_in_largest_jb_size':
+        lambda rand: rand.choice([0, 320, 640, 1280]),
+    'variable_rtp_audio_in_jitter_min_variance':
+        lambda rand: f'{rand.uniform(0, 5):.2f}',
+    'variable_rtp_audio_in_jitter_max_variance':
+        lambda rand: f'{rand.uniform(5, 80):.2f}',
+    'variable_rtp_audio_in_jitter_loss_rate':
+        lambda rand: f'{rand.uniform(0, 2):.2f}',
+    'variable_rtp_audio_in_jitter_burst_rate':
+        lambda rand: f'{rand.uniform(0, 2):.2f}',
+    'variable_rtp_audio_in_mean_interval':
+        lambda rand: f'{rand.uniform(19.5, 20.5):.2f}',
+    'variable_rtp_audio_in_flaw_total': lambda rand: rand.randint(0, 30),
+    'variable_rtp_audio_in_quality_percentage':
+        lambda rand: f'{rand.uniform(90, 100):.2f}',
+    'variable_rtp_audio_in_mos': lambda rand: f'{rand.uniform(3.5, 4.5):.2f}',
+    'variable_rtp_audio_rtcp_octet_count': lambda rand: rand.randint(0, 10 ** 5),
+    'variable_rtp_audio_rtcp_packet_count': lambda rand: rand.randint(0, 10 ** 3),
+}
+
+
+class Call():
+    """
+    Synthetic call with a single leg.
+    """
+
+    def __init__(self, rand: random.Random, index: int):
+        self.uuid = str(uuid.UUID(int=rand.getrandbits(128), version=4))
+        self.created = int(time.time()) - rand.randint(0, 3600)
+        self.profile = rand.choice(['internal', 'external'])
+        self.direction = rand.choice(['inbound', 'outbound'])
+        self.gateway = rand.choice(['', 'carrier-a', 'carrier-b'])
+        self.codec = rand.choice(['PCMU', 'PCMA', 'G722', 'opus'])
+        self.number = f'+4144{index:07d}'
+        self.name = f'sofia/{self.profile}/{self.number}@192.0.2.1'
+        self.variables = {key: str(generate(rand))
+                          for key, generate in RTP_VARIABLES.items()}
+
+    def row(self) -> dict:
+        """
+        Returns the row of the call in `show calls as json`.
+        """
+        return {
+            'uuid': self.uuid,
+            'direction': self.direction,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S',
+                                     time.localtime(self.created)),
+            'created_epoch': str(self.created),
+            'name': self.name,
+            'state': 'CS_EXCHANGE_MEDIA',
+            'cid_name': 'Example',
+            'cid_num': self.number,
+            'ip_addr': '192.0.2.1',
+            'dest': '1000',
+            'presence_id': '',
+            'presence_data': '',
+            'accountcode': '',
+            'callstate': 'ACTIVE',
+            'callee_name': 'Outbound Call',
+            'callee_num': '1000',
+            'callee_direction': 'SEND',
+            'call_uuid': self.uuid,
+            'hostname': 'fakeswitch',
+            'sent_callee_name': 'Outbound Call',
+            'sent_callee_num': '1000',
+            'b_uuid': '',
+            'b_direction': '',
+            'b_created': '',
+            'b_created_epoch': '',
+            'b_name': '',
+            'b_state': '',
+            'b_cid_name': '',
+            'b_cid_num': '',
+            'b_ip_addr': '',
+            'b_dest': '',
+            'b_presence_id': '',
+            'b_presence_data': '',
+            'b_accountcode': '',
+            'b_callstate': '',
+            'b_callee_name': '',
+            'b_callee_num': '',
+            'b_callee_direction': '',
+            'b_sent_callee_name': '',
+            'b_sent_callee_num': '',
+            'call_created_epoch': str(self.created),
+        }
+
+    def dump(self) -> dict:
+        """
+        Returns the channel data printed by `uuid_dump <uuid> json`.
+        """
+        data = {
+            'Event-Name': 'CHANNEL_DATA',
+            'Core-UUID': '00000000-0000-4000-8000-000000000000',
+            'FreeSWITCH-Hostname': 'fakeswitch',
+            'FreeSWITCH-Switchname': 'fakeswitch',
+            'FreeSWITCH-IPv4': '192.0.2.2',
+            'Event-Date-Timestamp': str(int(time.time() * 10 ** 6)),
+            'Channel-State': 'CS_EXCHANGE_MEDIA',
+            'Channel-Call-State': 'ACTIVE',
+            'Channel-Name': self.name,
+            'Unique-ID': self.uuid,
+            'Call-Direction': self.direction,
+            'Presence-Call-Direction': self.direction,
+            'Channel-Read-Codec-Name': self.codec,
+            'Channel-Read-Codec-Rate': '8000',
+            'Channel-Write-Codec-Name': self.codec,
+            'Channel-Write-Codec-Rate': '8000',
+            'Caller-Direction': self.direction,
+            'Caller-Username': self.number,
+            'Caller-Caller-ID-Number': self.number,
+            'Caller-Destination-Number': '1000',
+            'Caller-Unique-ID': self.uuid,
+            'Caller-Source': 'mod_sofia',
+            'Caller-Context': 'default',
+            'Caller-Channel-Name': self.name,
+            'Caller-Profile-Created-Time': str(self.created * 10 ** 6),
+            'variable_direction': self.direction,
+            'variable_uuid': self.uuid,
+            'variable_call_uuid': self.uuid,
+            'variable_session_id': '1',
+            'variable_sip_from_user': self.number,
+            'variable_sip_from_host': '192.0.2.1',
+            'variable_sip_to_user': '1000',
+            'variable_sip_call_id': f'{self.uuid}@192.0.2.1',
+            'variable_sip_user_agent': 'Example Phone 1.0',
+            'variable_sofia_profile_name': self.profile,
+            'variable_rtp_use_codec_name': self.codec,
+            'variable_rtp_use_codec_rate': '8000',
+            'variable_rtp_use_codec_ptime': '20',
+            'variable_read_codec': self.codec,
+            'variable_write_codec': self.codec,
+            'variable_endpoint_disposition': 'ANSWER',
+        }
+        if self.gateway:
+            data['variable_sip_gateway_name'] = self.gateway
+
+        # Dialplans and SIP headers add a lot of variables the exporter
+        # does not care about.
+        for index in range(150):
+            data[f'variable_sip_h_X-Example-{index}'] = f'value-{index}'
+
+        data.update(self.variables)
+        return data
+
+
+def frame(content_type: str, body: bytes = b'', **headers) -> bytes:
+    """
+    Returns an event socket frame.
+    """
+    lines = [f'Content-Type: {content_type}']
+    lines.extend(f'{name.replace("_", "-")}: {value}'
+                 for name, value in headers.items())
+    if body:
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\n'.join(lines) + '\n\n').encode() + body
+
+
+class FakeSwitch():
+    """
+    Event socket server backed by synthetic calls.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, calls, *, password='ClueCon', latency=0., jitter=0.,
+                 error_rate=0., disconnect_rate=0., churn=0., gateways=2,
+                 registrations=100, conferences=0, queues=0, seed=0):
+        self._rand = random.Random(seed)
+        self._password = password
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._disconnect_rate = disconnect_rate
+        self._churn = churn
+        self._gateways = [f'carrier-{chr(ord("a") + index)}' if index < 2
+                          else f'gateway-{index}' for index in range(gateways)]
+        self._registrations = registrations
+        self._conferences = conferences
+        self._queues = queues
+        self._subscribers = set()
+        self._counter = calls
+        self.calls = {}
+        for index in range(calls):
+            call = Call(self._rand, index)
+            self.calls[call.uuid] = call
+        self.commands = 0
+        self.connections = 0
+
+    async def serve(self, host='127.0.0.1', port=8021, on_ready=None):
+        """
+        Serves until cancelled. Port 0 binds an ephemeral port, on_ready is
+        invoked with the bound port once the server accepts connections.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        if on_ready is not None:
+            on_ready(server.sockets[0].getsockname()[1])
+        if self._churn:
+            asyncio.ensure_future(self._replace_calls())
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """
+        Connection callback for asyncio.start_server().
+        """
+        self.connections += 1
+        writer.write(frame('auth/request'))
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                if not await self._dispatch(command, writer):
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Handlers are cancelled when the loop shuts down, e.g., at the
+            # end of a test.
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return None
+            line = line.decode().strip()
+            if not line:
+                return lines
+            lines.append(line)
+
+    async def _dispatch(self, lines, writer) -> bool:
+        """
+        Answers a command. Returns False if the connection is to be closed.
+        """
+        self.commands += 1
+        (verb, _, args) = lines[0].partition(' ')
+        headers = dict(line.split(': ', 1) for line in lines[1:]
+                       if ': ' in line)
+
+        if verb == 'auth':
+            if args == self._password:
+                writer.write(frame('command/reply',
+                                   Reply_Text='+OK accepted'))
+                return True
+            writer.write(frame('command/reply', Reply_Text='-ERR invalid'))
+            return False
+
+        if verb == 'event':
+            self._subscribers.add(writer)
+            writer.write(frame('command/reply',
+                               Reply_Text='+OK event listener enabled json'))
+        elif verb == 'bgapi':
+            job = headers.get('Job-UUID', str(uuid.uuid4()))
+            writer.write(frame('command/reply',
+                               Reply_Text=f'+OK Job-UUID: {job}',
+                               Job_UUID=job))
+            event = {'Event-Name': 'BACKGROUND_JOB', 'Job-UUID': job,
+                     '_body': self._api(args)}
+            writer.write(frame('text/event-json', json.dumps(event).encode()))
+        elif verb == 'api':
+            if self._rand.random() < self._disconnect_rate:
+                return False
+            delay = self._latency + self._rand.uniform(0, self._jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(frame('api/response', self._api(args).encode()))
+        elif verb == 'exit':
+            writer.write(frame('command/reply', Reply_Text='+OK bye'))
+            return False
+        else:
+            writer.write(frame('command/reply',
+                               Reply_Text='-ERR command not found'))
+
+        return True
+
+    def _api(self, command) -> str:
+        (name, _, args) = command.partition(' ')
+        if name == 'json':
+            return json.dumps(self._status())
+        if command in ('show calls as json', 'show channels as json'):
+            rows = [call.row() for call in self.calls.values()]
+            return json.dumps({'row_count': len(rows), 'rows': rows})
+        if name in ('uuid_set_media_stats', 'uuid_dump'):
+            call = self.calls.get(args.split(' ')[0])
+            if call is None or self._rand.random() < self._error_rate:
+                return '-ERR No such channel!\n'
+            if name == 'uuid_dump':
+                return json.dumps(call.dump())
+            return '+OK\n'
+        if name == 'version':
+            return 'FreeSWITCH Version 1.10.7-release (fakeswitch)\n'
+        if command == 'sofia xmlstatus':
+            return self._sofia_profiles()
+        if command == 'sofia xmlstatus gateway':
+            return self._sofia_gateways()
+        if command == 'show registrations count':
+            return f'\n{self._registrations} total.\n\n'
+        if command == 'conference json_list' and self._conferences:
+            return self._conference_list()
+        if name == 'callcenter_config' and self._queues:
+            return self._callcenter(args)
+        return f'-ERR {name} Command not found!\n'
+
+    def _status(self):
+        return {
+            'command': 'status',
+            'status': 'success',
+            'response': {
+                'version': '1.10.7',
+                'systemStatus': 'ready',
+                'stackSizeKB': {'current': 240, 'max': 8192},
+                'sessions': {'count': {'total': self._counter,
+                                       'active': len(self.calls),
+                                       'peak': len(self.calls),
+                                       'limit': 10000}},
+            },
+        }
+
+    def _sofia_profiles(self):
+        inuse = collections.Counter(call.profile
+                                    for call in self.calls.values())
+        lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>', '<profiles>']
+        for (profile, port) in (('internal', 5060), ('external', 5080)):
+            lines.append(f'<profile>\n<name>{profile}</name>\n'
+                         f'<type>profile</type>\n'
+                         f'<data>sip:mod_sofia@192.0.2.2:{port}</data>\n'
+                         f'<state>RUNNING ({inuse[profile]})</state>\n'
+                         f'</profile>')
+        for gateway in self._gateways:
+            lines.append(f'<gateway>\n<name>external::{gateway}</name>\n'
+                         f'<type>gateway</type>\n'
+                         f'<data>sip:{gateway}@192.0.2.10</data>\n'
+                         f'<state>REGED</state>\n</gateway>')
+        lines.append('</profiles>')
+        return '\n'.join(lines) + '\n'
+
+    def _sofia_gateways(self):
+        calls = collections.Counter((call.gateway, call.direction)
+                                    for call in self.calls.values())
+        lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>', '<gateways>']
+        for index, gateway in enumerate(self._gateways):
+            lines.append(f'''<gateway>
+<name>{gateway}</name>
+<profile>external</profile>
+<scheme>Digest</scheme>
+<realm>{gateway}.example.net</realm>
+<username>fakeswitch</username>
+<password>yes</password>
+<from>&lt;sip:fakeswitch@{gateway}.example.net&gt;</from>
+<contact>&lt;sip:gw+{gateway}@192.0.2.2:5080;transport=udp&gt;</contact>
+<exten>fakeswitch</exten>
+<to>sip:fakeswitch@{gateway}.example.net</to>
+<proxy>sip:{gateway}.example.net</proxy>
+<context>public</context>
+<expires>3600</expires>
+<freq>3600</freq>
+<ping>30</ping>
+<pingfreq>30</pingfreq>
+<pingmin>1</pingmin>
+<pingcount>3</pingcount>
+<pingmax>3</pingmax>
+<pingtime>{10 + index % 40}.{index % 100:02d}</pingtime>
+<pinging>0</pinging>
+<state>{'REGED' if index % 10 else 'FAIL_WAIT'}</state>
+<status>{'UP' if index % 10 else 'DOWN'}</status>
+<uptime-usec>{3600 * 10 ** 6}</uptime-usec>
+<calls-in>{calls[(gateway, 'inbound')]}</calls-in>
+<calls-out>{calls[(gateway, 'outbound')]}</calls-out>
+<failed-calls-in>0</failed-calls-in>
+<failed-calls-out>{index % 7}</failed-calls-out>
+</gateway>''')
+        lines.append('</gateways>')
+        return '\n'.join(lines) + '\n'
+
+    def _conference_list(self):
+        rooms = [{'conference_name': f'room-{index}', 'member_count': 0,
+                  'ghost_count': 0, 'rate': 8000, 'run_time': 600 + index,
+                  'conference_uuid': str(uuid.UUID(int=index, version=4)),
+                  'machine_name': '', 'running': True, 'answered': True,
+                  'dynamic': True, 'variables': {}, 'members': []}
+                 for index in range(self._conferences)]
+        for index, call in enumerate(self.calls.values()):
+            room = rooms[index % len(rooms)]
+            room['member_count'] += 1
+            room['members'].append({
+                'type': 'caller',
+                'id': len(room['members']) + 1,
+                'flags': {'can_hear': True, 'can_see': False,
+                          'can_speak': index % 5 != 0, 'hold': False,
+                          'mute_detect': False, 'talking': index % 2 == 0,
+                          'has_video': False, 'video_bridge': False,
+                          'has_floor': index % 7 == 0,
+                          'is_moderator': False, 'end_conference': False},
+                'uuid': call.uuid,
+                'caller_id_name': 'Example',
+                'caller_id_number': call.number,
+                'join_time': int(time.time()) - call.created,
+                'last_talking': index % 10,
+                'energy': 100 + index % 4 * 100,
+                'volume_in': 0,
+                'volume_out': 0,
+                'output-volume': 0,
+                'input-volume': 0,
+            })
+        return json.dumps(rooms) + '\n'
+
+    def _callcenter(self, args):
+        queues = [f'queue-{index}@default' for index in range(self._queues)]
+        if args == 'queue list':
+            lines = ['name|strategy|moh_sound|time_base_score|'
+                     'max_wait_time|calls_answered|calls_abandoned']
+            lines.extend(f'{queue}|longest-idle-agent|local_stream://moh|'
+                         f'queue|0|{100 + index}|{index}'
+                         for index, queue in enumerate(queues))
+        elif args == 'member list':
+            lines = ['queue|instance_id|uuid|session_uuid|cid_number|'
+                     'cid_name|system_epoch|joined_epoch|rejoined_epoch|'
+                     'bridge_epoch|abandoned_epoch|base_score|skill_score|'
+                     'serving_agent|serving_system|state|score']
+            states = ['Waiting', 'Waiting', 'Trying', 'Answered']
+            for index, call in enumerate(self.calls.values()):
+                lines.append(
+                    f'{queues[index % len(queues)]}|single_box|'
+                    f'{uuid.UUID(int=index, version=4)}|{call.uuid}|'
+                    f'{call.number}|Example|{call.created}|{call.created}|'
+                    f'0|0|0|0|0||single_box|{states[index % len(states)]}|'
+                    f'{int(time.time()) - call.created}')
+        elif args == 'agent list':
+            lines = ['name|instance_id|uuid|type|contact|status|state|'
+                     'max_no_answer|wrap_up_time|reject_delay_time|'
+                     'busy_delay_time|no_answer_delay_time|'
+                     'last_bridge_start|last_bridge_end|last_offered_call|'
+                     'last_status_change|no_answer_count|calls_answered|'
+                     'talk_time|ready_time|external_calls_count']
+            for index in range(self._queues * 5):
+                (status, state) = [('Available', 'Waiting'),
+                                   ('Available', 'In a queue call'),
+                                   ('On Break', 'Idle'),
+                                   ('Logged Out', 'Idle')][index % 4]
+                lines.append(f'agent-{index}@default|single_box||callback|'
+                             f'user/{1000 + index}|{status}|{state}|3|10|'
+                             f'10|60|0|0|0|0|0|0|{index}|{index * 60}|0|0')
+        else:
+            return '-ERR Unknown command\n'
+        return '\n'.join(lines) + '\n+OK\n'
+
+    async def _replace_calls(self):
+        while True:
+            await asyncio.sleep(1 / self._churn)
+            if not self.calls:
+                continue
+
+            old = next(iter(self.calls.values()))
+            del self.calls[old.uuid]
+            new = Call(self._rand, self._counter)
+            self._counter += 1
+            self.calls[new.uuid] = new
+
+            for (name, call) in (('CHANNEL_HANGUP_COMPLETE', old),
+                                 ('CHANNEL_DESTROY', old),
+                                 ('CHANNEL_CREATE', new)):
+                event = {'Event-Name': name, 'Unique-ID': call.uuid,
+                         'Channel-Name': call.name,
+                         'Channel-Call-UUID': call.uuid,
+                         'variable_sip_user_agent': 'Example Phone 1.0'}
+                if name == 'CHANNEL_HANGUP_COMPLETE':
+                    event = dict(call.dump(), **event)
+                for writer in list(self._subscribers):
+                    writer.write(frame('text/event-json',
+                                       json.dumps(event).encode()))
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8021)
+    parser.add_argument('--password', default='ClueCon')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Seconds added to every api response')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='Random seconds added on top of latency')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='Share of channel commands answered with -ERR')
+    parser.add_argument('--disconnect-rate', type=float, default=0.,
+                        help='Share of api commands closing the connection')
+    parser.add_argument('--churn', type=float, default=0.,
+                        help='Calls replaced per second')
+    parser.add_argument('--gateways', type=int, default=2)
+    parser.add_argument('--registrations', type=int, default=100)
+    parser.add_argument('--conferences', type=int, default=0,
+                        help='Conference rooms the calls are spread over')
+    parser.add_argument('--queues', type=int, default=0,
+                        help='Callcenter queues the calls are spread over')
+    args = parser.parse_args()
+
+    switch = FakeSwitch(args.calls, password=args.password,
+                        latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate,
+                        disconnect_rate=args.disconnect_rate,
+                        churn=args.churn, gateways=args.gateways,
+                        registrations=args.registrations,
+                        conferences=args.conferences, queues=args.queues)
+    try:
+        asyncio.run(switch.serve(args.address, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
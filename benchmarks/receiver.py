@@ -0,0 +1,251 @@
+"""
+Stand-in for a Prometheus remote write receiver.
+
+Accepts remote write 1.0 requests on any path, decodes the snappy
+compressed protobuf WriteRequests without third party packages and keeps
+the latest sample of every series. Optionally delays responses and answers
+with 503 or 400 at random, in order to exercise retries and drops of the
+push mode. Prints the samples received per second. With --shallow, series
+are only counted, decoding them in Python is slower than encoding them.
+
+Usage: python benchmarks/receiver.py [-h] [--port 9201] [--error-rate 0.1]
+"""
+
+import argparse
+import asyncio
+import random
+import struct
+import time
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    """
+    Decodes the snappy block format, literals as well as copies.
+    """
+    (length, pos) = _varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[pos:pos + extra], 'little')
+                pos += extra
+            size += 1
+            out += data[pos:pos + size]
+            pos += size
+            continue
+
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = (tag >> 5) << 8 | data[pos]
+            pos += 1
+        else:
+            size = (tag >> 2) + 1
+            extra = 2 if kind == 2 else 4
+            offset = int.from_bytes(data[pos:pos + extra], 'little')
+            pos += extra
+        for _ in range(size):
+            out.append(out[-offset])
+
+    if len(out) != length:
+        raise ValueError(f'Expected {length} bytes, got {len(out)}')
+    return bytes(out)
+
+
+def _varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def _fields(data):
+    """
+    Yields tuples (number, value) of a protobuf message, value is bytes for
+    length delimited fields and the raw 8 bytes for 64 bit fields.
+    """
+    pos = 0
+    while pos < len(data):
+        (key, pos) = _varint(data, pos)
+        (number, wire) = (key >> 3, key & 7)
+        if wire == 0:
+            (value, pos) = _varint(data, pos)
+        elif wire == 1:
+            (value, pos) = (data[pos:pos + 8], pos + 8)
+        elif wire == 2:
+            (size, pos) = _varint(data, pos)
+            (value, pos) = (data[pos:pos + size], pos + size)
+        else:
+            raise ValueError(f'Unsupported wire type {wire}')
+        yield number, value
+
+
+def decode_write_request(data: bytes):
+    """
+    Yields tuples (labels, samples) of the series of a WriteRequest, labels
+    is a tuple of (name, value) pairs and samples a list of tuples
+    (timestamp, value bits).
+    """
+    for (number, series) in _fields(data):
+        if number != 1:
+            continue
+        labels = []
+        samples = []
+        for (field, value) in _fields(series):
+            if field == 1:
+                label = dict(_fields(value))
+                labels.append((label.get(1, b'').decode(),
+                               label.get(2, b'').decode()))
+            elif field == 2:
+                sample = dict(_fields(value))
+                samples.append((sample.get(2, 0),
+                                struct.unpack('<Q', sample.get(1))[0]))
+        yield tuple(labels), samples
+
+
+class Receiver():
+    """
+    Remote write receiver keeping the latest sample of every series.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, *, latency=0., error_rate=0., reject_rate=0.,
+                 shallow=False, seed=0):
+        self._rand = random.Random(seed)
+        self._shallow = shallow
+        self._latency = latency
+        self._error_rate = error_rate
+        self._reject_rate = reject_rate
+        # labels -> (timestamp, value bits)
+        self.series = {}
+        self.samples = 0
+        self.requests = 0
+        self.out_of_order = 0
+
+    async def serve(self, host='127.0.0.1', port=9201, on_ready=None):
+        """
+        Serves until cancelled. Port 0 binds an ephemeral port, on_ready is
+        invoked with the bound port once the server accepts connections.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        if on_ready is not None:
+            on_ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """
+        Connection callback for asyncio.start_server().
+        """
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                writer.write(await self._respond(*request))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        headers = {}
+        while True:
+            header = (await reader.readline()).decode().strip()
+            if not header:
+                break
+            (name, _, value) = header.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(
+            int(headers.get('content-length', 0)))
+        return headers, body
+
+    async def _respond(self, headers, body):
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        chance = self._rand.random()
+        if chance < self._error_rate:
+            return _response(503, b'overloaded')
+        if chance < self._error_rate + self._reject_rate:
+            return _response(400, b'rejected')
+        if headers.get('content-encoding') != 'snappy':
+            return _response(415, b'expected snappy')
+
+        data = snappy_decompress(body)
+        if self._shallow:
+            self.samples += sum(1 for _ in _fields(data))
+            return _response(204, b'')
+
+        for (labels, samples) in decode_write_request(data):
+            for sample in samples:
+                previous = self.series.get(labels)
+                if previous is not None and previous[0] > sample[0]:
+                    self.out_of_order += 1
+                self.series[labels] = sample
+                self.samples += 1
+        return _response(204, b'')
+
+
+def _response(status, body):
+    return (f'HTTP/1.1 {status} Status\r\nContent-Length: {len(body)}\r\n'
+            f'\r\n').encode() + body
+
+
+async def _report(receiver):
+    last = 0
+    while True:
+        await asyncio.sleep(1)
+        print(f'{time.strftime("%H:%M:%S")} {receiver.samples - last:>8} '
+              f'samples/s {len(receiver.series):>8} series '
+              f'{receiver.requests:>6} requests', flush=True)
+        last = receiver.samples
+
+
+async def _main(args):
+    receiver = Receiver(latency=args.latency, error_rate=args.error_rate,
+                        reject_rate=args.reject_rate, shallow=args.shallow)
+    asyncio.ensure_future(_report(receiver))
+    await receiver.serve(args.address, args.port)
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='Share of requests answered with 503')
+    parser.add_argument('--reject-rate', type=float, default=0.,
+                        help='Share of requests answered with 400')
+    parser.add_argument('--shallow', action='store_true',
+                        help='Count series without decoding them')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
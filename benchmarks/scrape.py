@@ -0,0 +1,148 @@
+"""
+End to end scrape benchmark against the fake event socket.
+
+For every call count a worker process starts benchmarks/fakeswitch.py in a
+process of its own and scrapes it through collect_esl(), the same way the
+/esl endpoint does. Reports the median wall clock and CPU time per scrape
+(CPU time of the worker, i.e., the exporter side only), ESL round trips and
+bytes read per scrape as well as the peak RSS of the worker.
+
+Module options are passed with --option, e.g., --option pipeline=8 or
+--option 'pool={}'. Values are parsed as YAML.
+
+Usage: python benchmarks/scrape.py [-h] [--calls 10,100,1000,10000] ...
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import yaml
+
+from prometheus_client import CollectorRegistry
+
+from fakeswitch import FakeSwitch
+
+
+def serve(calls, options, conn):
+    """
+    Runs the fake switch and sends the bound port through conn.
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    switch = FakeSwitch(calls, **options)
+    asyncio.run(switch.serve('127.0.0.1', 0, conn.send))
+
+
+def sample_sum(registry, name, suffix=''):
+    """
+    Returns the sum of all samples of a metric in the registry.
+    """
+    return sum(sample.value
+               for metric in registry.collect() if metric.name == name
+               for sample in metric.samples
+               if sample.name == name + suffix)
+
+
+def worker(args):
+    """
+    Scrapes a fake switch with the given number of calls and prints the
+    results as JSON.
+    """
+    # pylint: disable=import-outside-toplevel
+    from freeswitch_exporter.collector import collect_esl
+    from freeswitch_exporter.target import TargetRegistry
+
+    (parent, child) = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, daemon=True, args=(
+        args.worker, {
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'disconnect_rate': args.disconnect_rate,
+        }, child))
+    server.start()
+    port = parent.recv()
+
+    config = {'port': port}
+    for option in args.option:
+        (key, _, value) = option.partition('=')
+        config[key] = yaml.safe_load(value)
+
+    registry = CollectorRegistry()
+    targets = TargetRegistry(registry=registry)
+
+    walls = []
+    cpus = []
+    failures = 0
+    for _ in range(args.rounds):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            collect_esl(config, '127.0.0.1', targets)
+        except Exception:  # pylint: disable=broad-except
+            failures += 1
+        cpus.append(time.process_time() - cpu)
+        walls.append(time.perf_counter() - wall)
+
+    commands = 'freeswitch_exporter_esl_command_duration_seconds'
+    print(json.dumps({
+        'calls': args.worker,
+        'wall': statistics.median(walls),
+        'cpu': statistics.median(cpus),
+        'round_trips': sample_sum(registry, commands, '_count') / args.rounds,
+        'bytes': sample_sum(registry, 'freeswitch_exporter_esl_read_bytes',
+                            '_total') / args.rounds,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'failures': failures,
+    }))
+
+    server.terminate()
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', default='10,100,1000,10000',
+                        help='Comma separated list of call counts')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--option', action='append', default=[],
+                        help='Module option as key=value')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Seconds added to every api response')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='Random seconds added on top of latency')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='Share of channel commands answered with -ERR')
+    parser.add_argument('--disconnect-rate', type=float, default=0.,
+                        help='Share of api commands closing the connection')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(args)
+        return
+
+    print(f'{"calls":>8} {"wall ms":>10} {"cpu ms":>10} {"round trips":>12} '
+          f'{"KiB read":>10} {"peak RSS MiB":>13} {"failed":>7}')
+    for calls in args.calls.split(','):
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker', calls] + sys.argv[1:],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output)
+        print(f'{result["calls"]:>8} {result["wall"] * 1000:>10.1f} '
+              f'{result["cpu"] * 1000:>10.1f} {result["round_trips"]:>12.0f} '
+              f'{result["bytes"] / 1024:>10.0f} '
+              f'{result["rss"] / 1024:>13.1f} '
+              f'{result["failures"]:>4}/{args.rounds}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Import time benchmark of the exporter entry points.
+
+For every entry point a fresh interpreter imports the modules it needs, once
+with -X importtime. Reports the median wall clock time of the interpreter
+runs, the cumulative import time of the exporter modules and the slowest
+third party packages. Exits with status 1 if the textfile or push path loads
+any of the packages it must not need: werkzeug, yaml and asgiref.
+
+Usage: python benchmarks/startup.py [-h] [--rounds 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Entry point -> (statement, packages which must not be imported).
+ENTRY_POINTS = {
+    'interpreter': ('pass', ()),
+    'textfile': ('import freeswitch_exporter.cli, '
+                 'freeswitch_exporter.textfile',
+                 ('werkzeug', 'yaml', 'asgiref')),
+    'push': ('import freeswitch_exporter.cli, '
+             'freeswitch_exporter.remote_write',
+             ('werkzeug', 'yaml', 'asgiref')),
+    'server': ('import freeswitch_exporter.cli, freeswitch_exporter.http',
+               ()),
+}
+
+CHECK = ('; import sys; '
+         'print(",".join(m for m in {0!r} if m in sys.modules))')
+
+
+def importtime(statement):
+    """
+    Returns a tuple (own, packages). Own is the cumulative import time in
+    microseconds of the exporter modules imported by the statement, packages
+    maps the third party packages imported along the way to theirs.
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        check=True, stderr=subprocess.PIPE, text=True).stderr
+
+    own = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative, name) = line[len('import time:'):].split('|')
+        package = name.strip()
+        if package.startswith('freeswitch_exporter'):
+            if not name.startswith('   '):
+                own += int(cumulative)
+        elif '.' not in package and package not in sys.stdlib_module_names:
+            packages[package] = int(cumulative)
+    return own, packages
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"entry point":>12} {"wall ms":>8} {"import ms":>10}  '
+          f'slowest packages')
+    for name, (statement, forbidden) in ENTRY_POINTS.items():
+        walls = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            loaded = subprocess.run(
+                [sys.executable, '-c', statement + CHECK.format(forbidden)],
+                check=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+            walls.append(time.perf_counter() - start)
+
+        (own, packages) = importtime(statement)
+        slowest = sorted(((value, package)
+                          for package, value in packages.items()),
+                         reverse=True)[:3]
+        print(f'{name:>12} {statistics.median(walls) * 1000:>8.1f} '
+              f'{own / 1000:>10.1f}  ' +
+              ', '.join(f'{package} {value / 1000:.1f}'
+                        for value, package in slowest))
+
+        if loaded:
+            print(f'{name} must not import: {loaded}')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
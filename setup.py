@@ -27,6 +27,10 @@ setup(
         "requests",
         'Werkzeug',
     ],
+    extras_require={
+        'snappy': ['python-snappy'],
+        'zstd': ['zstandard'],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Information Technology",
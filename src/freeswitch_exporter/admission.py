@@ -0,0 +1,141 @@
+"""
+Admission control protecting FreeSWITCH targets from overload.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+
+class AdmissionError(Exception):
+    """
+    Error thrown if a collection is not admitted. Carries the HTTP status
+    the request is answered with.
+    """
+
+    def __init__(self, message, status, reason):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class AdmissionBusyError(AdmissionError):
+    """
+    Error thrown if all sessions are held and the caller does not wait.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, 429, 'busy')
+
+
+class TokenBucket():
+    """
+    Token bucket refilled with rate tokens per second, holding up to burst
+    tokens. Must only be used from one event loop.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self, count=1) -> float:
+        """
+        Takes count tokens and returns the number of seconds until they are
+        covered. The bucket goes into debt, later callers wait longer.
+        """
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens +
+                           (now - self._updated) * self._rate)
+        self._updated = now
+        self._tokens -= count
+        return max(0., -self._tokens / self._rate)
+
+    async def acquire(self, count=1) -> float:
+        """
+        Takes count tokens, waiting until they are available. Returns the
+        number of seconds waited.
+        """
+        delay = self.reserve(count)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class Admission():
+    """
+    Admission control of one target. At most max_sessions collections hold
+    an ESL session at a time, up to max_queue more wait for one. Further
+    collections are rejected right away (429), waiting ones once the scrape
+    deadline or queue_timeout expires (503). ESL commands are rate limited
+    with a token bucket if commands_per_second is set.
+
+    Must only be used from the event loop of the target.
+    """
+
+    def __init__(self, config, stats=NULL_STATS):
+        config = config if isinstance(config, dict) else {}
+        self._stats = stats
+        self._max_sessions = config.get('max_sessions', 1)
+        self._max_queue = config.get('max_queue', 4)
+        self._queue_timeout = config.get('queue_timeout')
+        self._slots = None
+        self._waiting = 0
+
+        self.commands = None
+        if config.get('commands_per_second'):
+            rate = float(config['commands_per_second'])
+            self.commands = TokenBucket(
+                rate, float(config.get('command_burst', rate)))
+
+    @asynccontextmanager
+    async def session(self, deadline, wait=True):
+        """
+        Holds one of the sessions of the target for the duration of the
+        body. Raises AdmissionError if none becomes available in time.
+
+        If wait is False, raises AdmissionBusyError instead of waiting when
+        all sessions are held. The attempt is not counted as rejected.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_sessions)
+
+        if not wait and self._slots.locked():
+            raise AdmissionBusyError(f"All {self._max_sessions} sessions of "
+                                     f"the target are held")
+
+        if not self._slots.locked():
+            # Does not suspend, hence no other collection can interfere.
+            await self._slots.acquire()
+        else:
+            await self._wait(deadline)
+
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _wait(self, deadline):
+        if self._waiting >= self._max_queue:
+            self._stats.rejected('queue_full')
+            raise AdmissionError("Too many collections of the target in "
+                                 "progress", 429, 'queue_full')
+
+        timeouts = [timeout for timeout in (self._queue_timeout,
+                                            deadline.remaining())
+                    if timeout is not None]
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(),
+                                   min(timeouts) if timeouts else None)
+        except asyncio.TimeoutError as error:
+            self._stats.rejected('queue_timeout')
+            raise AdmissionError("Timed out waiting for a session to the "
+                                 "target", 503, 'queue_timeout') from error
+        finally:
+            self._waiting -= 1
@@ -0,0 +1,166 @@
+"""
+Aggregation of per-channel statistics by low cardinality labels.
+"""
+
+import bisect
+import collections
+
+from typing import List, Optional
+
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+
+# Channel variables providing the values of the supported labels.
+LABEL_VARIABLES = {
+    'profile': 'variable_sofia_profile_name',
+    'gateway': 'variable_sip_gateway_name',
+    'codec': 'variable_rtp_use_codec_name',
+    'direction': 'Call-Direction',
+}
+
+# Labels used unless configured otherwise. Every further label multiplies the
+# number of series, profile and gateway are opt-in.
+DEFAULT_LABELS = ['direction', 'codec']
+
+_SECONDS_BUCKETS = (.001, .005, .01, .02, .05, .1, .2, .5)
+_RATE_BUCKETS = (.1, .5, 1, 2, 5, 10, 20, 50)
+
+# Channel variables folded into histograms. All others are summed up.
+HISTOGRAM_BUCKETS = {
+    'variable_rtp_audio_in_mos': (1, 2, 3, 3.5, 4, 4.2, 4.4, 4.5),
+    'variable_rtp_audio_in_quality_percentage':
+        (50, 70, 80, 90, 95, 98, 99, 100),
+    'variable_rtp_audio_in_jitter_loss_rate': _RATE_BUCKETS,
+    'variable_rtp_audio_in_jitter_burst_rate': _RATE_BUCKETS,
+    'variable_rtp_audio_in_jitter_min_variance': _SECONDS_BUCKETS,
+    'variable_rtp_audio_in_jitter_max_variance': _SECONDS_BUCKETS,
+    'variable_rtp_audio_in_mean_interval': (.01, .02, .03, .04, .06, .1),
+    'variable_rtp_audio_in_largest_jb_size':
+        (1024, 4096, 16384, 65536, 262144),
+}
+
+
+def label_value(label, row, channelvars) -> str:
+    """
+    Returns the value of an aggregation label for a call, given its row and
+    channel variables.
+    """
+    value = channelvars.get(LABEL_VARIABLES[label])
+    if value is None and label == 'profile':
+        # Fall back to the profile part of sofia/<profile>/<destination>.
+        parts = row.get('name', '').split('/')
+        value = parts[1] if len(parts) > 2 else None
+    return value or ''
+
+
+def aggregation_labels(config) -> Optional[List[str]]:
+    """
+    Returns the labels configured in the aggregation section of a module or
+    None if aggregation is disabled. Raises ValueError on unknown labels.
+    """
+    if not config:
+        return None
+
+    if config is True:
+        return list(DEFAULT_LABELS)
+
+    labels = list(config.get('labels', DEFAULT_LABELS))
+    for label in labels:
+        if label not in LABEL_VARIABLES:
+            raise ValueError(f"Unknown aggregation label: {label}")
+
+    return labels
+
+
+class ChannelAggregator():
+    """
+    Folds the channel variables of every call into sums and histograms keyed
+    by the configured labels instead of the call uuid.
+    """
+
+    def __init__(self, labels: List[str], metrics, milliseconds,
+                 count=True):
+        self._labels = labels
+        self._metrics = metrics
+        self._milliseconds = milliseconds
+        self._count = count
+        self._channels = collections.Counter()
+        self._values = collections.defaultdict(dict)
+
+    @property
+    def variables(self) -> List[str]:
+        """
+        Returns the channel variables required to compute the labels.
+        """
+        return [LABEL_VARIABLES[label] for label in self._labels]
+
+    def add(self, row, channelvars):
+        """
+        Adds the channel variables of one call.
+        """
+        labelvalues = tuple(label_value(label, row, channelvars)
+                            for label in self._labels)
+        self._channels[labelvalues] += 1
+
+        for key, value in channelvars.items():
+            if key not in self._metrics:
+                continue
+
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+
+            if key in self._milliseconds:
+                value /= 1000.
+
+            buckets = HISTOGRAM_BUCKETS.get(key)
+            values = self._values[key]
+            if buckets is None:
+                values[labelvalues] = values.get(labelvalues, 0.) + value
+            else:
+                if labelvalues not in values:
+                    values[labelvalues] = [[0] * (len(buckets) + 1), 0.]
+                histogram = values[labelvalues]
+                histogram[0][bisect.bisect_left(buckets, value)] += 1
+                histogram[1] += value
+
+    def families(self):
+        """
+        Returns the aggregated metric families.
+        """
+        result = []
+        if self._count:
+            family = GaugeMetricFamily(
+                'rtp_channels', 'Number of channels.', labels=self._labels)
+            for labelvalues, count in sorted(self._channels.items()):
+                family.add_metric(labelvalues, count)
+            result.append(family)
+
+        for key, metric in self._metrics.items():
+            values = self._values.get(key, {})
+            buckets = HISTOGRAM_BUCKETS.get(key)
+            if buckets is None:
+                family = GaugeMetricFamily(
+                    metric.name, metric.documentation, labels=self._labels)
+                for labelvalues, total in sorted(values.items()):
+                    family.add_metric(labelvalues, total)
+            else:
+                family = HistogramMetricFamily(
+                    metric.name, metric.documentation, labels=self._labels)
+                for labelvalues, (counts, total) in sorted(values.items()):
+                    family.add_metric(labelvalues,
+                                      self._buckets(buckets, counts), total)
+            result.append(family)
+
+        return result
+
+    @staticmethod
+    def _buckets(bounds, counts):
+        cumulative = 0
+        result = []
+        for bound, count in zip(list(bounds) + [float('inf')], counts):
+            cumulative += count
+            result.append((floatToGoString(bound), cumulative))
+        return result
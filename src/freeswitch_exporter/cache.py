@@ -0,0 +1,111 @@
+"""
+Caches for collection results which change slowly or not at all.
+"""
+# pylint: disable=too-few-public-methods
+
+import collections
+import time
+
+from typing import Optional
+
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+# Channel variables which do not change over the lifetime of a call.
+IDENTITY_VARIABLES = [
+    'variable_sip_user_agent',
+    'variable_sofia_profile_name',
+    'variable_sip_gateway_name',
+    'Call-Direction',
+]
+
+
+class TTLCache():
+    """
+    Mapping whose entries expire ttl seconds after they were stored, or
+    never if ttl is None. Holds at most max_entries, the least recently used
+    ones are evicted first.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries=10000):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the value stored for key or None if missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        (value, expires) = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if full.
+        """
+        expires = None
+        if self._ttl is not None:
+            expires = time.monotonic() + self._ttl
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def retain(self, keys):
+        """
+        Drops all entries except the ones for the given keys.
+        """
+        keys = set(keys)
+        for key in [key for key in self._entries if key not in keys]:
+            del self._entries[key]
+
+
+class CollectionCache():
+    """
+    Caches of one target by command class: metric families collected from
+    the Sofia commands are kept for the number of seconds configured for the
+    class, identity variables of channels until the channel is gone.
+
+    `status` is not cached. Its ready status and session counts have to be
+    current, hence it would be sent on every scrape anyway, and it is a
+    single small reply served from memory.
+    """
+
+    def __init__(self, config, stats=NULL_STATS):
+        config = config if isinstance(config, dict) else {}
+        self._stats = stats
+        self._results = {name: TTLCache(config[name], 1)
+                         for name in ('sofia',) if config.get(name)}
+        self.channels = None
+        if config.get('channels', False):
+            self.channels = TTLCache(None, config.get('max_channels', 10000))
+
+    async def families(self, name, collect):
+        """
+        Returns the cached families of the named command class if fresh.
+        Otherwise awaits collect() and caches the families it returns.
+        """
+        cache = self._results.get(name)
+        if cache is None:
+            return await collect()
+
+        families = cache.get(name)
+        if families is not None:
+            self._stats.cache_hit(name)
+            return families
+
+        self._stats.cache_miss(name)
+        families = list(await collect())
+        cache.put(name, families)
+        return families
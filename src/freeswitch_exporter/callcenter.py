@@ -0,0 +1,183 @@
+"""
+Collection of mod_callcenter queue and agent metrics.
+"""
+# pylint: disable=too-few-public-methods
+
+import io
+import logging
+import time
+
+from typing import Dict, Iterator
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from freeswitch_exporter.esl import ESL
+
+# Member states, see cc_member_state_t in mod_callcenter.c.
+MEMBER_STATES = ['Unknown', 'Waiting', 'Trying', 'Answered', 'Abandoned']
+
+# Member states counted as waiting for an agent.
+WAITING_STATES = ('Waiting', 'Trying')
+
+# Agent status and state, see cc_agent_status_t and cc_agent_state_t.
+AGENT_STATUSES = ['Logged Out', 'Available', 'Available (On Demand)',
+                  'On Break']
+AGENT_STATES = ['Idle', 'Waiting', 'Receiving', 'In a queue call']
+
+# Cumulative call counters of queues by queue list column, only listed by
+# recent versions of mod_callcenter.
+QUEUE_CALLS = {
+    'calls_answered': ('freeswitch_callcenter_queue_calls_answered_total',
+                       'Calls answered by agents of the queue'),
+    'calls_abandoned': ('freeswitch_callcenter_queue_calls_abandoned_total',
+                        'Calls abandoned while waiting in the queue'),
+}
+
+
+def iter_rows(document: bytes) -> Iterator[Dict[str, str]]:
+    """
+    Yields the rows of a pipe separated callcenter_config list as dicts
+    keyed by the column names of the header line.
+
+    The document is split lazily line by line. Hence memory use does not
+    depend on the number of rows. Rows not matching the header are skipped,
+    the trailing +OK line ends the list.
+    """
+    columns = None
+    for line in io.BytesIO(document):
+        line = line.rstrip(b'\r\n')
+        if not line:
+            continue
+        if line.startswith(b'+OK'):
+            return
+        fields = line.decode(errors='replace').split('|')
+        if columns is None:
+            columns = fields
+        elif len(fields) == len(columns):
+            yield dict(zip(columns, fields))
+
+
+class ESLCallcenterInfo():
+    """
+    Callcenter async collector. Queues, queue members and agents are
+    fetched with one bulk list command each, pipelined on the connection.
+
+    Members are aggregated by queue and agents by status and state, hence
+    only max_queues bounds the number of series. Members of queues beyond
+    it are left out.
+    """
+
+    def __init__(self, esl: ESL, config=None):
+        config = config if isinstance(config, dict) else {}
+        self._esl = esl
+        self._agents = config.get('agents', True)
+        self._max_queues = config.get('max_queues', 100)
+
+    async def collect(self):
+        """
+        Collects callcenter metrics.
+        """
+        commands = ['api callcenter_config queue list',
+                    'api callcenter_config member list']
+        if self._agents:
+            commands.append('api callcenter_config agent list')
+
+        bodies = [body for (_, body)
+                  in await self._esl.send_all(commands, raw=True)]
+
+        if bodies[0].startswith(b'-ERR'):
+            logging.getLogger(__name__).debug(
+                "Callcenter status not available: %s",
+                bodies[0].decode().strip())
+            return []
+
+        families = self._collect_queues(bodies[0], bodies[1])
+        if self._agents:
+            families.extend(self._collect_agents(bodies[2]))
+        return families
+
+    def _collect_queues(self, queue_list, member_list):
+        queue_metrics = {
+            key: CounterMetricFamily(name, documentation, labels=['queue'])
+            for key, (name, documentation) in QUEUE_CALLS.items()
+        }
+        skipped_metric = GaugeMetricFamily(
+            'freeswitch_callcenter_queues_skipped',
+            'Number of callcenter queues not exported due to max_queues')
+
+        # queue -> [members by state, longest wait, total wait]
+        queues = {}
+        skipped = 0
+        for row in iter_rows(queue_list):
+            if len(queues) >= self._max_queues:
+                skipped += 1
+                continue
+            name = row.get('name', '')
+            queues[name] = [dict.fromkeys(MEMBER_STATES, 0), 0., 0.]
+            for key, metric in queue_metrics.items():
+                try:
+                    metric.add_metric([name], float(row[key]))
+                except (KeyError, ValueError):
+                    continue
+        skipped_metric.add_metric([], skipped)
+
+        now = time.time()
+        for row in iter_rows(member_list):
+            queue = queues.get(row.get('queue'))
+            if queue is None:
+                continue
+            state = row.get('state', 'Unknown')
+            queue[0][state] = queue[0].get(state, 0) + 1
+            if state not in WAITING_STATES:
+                continue
+            try:
+                wait = max(0., now - float(row['joined_epoch']))
+            except (KeyError, ValueError):
+                continue
+            queue[1] = max(queue[1], wait)
+            queue[2] += wait
+
+        return _queue_families(queues) + [
+            metric for metric in queue_metrics.values() if metric.samples
+        ] + [skipped_metric]
+
+    @staticmethod
+    def _collect_agents(agent_list):
+        agents_metric = GaugeMetricFamily(
+            'freeswitch_callcenter_agents',
+            'Number of callcenter agents by status and state',
+            labels=['status', 'state'])
+
+        counts = {(status, state): 0
+                  for status in AGENT_STATUSES for state in AGENT_STATES}
+        for row in iter_rows(agent_list):
+            key = (row.get('status', ''), row.get('state', ''))
+            counts[key] = counts.get(key, 0) + 1
+        for labelvalues, count in counts.items():
+            agents_metric.add_metric(list(labelvalues), count)
+
+        return [agents_metric]
+
+
+def _queue_families(queues):
+    members_metric = GaugeMetricFamily(
+        'freeswitch_callcenter_queue_members',
+        'Number of members of the callcenter queue by state',
+        labels=['queue', 'state'])
+    wait_max_metric = GaugeMetricFamily(
+        'freeswitch_callcenter_queue_wait_seconds_max',
+        'Longest wait of the members waiting in the callcenter queue',
+        labels=['queue'])
+    wait_mean_metric = GaugeMetricFamily(
+        'freeswitch_callcenter_queue_wait_seconds_mean',
+        'Mean wait of the members waiting in the callcenter queue',
+        labels=['queue'])
+
+    for name, (states, longest, total) in queues.items():
+        for state, count in states.items():
+            members_metric.add_metric([name, state], count)
+        waiting = sum(states.get(state, 0) for state in WAITING_STATES)
+        wait_max_metric.add_metric([name], longest)
+        wait_mean_metric.add_metric([name], total / waiting if waiting else 0.)
+
+    return [members_metric, wait_max_metric, wait_mean_metric]
@@ -0,0 +1,177 @@
+"""
+Event driven table of live FreeSWITCH channels.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import json
+import logging
+
+from freeswitch_exporter.esl import ESL, ESLError
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+
+CHANNEL_EVENTS = [
+    'CHANNEL_CREATE',
+    'CHANNEL_ANSWER',
+    'CHANNEL_BRIDGE',
+    'CHANNEL_UNBRIDGE',
+    'CHANNEL_UUID',
+    'CHANNEL_HANGUP_COMPLETE',
+    'CHANNEL_DESTROY',
+    'BACKGROUND_JOB',
+]
+
+
+class ChannelTable():
+    """
+    Live channels indexed by uuid.
+
+    Rows have the same shape as the ones returned by `show calls as json`,
+    i.e., only channels which are the leading leg of their call are listed.
+    They carry the user agent as well once it is known, from channel events
+    or from a dump of the channel, see learn(). `show channels` does not
+    list it, channels seeded from it start without.
+    """
+
+    def __init__(self):
+        self._channels = {}
+        self._gone = set()
+        self._seed_job = None
+        self.synced = False
+
+    def rows(self):
+        """
+        Returns a list of rows, one for each call.
+        """
+        return [channel for channel in self._channels.values()
+                if channel['call_uuid'] == channel['uuid']]
+
+    def __len__(self):
+        return len(self._channels)
+
+    def reset(self, seed_job=None):
+        """
+        Forget all channels, e.g., after the subscription was interrupted. The
+        table is synced again once the result of seed_job is applied.
+        """
+        self._channels.clear()
+        self._gone.clear()
+        self._seed_job = seed_job
+        self.synced = False
+
+    def apply(self, event):
+        """
+        Updates the table from a FreeSWITCH event.
+        """
+        name = event.get('Event-Name')
+        if name == 'BACKGROUND_JOB':
+            if event.get('Job-UUID') == self._seed_job:
+                self._seed(event.get('_body', ''))
+            return
+
+        uuid = event.get('Unique-ID')
+        if not uuid:
+            return
+
+        if name in ('CHANNEL_HANGUP_COMPLETE', 'CHANNEL_DESTROY'):
+            self._channels.pop(uuid, None)
+            if not self.synced:
+                self._gone.add(uuid)
+            return
+
+        if name == 'CHANNEL_UUID':
+            self._channels.pop(event.get('Old-Unique-ID'), None)
+
+        channel = self._channels.setdefault(uuid, {'uuid': uuid})
+        channel['name'] = event.get('Channel-Name', channel.get('name', ''))
+        channel['call_uuid'] = event.get('Channel-Call-UUID', uuid)
+        if event.get('variable_sip_user_agent'):
+            channel['user_agent'] = event['variable_sip_user_agent']
+
+    def learn(self, uuid, user_agent):
+        """
+        Records the user agent of a channel not carried by its events so
+        far, e.g., taken from a dump.
+        """
+        channel = self._channels.get(uuid)
+        if channel is not None and user_agent:
+            channel.setdefault('user_agent', user_agent)
+
+    def _seed(self, body):
+        if body.startswith('-ERR'):
+            raise ESLError(f"Failed to list channels: {body.strip()}")
+
+        for row in json.loads(body).get('rows', None) or []:
+            uuid = row['uuid']
+            if uuid in self._channels or uuid in self._gone:
+                continue
+            self._channels[uuid] = {
+                'uuid': uuid,
+                'name': row.get('name', ''),
+                'call_uuid': row.get('call_uuid') or uuid,
+            }
+
+        self._gone.clear()
+        self._seed_job = None
+        self.synced = True
+
+
+class ChannelSubscriber():
+    """
+    Keeps a ChannelTable up to date over a dedicated event socket connection.
+    Passes hangup events on to retained counters, if any.
+    """
+
+    def __init__(self, host, config, stats=NULL_STATS, retained=None):
+        self._host = host
+        self._port = config.get('port', 8021)
+        self._password = config.get('password', 'ClueCon')
+        self._stats = stats
+        self._retained = retained
+        self._log = logging.getLogger(__name__)
+        self.table = ChannelTable()
+
+    async def run(self):
+        """
+        Subscribes to channel events and reconnects with backoff whenever
+        the connection is lost. Runs until cancelled.
+        """
+        backoff = 1
+        while True:
+            try:
+                await self._subscribe()
+                backoff = 1
+            except (ESLError, OSError, asyncio.IncompleteReadError,
+                    ValueError) as error:
+                self._log.warning("Channel event subscription to %s:%s "
+                                  "failed: %s", self._host, self._port, error)
+                backoff = min(backoff * 2, 60)
+            except Exception:  # pylint: disable=broad-except
+                # Malformed events or replies must not end the subscription.
+                # Cancellation is not an Exception and still ends it.
+                self._log.exception("Channel event subscription to %s:%s "
+                                    "failed", self._host, self._port)
+                backoff = min(backoff * 2, 60)
+            finally:
+                self.table.reset()
+
+            await asyncio.sleep(backoff)
+
+    async def _subscribe(self):
+        reader, writer = await asyncio.open_connection(self._host, self._port)
+        try:
+            esl = ESL(reader, writer, self._stats)
+            await esl.initialize()
+            if not await esl.login(self._password):
+                raise ESLError("Login failed")
+
+            await esl.subscribe(CHANNEL_EVENTS)
+            self.table.reset(await esl.bgapi('show channels as json'))
+            async for event in esl.events():
+                self.table.apply(event)
+                if self._retained is not None:
+                    self._retained.hangup(event)
+        finally:
+            writer.close()
+            await writer.wait_closed()
@@ -2,23 +2,136 @@
 FreeSWITCH exporter for the Prometheus monitoring system.
 """
 
+# Modules are imported by the subcommands needing them. Hence oneshot
+# collections started from cron or systemd timers neither load the HTTP
+# server nor YAML unless a configuration file is given.
+# pylint: disable=import-outside-toplevel
+
+import asyncio
+import logging
 import sys
 from argparse import ArgumentParser
-from freeswitch_exporter.http import start_http_server
+
 
 def main(args=None):
     """
     Main entry point.
     """
 
-    parser = ArgumentParser()
+    argv = sys.argv[1:] if args is None else args
+    if argv[:1] == ['textfile']:
+        return textfile(argv[1:])
+    if argv[:1] == ['push']:
+        return push(argv[1:])
+
+    parser = ArgumentParser(
+        epilog='Run "%(prog)s textfile -h" in order to write node_exporter '
+               'textfiles, or "%(prog)s push -h" in order to push to a '
+               'remote write endpoint, instead of serving HTTP.')
     parser.add_argument('config', nargs='?', default='esl.yml',
                         help='Path to configuration file (esl.yml)')
     parser.add_argument('port', nargs='?', type=int, default='9724',
                         help='Port on which the exporter is listening (9724)')
     parser.add_argument('address', nargs='?', default='',
                         help='Address to which the exporter will bind')
+    parser.add_argument('--server', choices=['werkzeug', 'asyncio'],
+                        default='werkzeug',
+                        help='HTTP server implementation (werkzeug)')
+
+    params = parser.parse_args(argv)
+
+    from freeswitch_exporter.http import start_http_server
+    start_http_server(params.config, params.port, params.address,
+                      params.server)
+    return 0
+
+
+def textfile(args):
+    """
+    Entry point of the textfile subcommand.
+    """
+
+    parser = ArgumentParser(
+        prog='freeswitch_exporter textfile',
+        description='Collect a target once, or every interval seconds, and '
+                    'write the result to a node_exporter textfile collector '
+                    'file.')
+    parser.add_argument('output',
+                        help='Path of the file to write, ending with .prom')
+    _add_target_arguments(parser)
+    parser.add_argument('--interval', type=float,
+                        help='Keep rewriting the file every interval seconds')
+
+    params = parser.parse_args(args)
+    config = _load_config(parser, params)
+
+    from freeswitch_exporter.textfile import write_textfile
+    try:
+        asyncio.run(write_textfile(config, params.target, params.output,
+                                   params.module, params.interval))
+    except Exception:  # pylint: disable=broad-except
+        logging.getLogger(__name__).exception(
+            "Exception thrown while collecting %s", params.target)
+        return 1
+    return 0
 
-    params = parser.parse_args(args if args is None else sys.argv[1:])
 
-    start_http_server(params.config, params.port, params.address)
+def push(args):
+    """
+    Entry point of the push subcommand.
+    """
+
+    parser = ArgumentParser(
+        prog='freeswitch_exporter push',
+        description='Collect a target every interval seconds and send the '
+                    'samples to a Prometheus remote write endpoint.')
+    parser.add_argument('url',
+                        help='URL of the remote write endpoint, e.g., '
+                             'http://prometheus:9090/api/v1/write')
+    _add_target_arguments(parser)
+    parser.add_argument('--interval', type=float, default=15,
+                        help='Seconds between collections (15)')
+
+    params = parser.parse_args(args)
+    config = _load_config(parser, params)
+
+    from freeswitch_exporter.remote_write import push as push_target
+    try:
+        asyncio.run(push_target(config, params.target, params.url,
+                                params.module, params.interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _add_target_arguments(parser):
+    parser.add_argument('--config',
+                        help='Path to configuration file, e.g., esl.yml')
+    parser.add_argument('--module', default='default',
+                        help='Module of the configuration file (default)')
+    parser.add_argument('--target', default='localhost',
+                        help='FreeSWITCH host to collect (localhost)')
+    parser.add_argument('--port', type=int,
+                        help='Event socket port, overrides the module')
+    parser.add_argument('--password',
+                        help='Event socket password, overrides the module')
+
+
+def _load_config(parser, params):
+    """
+    Returns the configuration of the selected module, if any, with the
+    event socket options given on the command line.
+    """
+    config = {}
+    if params.config is not None:
+        import yaml
+        with open(params.config, encoding='utf-8') as handle:
+            modules = yaml.safe_load(handle)
+        if params.module not in modules:
+            parser.error(f"Module '{params.module}' not found in config")
+        config = dict(modules[params.module])
+    if params.port is not None:
+        config['port'] = params.port
+    if params.password is not None:
+        config['password'] = params.password
+    return config
@@ -4,17 +4,55 @@ Prometheus collecters for FreeSWITCH.
 # pylint: disable=too-few-public-methods
 
 import asyncio
+import collections
+import fnmatch
 import itertools
 import json
 import logging
+import time
+
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from prometheus_client.core import GaugeMetricFamily, Metric, \
+    SummaryMetricFamily
+from prometheus_client.utils import floatToGoString
+
+from freeswitch_exporter.admission import AdmissionBusyError
+from freeswitch_exporter.aggregate import ChannelAggregator, \
+    aggregation_labels
+from freeswitch_exporter.cache import IDENTITY_VARIABLES
+from freeswitch_exporter.callcenter import ESLCallcenterInfo
+from freeswitch_exporter.conference import ESLConferenceInfo
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.esl import ESL, discard
+from freeswitch_exporter.exposition import GaugeDefinition, iter_render, \
+    render
+from freeswitch_exporter.extract import extract_json_keys
+from freeswitch_exporter.instrumentation import NULL_STATS
+from freeswitch_exporter.pool import ESLPoolBusyError
+from freeswitch_exporter.sampling import row_variables
+from freeswitch_exporter.sofia import ESLSofiaInfo
+
+
+class MetricFilter():
+    """
+    Decides which metric families are exported, based on lists of
+    shell-style patterns matched against family names.
+    """
 
-from contextlib import asynccontextmanager
+    def __init__(self, config=None):
+        config = config or {}
+        self._include = config.get('include')
+        self._exclude = config.get('exclude') or []
 
-from asgiref.sync import async_to_sync
-from prometheus_client import CollectorRegistry, generate_latest
-from prometheus_client.core import GaugeMetricFamily
+    def __call__(self, name: str) -> bool:
+        if self._include is not None and not any(
+                fnmatch.fnmatchcase(name, pattern)
+                for pattern in self._include):
+            return False
 
-from freeswitch_exporter.esl import ESL
+        return not any(fnmatch.fnmatchcase(name, pattern)
+                       for pattern in self._exclude)
 
 
 class ESLProcessInfo():
@@ -31,7 +69,7 @@ class ESLProcessInfo():
         """
 
         (_, result) = await self._esl.send(
-            'api json {"command" : "status", "data" : ""}')
+            'api json {"command" : "status", "data" : ""}', raw=True)
         response = json.loads(result).get('response', {})
 
         process_info_metric = GaugeMetricFamily(
@@ -77,180 +115,541 @@ class ESLProcessInfo():
         ], process_session_metrics)
 
 
+# Per-channel gauges by uuid_dump channel variable.
+CHANNEL_METRICS = {
+    'variable_rtp_audio_in_raw_bytes': GaugeDefinition(
+        'rtp_audio_in_raw_bytes_total',
+        'Total number of bytes received via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_raw_bytes': GaugeDefinition(
+        'rtp_audio_out_raw_bytes_total',
+        'Total number of bytes sent via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_media_bytes': GaugeDefinition(
+        'rtp_audio_in_media_bytes_total',
+        'Total number of media bytes received via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_media_bytes': GaugeDefinition(
+        'rtp_audio_out_media_bytes_total',
+        'Total number of media bytes sent via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_packet_count': GaugeDefinition(
+        'rtp_audio_in_packets_total',
+        'Total number of packets received via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_packet_count': GaugeDefinition(
+        'rtp_audio_out_packets_total',
+        'Total number of packets sent via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_media_packet_count': GaugeDefinition(
+        'rtp_audio_in_media_packets_total',
+        'Total number of media packets received via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_media_packet_count': GaugeDefinition(
+        'rtp_audio_out_media_packets_total',
+        'Total number of media packets sent via this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_skip_packet_count': GaugeDefinition(
+        'rtp_audio_in_skip_packets_total',
+        'Total number of inbound packets discarded by this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_skip_packet_count': GaugeDefinition(
+        'rtp_audio_out_skip_packets_total',
+        'Total number of outbound packets discarded by this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_jitter_packet_count': GaugeDefinition(
+        'rtp_audio_in_jitter_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_dtmf_packet_count': GaugeDefinition(
+        'rtp_audio_in_dtmf_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_dtmf_packet_count': GaugeDefinition(
+        'rtp_audio_out_dtmf_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_cng_packet_count': GaugeDefinition(
+        'rtp_audio_in_cng_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_out_cng_packet_count': GaugeDefinition(
+        'rtp_audio_out_cng_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_flush_packet_count': GaugeDefinition(
+        'rtp_audio_in_flush_packets_total',
+        'Total number of ? packets in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_largest_jb_size': GaugeDefinition(
+        'rtp_audio_in_jitter_buffer_bytes_max',
+        'Largest jitterbuffer size in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_in_jitter_min_variance': GaugeDefinition(
+        'rtp_audio_in_jitter_seconds_min',
+        'Minimal jitter in seconds.',
+        labels=['id']),
+    'variable_rtp_audio_in_jitter_max_variance': GaugeDefinition(
+        'rtp_audio_in_jitter_seconds_max',
+        'Maximum jitter in seconds.',
+        labels=['id']),
+    'variable_rtp_audio_in_jitter_loss_rate': GaugeDefinition(
+        'rtp_audio_in_jitter_loss_rate',
+        'Ratio of lost packets due to inbound jitter.',
+        labels=['id']),
+    'variable_rtp_audio_in_jitter_burst_rate': GaugeDefinition(
+        'rtp_audio_in_jitter_burst_rate',
+        'Ratio of packet bursts due to inbound jitter.',
+        labels=['id']),
+    'variable_rtp_audio_in_mean_interval': GaugeDefinition(
+        'rtp_audio_in_mean_interval_seconds',
+        'Mean interval in seconds of inbound packets',
+        labels=['id']),
+    'variable_rtp_audio_in_flaw_total': GaugeDefinition(
+        'rtp_audio_in_flaw_total',
+        'Total number of flaws detected in the channel',
+        labels=['id']),
+    'variable_rtp_audio_in_quality_percentage': GaugeDefinition(
+        'rtp_audio_in_quality_percent',
+        'Audio quality in percent',
+        labels=['id']),
+    'variable_rtp_audio_in_mos': GaugeDefinition(
+        'rtp_audio_in_quality_mos',
+        'Audio quality as Mean Opinion Score, (between 1 and 5)',
+        labels=['id']),
+    'variable_rtp_audio_rtcp_octet_count': GaugeDefinition(
+        'rtcp_audio_bytes_total',
+        'Total number of rtcp bytes in this channel.',
+        labels=['id']),
+    'variable_rtp_audio_rtcp_packet_count': GaugeDefinition(
+        'rtcp_audio_packets_total',
+        'Total number of rtcp packets in this channel.',
+        labels=['id']),
+}
+
+CHANNEL_INFO = GaugeDefinition(
+    'rtp_channel_info',
+    'FreeSWITCH RTP channel info',
+    labels=['id', 'name', 'user_agent'])
+
+# Quantiles of the channel stats age summary.
+AGE_QUANTILES = (.5, .9, .99)
+
+# Seconds granted to the status command even if the scrape deadline leaves
+# less. Without it there would be no freeswitch_up at all.
+STATUS_MIN_TIMEOUT = 1.
+
+MILLISECOND_METRICS = [
+    'variable_rtp_audio_in_jitter_min_variance',
+    'variable_rtp_audio_in_jitter_max_variance',
+    'variable_rtp_audio_in_mean_interval',
+]
+
+
 class ESLChannelInfo():
     """
     Channel info async collector
     """
 
-    def __init__(self, esl: ESL):
-        self._esl = esl
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, esl, config=None, target=None, deadline=None):
+        config = config or {}
+        # Calls are listed on the first connection and dumped on all of them.
+        self._shards = list(esl) if isinstance(esl, (list, tuple)) else [esl]
+        self._esl = self._shards[0]
+        self._deadline = deadline or Deadline()
+        self._window = max(1, config.get('pipeline', 1))
+        self._channels = None
+        self._retained = None
+        self._identity = None
+        self._sampler = None
+        if target is not None:
+            self._channels = target.channels
+            self._retained = target.retained
+            self._sampler = target.sampler
+            if target.cache is not None:
+                self._identity = target.cache.channels
+        self._enabled = MetricFilter(config.get('channel_metrics'))
+        self._aggregation = aggregation_labels(config.get('aggregation'))
         self._log = logging.getLogger(__name__)
+        self._parse_time = 0.
+        self._listed = None
+        self._stale = {}
+        self._ages = []
+        self.partial = False
+        self.skipped = 0
+
+    async def _dump(self, rows, media_stats=True):
+        """
+        Refreshes media stats (unless media_stats is False) and dumps channel
+        variables for every row, see _dump_shard(). With several connections
+        rows are dealt to them round robin and the shards are dumped
+        concurrently. Tuples (row, uuid_dump result) are yielded as they
+        arrive then.
+        """
+        if len(self._shards) == 1:
+            async for result in self._dump_shard(self._esl, rows,
+                                                 media_stats):
+                yield result
+            return
+
+        # Shards only run while the consumer waits for an empty queue, which
+        # keeps it short.
+        queue = asyncio.Queue()
+
+        async def dump(esl, shard):
+            try:
+                async for result in self._dump_shard(esl, shard, media_stats):
+                    queue.put_nowait(result)
+            finally:
+                queue.put_nowait(None)
+
+        count = len(self._shards)
+        tasks = [asyncio.create_task(dump(esl, rows[index::count]))
+                 for index, esl in enumerate(self._shards)]
+        try:
+            while count:
+                result = await queue.get()
+                if result is None:
+                    count -= 1
+                else:
+                    yield result
+            # Raise errors of failed shards.
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _dump_shard(self, esl, rows, media_stats):
+        """
+        Refreshes media stats and dumps channel variables of rows on one
+        connection. Keeps up to window channels in flight on the connection
+        and yields tuples (row, uuid_dump result) in order. Stops early once
+        the deadline expired.
+        """
+        rows = collections.deque(rows)
+        in_flight = collections.deque()
+        try:
+            while rows or in_flight:
+                while rows and len(in_flight) < self._window \
+                        and not self._deadline.expired():
+                    row = rows.popleft()
+                    stats = None
+                    if media_stats:
+                        stats = await esl.submit(
+                            f'api uuid_set_media_stats {row["uuid"]}')
+                    try:
+                        dump = await esl.submit(
+                            f'api uuid_dump {row["uuid"]} json', raw=True)
+                    except BaseException:
+                        discard(stats)
+                        raise
+                    in_flight.append((row, stats, dump))
+
+                if not in_flight:
+                    break
+
+                yield await self._deadline.wait_for(
+                    self._complete(in_flight.popleft()))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Responses to abandoned commands are read and dropped.
+            for (_, stats, dump) in in_flight:
+                discard(stats)
+                discard(dump)
+
+    async def _channelvars(self, rows, keys, media_stats):
+        """
+        Yields tuples (row, channel variables) with the given keys for every
+        row, the variables are None if FreeSWITCH answered with -ERR. Channels
+        not due for a refresh are served from the sampler. Identity variables
+        of known channels are taken from the cache and variables provided by
+        the listing from the row, e.g., the user agent recorded by the
+        channel table. Channels are not dumped at all if nothing else is
+        required.
+        """
+        pending = []
+        for row in rows:
+            if row['uuid'] in self._stale:
+                (channelvars, age) = self._stale[row['uuid']]
+                # Channels never refreshed have no statistics to age.
+                if age is not None:
+                    self._ages.append(age)
+                yield row, channelvars
+            else:
+                pending.append(row)
+
+        cached = {}
+        if self._identity is not None:
+            cached = self._lookup_identity(pending)
+        known = {}
+        for row in pending:
+            channelvars = dict(cached.get(row['uuid'], {}),
+                               **row_variables(row))
+            if channelvars:
+                known[row['uuid']] = channelvars
+
+        listed = {uuid for (uuid, channelvars) in known.items()
+                  if all(key in channelvars for key in keys)}
+        for row in [row for row in pending if row['uuid'] in listed]:
+            yield row, known[row['uuid']]
+        pending = [row for row in pending if row['uuid'] not in listed]
+
+        async for row, result in self._dump(pending, media_stats):
+            uuid = row['uuid']
+            if result.startswith(b"-ERR "):
+                self._log.debug(
+                    "Got error while scraping call stats for %s: %s",
+                    uuid,
+                    result.decode().strip()
+                )
+                yield row, None
+                continue
+
+            channelvars = known.get(uuid, {})
+            channelvars = dict(channelvars, **self._parse(
+                result, [key for key in keys if key not in channelvars]))
+            if self._identity is not None and uuid not in cached:
+                self._identity.put(uuid, {
+                    key: channelvars[key] for key in IDENTITY_VARIABLES
+                    if key in channelvars})
+            if self._channels is not None:
+                self._channels.learn(
+                    uuid, channelvars.get('variable_sip_user_agent'))
+
+            if self._sampler is not None:
+                self._sampler.update(uuid, channelvars)
+                self._ages.append(0.)
+
+            yield row, channelvars
+
+    def _lookup_identity(self, rows):
+        """
+        Returns the cached identity variables of rows by uuid, rows missing
+        from the cache are left out.
+        """
+        known = {}
+        for row in rows:
+            channelvars = self._identity.get(row['uuid'])
+            if channelvars is not None:
+                known[row['uuid']] = channelvars
+
+        stats = self._esl.stats
+        stats.cache_hit('channels', len(known))
+        stats.cache_miss('channels', len(rows) - len(known))
+        return known
+
+    async def _rows(self):
+        """
+        Returns the calls from the channel table if it is in sync, from
+        `show calls` otherwise. Returns an empty list if the deadline expires
+        before the calls are listed.
+        """
+        if self._channels is not None and self._channels.synced:
+            return self._channels.rows()
+
+        try:
+            (_, result) = await self._deadline.wait_for(
+                self._esl.send('api show calls as json', raw=True))
+        except asyncio.TimeoutError:
+            self.partial = True
+            return []
+
+        return json.loads(result).get('rows', [])
+
+    def _parse(self, result, keys):
+        """
+        Returns the channel variables required from a uuid_dump result.
+        """
+        start = time.perf_counter()
+        channelvars = extract_json_keys(result, keys)
+        if channelvars is None:
+            channelvars = json.loads(result)
+        self._parse_time += time.perf_counter() - start
+        return channelvars
+
+    @staticmethod
+    async def _complete(entry):
+        (row, stats, dump) = entry
+        try:
+            if stats is not None:
+                await stats
+        except BaseException:
+            discard(dump)
+            raise
+        (_, result) = await dump
+        return row, result
 
     async def collect(self):
         """
-        Collects channel metrics.
-        """
-
-        channel_metrics = {
-            'variable_rtp_audio_in_raw_bytes': GaugeMetricFamily(
-                'rtp_audio_in_raw_bytes_total',
-                'Total number of bytes received via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_raw_bytes': GaugeMetricFamily(
-                'rtp_audio_out_raw_bytes_total',
-                'Total number of bytes sent via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_media_bytes': GaugeMetricFamily(
-                'rtp_audio_in_media_bytes_total',
-                'Total number of media bytes received via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_media_bytes': GaugeMetricFamily(
-                'rtp_audio_out_media_bytes_total',
-                'Total number of media bytes sent via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_packets_total',
-                'Total number of packets received via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_packet_count': GaugeMetricFamily(
-                'rtp_audio_out_packets_total',
-                'Total number of packets sent via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_media_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_media_packets_total',
-                'Total number of media packets received via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_media_packet_count': GaugeMetricFamily(
-                'rtp_audio_out_media_packets_total',
-                'Total number of media packets sent via this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_skip_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_skip_packets_total',
-                'Total number of inbound packets discarded by this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_skip_packet_count': GaugeMetricFamily(
-                'rtp_audio_out_skip_packets_total',
-                'Total number of outbound packets discarded by this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_jitter_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_jitter_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_dtmf_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_dtmf_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_dtmf_packet_count': GaugeMetricFamily(
-                'rtp_audio_out_dtmf_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_cng_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_cng_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_out_cng_packet_count': GaugeMetricFamily(
-                'rtp_audio_out_cng_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_flush_packet_count': GaugeMetricFamily(
-                'rtp_audio_in_flush_packets_total',
-                'Total number of ? packets in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_largest_jb_size': GaugeMetricFamily(
-                'rtp_audio_in_jitter_buffer_bytes_max',
-                'Largest jitterbuffer size in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_in_jitter_min_variance': GaugeMetricFamily(
-                'rtp_audio_in_jitter_seconds_min',
-                'Minimal jitter in seconds.',
-                labels=['id']),
-            'variable_rtp_audio_in_jitter_max_variance': GaugeMetricFamily(
-                'rtp_audio_in_jitter_seconds_max',
-                'Maximum jitter in seconds.',
-                labels=['id']),
-            'variable_rtp_audio_in_jitter_loss_rate': GaugeMetricFamily(
-                'rtp_audio_in_jitter_loss_rate',
-                'Ratio of lost packets due to inbound jitter.',
-                labels=['id']),
-            'variable_rtp_audio_in_jitter_burst_rate': GaugeMetricFamily(
-                'rtp_audio_in_jitter_burst_rate',
-                'Ratio of packet bursts due to inbound jitter.',
-                labels=['id']),
-            'variable_rtp_audio_in_mean_interval': GaugeMetricFamily(
-                'rtp_audio_in_mean_interval_seconds',
-                'Mean interval in seconds of inbound packets',
-                labels=['id']),
-            'variable_rtp_audio_in_flaw_total': GaugeMetricFamily(
-                'rtp_audio_in_flaw_total',
-                'Total number of flaws detected in the channel',
-                labels=['id']),
-            'variable_rtp_audio_in_quality_percentage': GaugeMetricFamily(
-                'rtp_audio_in_quality_percent',
-                'Audio quality in percent',
-                labels=['id']),
-            'variable_rtp_audio_in_mos': GaugeMetricFamily(
-                'rtp_audio_in_quality_mos',
-                'Audio quality as Mean Opinion Score, (between 1 and 5)',
-                labels=['id']),
-            'variable_rtp_audio_rtcp_octet_count': GaugeMetricFamily(
-                'rtcp_audio_bytes_total',
-                'Total number of rtcp bytes in this channel.',
-                labels=['id']),
-            'variable_rtp_audio_rtcp_packet_count': GaugeMetricFamily(
-                'rtcp_audio_packets_total',
-                'Total number of rtcp packets in this channel.',
-                labels=['id']),
-        }
-
-        channel_info_metric = GaugeMetricFamily(
-            'rtp_channel_info',
-            'FreeSWITCH RTP channel info',
-            labels=['id', 'name', 'user_agent'])
-
-        millisecond_metrics = [
-            'variable_rtp_audio_in_jitter_min_variance',
-            'variable_rtp_audio_in_jitter_max_variance',
-            'variable_rtp_audio_in_mean_interval',
-        ]
+        Collects channel metrics. Channels left over when the deadline
+        expires are skipped and reported by scrape_metrics().
+        """
+        families = await self._collect()
+        if self.skipped:
+            self.partial = True
+            self._deadline.exceed()
+
+        if self._retained is not None:
+            # Calls missing from a complete listing have ended.
+            if self._listed is not None:
+                self._retained.sweep(self._listed)
+            families = itertools.chain(
+                families, self._retained.families(self._enabled))
+
+        return families
+
+    def scrape_metrics(self, partial=False):
+        """
+        Returns metric families reporting whether the collection was cut
+        short by the deadline. Pass partial=True if families collected
+        along with the channels were left out.
+        """
+        partial_metric = GaugeMetricFamily(
+            'freeswitch_scrape_partial',
+            'Whether collection was cut short by the scrape deadline',
+        )
+        partial_metric.add_metric([], int(self.partial or partial))
+
+        skipped_metric = GaugeMetricFamily(
+            'freeswitch_channels_skipped',
+            'Number of channels skipped because of the scrape deadline',
+        )
+        skipped_metric.add_metric([], self.skipped)
+
+        if self._sampler is None:
+            return [partial_metric, skipped_metric]
+
+        ages = sorted(self._ages)
+        age_metric = SummaryMetricFamily(
+            'freeswitch_channel_stats_age_seconds',
+            'Time since the statistics of the channels served were collected',
+            count_value=len(ages), sum_value=sum(ages))
+        for quantile in AGE_QUANTILES:
+            if ages:
+                age_metric.add_sample(
+                    age_metric.name, {'quantile': floatToGoString(quantile)},
+                    ages[min(len(ages) - 1, int(quantile * len(ages)))])
+
+        return [partial_metric, skipped_metric, age_metric]
+
+    async def _collect(self):
+        channel_metrics = {key: definition.family()
+                           for key, definition in CHANNEL_METRICS.items()
+                           if self._enabled(definition.name)}
+        channel_info_enabled = self._enabled(CHANNEL_INFO.name)
+        channel_info_metric = CHANNEL_INFO.family()
+
+        # Per-channel info cannot be aggregated, count channels instead.
+        aggregator = None
+        if self._aggregation is not None:
+            aggregator = ChannelAggregator(
+                self._aggregation, channel_metrics, MILLISECOND_METRICS,
+                self._enabled('rtp_channels'))
+            channel_info_enabled = False
+
+        # Skip listing and dumping calls altogether if no family needs them.
+        # Otherwise only extract the required variables from the dumps.
+        keys = self._keys(channel_metrics, channel_info_enabled, aggregator)
+        if not keys and aggregator is None:
+            return []
 
         # This loop is potentially running while calls are being dropped and
         # new calls are established. This will lead to some failing api
         # requests. In that case it is better to just skip scraping for that
         # call and continue with the next one in order to avoid failing the
         # whole scrape.
-        (_, result) = await self._esl.send('api show calls as json')
-        for row in json.loads(result).get('rows', []):
-            uuid = row['uuid']
+        stats = self._esl.stats
+        rows = await self._list()
 
-            await self._esl.send(f'api uuid_set_media_stats {uuid}')
-            (_, result) = await self._esl.send(f'api uuid_dump {uuid} json')
+        self.skipped = len(rows)
+        self._parse_time = 0.
+        with stats.phase('channels'):
+            async for row, channelvars in self._channelvars(
+                    rows, keys,
+                    bool(channel_metrics) or self._retained is not None):
+                self.skipped -= 1
+                uuid = row['uuid']
 
-            if result.startswith("-ERR "):
-                self._log.debug(
-                    "Got error while scraping call stats for %s: %s",
-                    uuid,
-                    result.strip()
-                )
-                continue
+                if channelvars is None:
+                    stats.channel_skipped()
+                    continue
 
-            channelvars = json.loads(result)
+                stats.channel_scraped()
+
+                if self._retained is not None:
+                    self._retained.observe(row, channelvars)
+
+                if aggregator is not None:
+                    aggregator.add(row, channelvars)
+                    continue
+
+                for key, metric_value in channelvars.items():
+                    if key in MILLISECOND_METRICS:
+                        metric_value = float(metric_value) / 1000.
+                    if key in channel_metrics:
+                        channel_metrics[key].add_metric([uuid], metric_value)
 
-            label_values = [uuid]
-            for key, metric_value in channelvars.items():
-                if key in millisecond_metrics:
-                    metric_value = float(metric_value) / 1000.
-                if key in channel_metrics:
-                    channel_metrics[key].add_metric(
-                        label_values, metric_value)
+                user_agent = self._user_agent(uuid, channelvars)
+                if channel_info_enabled and user_agent is not None:
+                    channel_info_metric.add_metric(
+                        [uuid, row['name'], user_agent], 1)
 
-            user_agent = channelvars.get('variable_sip_user_agent', 'Unknown')
-            channel_info_label_values = [uuid, row['name'], user_agent]
-            channel_info_metric.add_metric(
-                channel_info_label_values, 1)
+        stats.observe_phase('parse', self._parse_time)
+
+        if aggregator is not None:
+            return aggregator.families()
 
         return itertools.chain(
             channel_metrics.values(),
-            [channel_info_metric])
+            [channel_info_metric] if channel_info_enabled else [])
+
+    def _user_agent(self, uuid, channelvars):
+        """
+        Returns the user agent of a channel for rtp_channel_info. Returns
+        None for channels never dumped unless the listing provided it, they
+        are left out until dumped rather than exported with a placeholder.
+        """
+        user_agent = channelvars.get('variable_sip_user_agent')
+        if user_agent is not None:
+            return user_agent
+        if uuid in self._stale and self._stale[uuid][1] is None:
+            return None
+        return 'Unknown'
+
+    async def _list(self):
+        """
+        Lists the calls, forgets state kept for calls which are gone and
+        returns the rows of the calls to serve.
+        """
+        with self._esl.stats.phase('list_channels'):
+            rows = await self._rows()
+
+        if not self.partial:
+            self._listed = [row['uuid'] for row in rows]
+            for state in (self._identity, self._sampler):
+                if state is not None:
+                    state.retain(self._listed)
+
+        if self._sampler is not None:
+            (rows, self._stale) = self._sampler.select(rows)
+
+        return rows
+
+    def _keys(self, channel_metrics, channel_info_enabled, aggregator):
+        """
+        Returns the channel variables to extract from uuid_dump responses.
+        """
+        keys = list(channel_metrics)
+        if channel_info_enabled:
+            keys.append('variable_sip_user_agent')
+        for consumer in (aggregator, self._retained):
+            if consumer is not None:
+                keys.extend(consumer.variables)
+        return list(dict.fromkeys(keys))
 
 
 class ChannelCollector():
@@ -262,37 +661,338 @@ class ChannelCollector():
     freeswitch_version_info{release="15",repoid="7599e35a",version="4.4"} 1.0
     """
 
-    def __init__(self, host, port, password):
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, host, config, target=None, runner=None):
         self._host = host
-        self._port = port
-        self._password = password
+        self._port = config.get('port', 8021)
+        self._password = config.get('password', 'ClueCon')
+        self._config = config
+        self._target = target
+        self._runner = runner
+        self._stats = target.stats if target is not None else NULL_STATS
+        self.partial = False
+
+    @asynccontextmanager
+    async def _connect(self, deadline):
+        admission = None
+        if self._target is not None:
+            admission = self._target.admission
+
+        async with AsyncExitStack() as stack:
+            if admission is not None:
+                with self._stats.phase('admission'):
+                    await stack.enter_async_context(
+                        admission.session(deadline))
+
+            yield await self._borrow(stack, deadline)
+
+    async def _shard(self, stack, deadline):
+        """
+        Returns an additional connection for sharding. Holds a session of
+        its own if admission control is enabled. Raises AdmissionBusyError
+        or ESLPoolBusyError instead of waiting if there is none to spare.
+        """
+        admission = None
+        if self._target is not None:
+            admission = self._target.admission
+
+        async with AsyncExitStack() as shard:
+            if admission is not None:
+                await shard.enter_async_context(
+                    admission.session(deadline, wait=False))
+            esl = await self._borrow(shard, deadline, wait=False)
+            stack.push_async_callback(shard.pop_all().aclose)
+            return esl
+
+    async def _borrow(self, stack, deadline, wait=True):
+        """
+        Returns a logged-in connection from the pool, if any, or a new one.
+        The connection is returned or closed when the stack unwinds. Raises
+        ESLPoolBusyError if wait is False and the pool has no connection to
+        spare.
+        """
+        if self._target is not None and self._target.pool is not None:
+            with self._stats.phase('connect'):
+                esl = await deadline.wait_for(stack.enter_async_context(
+                    self._target.pool.connection(wait)))
+        else:
+            esl = await stack.enter_async_context(self._open(deadline))
+
+        # Connections borrowed from the pool report to this collection.
+        esl.stats = self._stats
+        esl.limiter = None
+        if self._target is not None and self._target.admission is not None:
+            esl.limiter = self._target.admission.commands
+        return esl
 
     @asynccontextmanager
-    async def _connect(self):
-        reader, writer = await asyncio.open_connection(self._host, self._port)
+    async def _channel_info(self, esl, deadline):
+        """
+        Yields the channel info collector. Channels are sharded across
+        additional connections if the connections option is above 1, shards
+        which fail to connect are left out.
+
+        Additional connections are only opened if admission control and the
+        pool have sessions and connections to spare. Waiting for them while
+        holding esl would deadlock concurrent collections of the same target.
+        """
+        async with AsyncExitStack() as stack:
+            connections = [esl]
+            shards = await asyncio.gather(
+                *(self._shard(stack, deadline)
+                  for _ in range(self._config.get('connections', 1) - 1)),
+                return_exceptions=True)
+            for shard in shards:
+                if isinstance(shard, ESL):
+                    connections.append(shard)
+                elif isinstance(shard, (AdmissionBusyError,
+                                        ESLPoolBusyError)):
+                    logging.getLogger(__name__).debug(
+                        "Collecting %s with fewer shards: %s",
+                        self._host, shard)
+                elif isinstance(shard, Exception):
+                    logging.getLogger(__name__).warning(
+                        "Failed to open shard connection to %s: %r",
+                        self._host, shard)
+                else:
+                    raise shard
+
+            yield ESLChannelInfo(connections, self._config, self._target,
+                                 deadline)
+
+    @asynccontextmanager
+    async def _open(self, deadline):
+        with self._stats.phase('connect'):
+            reader, writer = await deadline.wait_for(
+                asyncio.open_connection(self._host, self._port))
         try:
-            esl = ESL(reader, writer)
-            await esl.initialize()
-            await esl.login(self._password)
+            esl = ESL(reader, writer, self._stats)
+            with self._stats.phase('auth'):
+                await deadline.wait_for(esl.initialize())
+                await deadline.wait_for(esl.login(self._password))
             yield esl
         finally:
             writer.close()
             await writer.wait_closed()
 
-    @async_to_sync
-    async def collect(self):  # pylint: disable=missing-docstring
-        async with self._connect() as esl:
-            return itertools.chain(
-                await ESLProcessInfo(esl).collect(),
-                await ESLChannelInfo(esl).collect())
+    async def collect_async(self, deadline=None):
+        """
+        Collects all metric families. Must be awaited on the event loop
+        owning the target state, if any.
+
+        Process info is always collected. Sofia, conference and callcenter
+        status are left out and channel collection stops early if the
+        deadline expires.
+        """
+        deadline = deadline or Deadline()
 
+        async with self._connect(deadline) as esl:
+            status = await self._collect_status(esl, deadline)
+            async with self._channel_info(esl, deadline) as channel_info:
+                return itertools.chain(
+                    status, await channel_info.collect(),
+                    channel_info.scrape_metrics(self.partial))
 
-def collect_esl(config, host):
+    async def stream_async(self, deadline=None):
+        """
+        Collects all metric families and yields them in prometheus text
+        format chunk by chunk. Process info and Sofia status are yielded
+        before channels are collected, channel families are encoded once the
+        connection was released, a bounded number of rows at a time.
+        """
+        deadline = deadline or Deadline()
+        render_time = 0.
+
+        async with self._connect(deadline) as esl:
+            start = time.perf_counter()
+            status = render(await self._collect_status(esl, deadline))
+            render_time += time.perf_counter() - start
+            yield status
+            async with self._channel_info(esl, deadline) as channel_info:
+                families = itertools.chain(
+                    await channel_info.collect(),
+                    channel_info.scrape_metrics(self.partial))
+
+        start = time.perf_counter()
+        for chunk in iter_render(families):
+            render_time += time.perf_counter() - start
+            yield chunk
+            start = time.perf_counter()
+        render_time += time.perf_counter() - start
+        self._stats.observe_phase('render', render_time)
+
+    async def _collect_status(self, esl, deadline):
+        """
+        Collects process info, Sofia, conference and callcenter status.
+        """
+        with self._stats.phase('process_info'):
+            process = await deadline.wait_for(ESLProcessInfo(esl).collect(),
+                                              STATUS_MIN_TIMEOUT)
+        sofia = await self._optional('sofia', lambda: self._cached(
+            'sofia', lambda: deadline.wait_for(ESLSofiaInfo(
+                esl, self._config['sofia']).collect())))
+        conference = await self._optional(
+            'conference', lambda: deadline.wait_for(ESLConferenceInfo(
+                esl, self._config['conference']).collect()))
+        callcenter = await self._optional(
+            'callcenter', lambda: deadline.wait_for(ESLCallcenterInfo(
+                esl, self._config['callcenter']).collect()))
+        return itertools.chain(process, sofia, conference, callcenter)
+
+    async def _optional(self, name, collect):
+        """
+        Awaits collect() if the option of the same name is set. Returns no
+        families if the deadline expires before they are collected, the
+        collection is partial then.
+        """
+        if not self._config.get(name):
+            return []
+
+        with self._stats.phase(name):
+            try:
+                return await collect()
+            except asyncio.TimeoutError:
+                logging.getLogger(__name__).debug(
+                    "Left out %s status of %s, the scrape deadline expired",
+                    name, self._host)
+                self.partial = True
+                return []
+
+    async def _cached(self, name, collect):
+        """
+        Returns the families of a command class from the cache of the target,
+        if any and fresh. Awaits collect() otherwise.
+        """
+        if self._target is None or self._target.cache is None:
+            return await collect()
+        return await self._target.cache.families(name, collect)
+
+    def collect(self, deadline=None):  # pylint: disable=missing-docstring
+        if self._runner is not None:
+            return self._runner(self.collect_async(deadline))
+
+        # Imported on demand, oneshot collections do not need asgiref.
+        # pylint: disable=import-outside-toplevel
+        from asgiref.sync import async_to_sync
+        return async_to_sync(self.collect_async)(deadline)
+
+
+def collect_esl(config, host, targets=None, module='default',
+                deadline=None):
     """Scrape a host and return prometheus text format for it (asinc)"""
 
-    port = config.get('port', 8021)
-    password = config.get('password', 'ClueCon')
+    target = None
+    runner = None
+    if targets is not None:
+        target = targets.get(module, host, config)
+        runner = targets.run
+
+    families = ChannelCollector(host, config, target, runner).collect(deadline)
+    return _render(families, target)
+
+
+def stream_esl(config, host, targets, module='default', deadline=None):
+    """
+    Scrape a host and yield prometheus text format for it in chunks. Every
+    chunk is collected on the background loop of the targets.
+    """
+
+    target = targets.get(module, host, config)
+    chunks = ChannelCollector(host, config, target).stream_async(deadline)
+
+    async def step():
+        return await chunks.__anext__()
+
+    try:
+        while True:
+            try:
+                yield targets.run(step())
+            except StopAsyncIteration:
+                return
+    finally:
+        targets.run(chunks.aclose())
+
+
+async def collect_esl_async(config, host, target=None, deadline=None):
+    """Scrape a host and return prometheus text format for it (awaitable)"""
+
+    families = await ChannelCollector(host, config, target) \
+        .collect_async(deadline)
+    return _render(families, target)
+
+
+def _render(families, target):
+    stats = target.stats if target is not None else NULL_STATS
+    with stats.phase('render'):
+        return render(families)
+
+
+async def collect_esl_many_async(config, hosts, targets=None,
+                                 module='default', deadline=None):
+    """
+    Scrape several hosts concurrently and return prometheus text format for
+    all of them, with a target label added to every sample (awaitable).
+    """
 
-    registry = CollectorRegistry()
-    registry.register(ChannelCollector(host, port, password))
-    return generate_latest(registry)
+    slots = asyncio.Semaphore(config.get('fanout_concurrency', 10))
+
+    up_metric = GaugeMetricFamily(
+        'freeswitch_target_up',
+        'Whether the collection of a target succeeded',
+        labels=['target'])
+    duration_metric = GaugeMetricFamily(
+        'freeswitch_target_collection_duration_seconds',
+        'Duration of the collection of a target',
+        labels=['target'])
+
+    async def collect(host):
+        target = None
+        if targets is not None:
+            target = targets.get(module, host, config)
+
+        async with slots:
+            start = time.time()
+            try:
+                families = list(await ChannelCollector(
+                    host, config, target).collect_async(deadline))
+                up_metric.add_metric([host], 1)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception(
+                    "Exception thrown while collecting %s", host)
+                families = []
+                up_metric.add_metric([host], 0)
+            duration_metric.add_metric([host], time.time() - start)
+
+        return host, families
+
+    results = await asyncio.gather(*(collect(host) for host in hosts))
+
+    merged = {}
+    for host, families in results:
+        for family in families:
+            metric = merged.get(family.name)
+            if metric is None:
+                metric = Metric(family.name, family.documentation,
+                                family.type, family.unit)
+                merged[family.name] = metric
+            metric.samples.extend(
+                sample._replace(labels={**sample.labels, 'target': host})
+                for sample in family.samples)
+
+    return render(itertools.chain(merged.values(),
+                                  [up_metric, duration_metric]))
+
+
+def collect_esl_many(config, hosts, targets=None, module='default',
+                     deadline=None):
+    """Scrape several hosts and return prometheus text format for them"""
+
+    if targets is not None:
+        return targets.run(
+            collect_esl_many_async(config, hosts, targets, module, deadline))
+
+    # pylint: disable=import-outside-toplevel
+    from asgiref.sync import async_to_sync
+    return async_to_sync(collect_esl_many_async)(config, hosts, None, module,
+                                                 deadline)
@@ -0,0 +1,84 @@
+"""
+Content encoding of exposition responses.
+"""
+
+import zlib
+
+from typing import AsyncIterator, Iterator, List, Optional
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression level of gzip. Level 6 is close to the ratio of level 9 at a
+# fraction of the CPU time for exposition text.
+GZIP_LEVEL = 6
+
+
+def encodings() -> List[str]:
+    """
+    Returns the supported content encodings in order of preference. zstd is
+    only supported if the zstandard package is installed.
+    """
+    return (['zstd'] if zstandard is not None else []) + ['gzip']
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Returns the preferred supported encoding accepted by the client or None
+    if the response has to be sent as is.
+    """
+    if not accept_encoding:
+        return None
+
+    return parse_accept_header(accept_encoding).best_match(encodings())
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses a complete response body.
+    """
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def iter_compress(chunks, encoding: str) -> Iterator[bytes]:
+    """
+    Compresses a response body streamed as an iterable of chunks. Empty
+    output is held back until the compressor emits data.
+    """
+    compressor = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+async def aiter_compress(chunks, encoding: str) -> AsyncIterator[bytes]:
+    """
+    Compresses a response body streamed as an async iterable of chunks.
+    """
+    compressor = _compressor(encoding)
+    try:
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'aclose'):
+            await chunks.aclose()
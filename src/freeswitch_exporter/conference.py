@@ -0,0 +1,271 @@
+"""
+Collection of conference room and member metrics.
+"""
+# pylint: disable=too-few-public-methods
+
+import codecs
+import json
+import logging
+import re
+
+from typing import Any, Iterator
+
+from prometheus_client.core import GaugeMetricFamily
+
+from freeswitch_exporter.esl import ESL
+
+# Bytes of the document decoded at once.
+CHUNK_SIZE = 65536
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+
+def iter_array(document: bytes) -> Iterator[Any]:
+    """
+    Yields the elements of the JSON array in document one at a time.
+
+    The document is decoded in chunks and every element is decoded on its
+    own and can be discarded once yielded. Hence only one element, e.g., one
+    conference with its members, is held decoded at a time rather than the
+    whole array, and the document is never decoded to str as a whole. Yields
+    nothing if the document is not an array, stops at the first syntax
+    error.
+    """
+    reader = _ArrayReader()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    try:
+        for start in range(0, len(document), CHUNK_SIZE):
+            final = start + CHUNK_SIZE >= len(document)
+            yield from reader.feed(decoder.decode(
+                document[start:start + CHUNK_SIZE], final), final)
+            if reader.done:
+                return
+    except ValueError as error:
+        logging.getLogger(__name__).warning(
+            "Failed to parse conference list: %s", error)
+
+
+class _ArrayReader():
+    """
+    Incremental reader of the elements of a JSON array.
+
+    Only the text of the element being read is retained between chunks. An
+    incomplete element is read again once the text has doubled, such that
+    large elements spanning many chunks are not parsed over and over.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._retry = 0
+        # One of '[' before the array, ']' after it is opened, 'value' and
+        # ',' after an element.
+        self._expect = '['
+        self.done = False
+
+    def feed(self, chunk: str, final: bool) -> Iterator[Any]:
+        """
+        Yields the elements completed by chunk, final marks the last one.
+        """
+        self._text = self._text[self._pos:] + chunk
+        self._pos = 0
+        if len(self._text) < self._retry and not final:
+            return
+
+        while not self.done:
+            self._pos = _WHITESPACE.match(self._text, self._pos).end()
+            if self._pos == len(self._text):
+                if final and self._expect != '[':
+                    raise ValueError("Unterminated array")
+                self.done = final
+                return
+
+            if self._expect == 'value':
+                try:
+                    (element, end) = _DECODER.raw_decode(
+                        self._text, self._pos)
+                except ValueError:
+                    if final:
+                        raise
+                    end = len(self._text)
+                if end == len(self._text) and not final:
+                    # Numbers and literals may continue in the next chunk.
+                    self._retry = 2 * (len(self._text) - self._pos)
+                    return
+                yield element
+                (self._pos, self._retry, self._expect) = (end, 0, ',')
+            else:
+                self._delimiter()
+
+    def _delimiter(self):
+        char = self._text[self._pos]
+        if self._expect == '[':
+            self.done = char != '['
+            self._expect = ']'
+        elif char == ']':
+            self.done = True
+        elif self._expect == ']':
+            self._expect = 'value'
+            return
+        elif char == ',':
+            self._expect = 'value'
+        else:
+            raise ValueError(f"Expecting ',' delimiter at {self._pos}")
+        self._pos += 1
+
+
+class ESLConferenceInfo():
+    """
+    Conference async collector. All rooms and their members are fetched with
+    one `conference json_list` command.
+
+    At most max_conferences rooms are exported with per-room series and at
+    most max_members members with per-member series in total, in the order
+    listed by FreeSWITCH. The number of rooms and members left out is
+    exported instead.
+    """
+
+    def __init__(self, esl: ESL, config=None):
+        config = config if isinstance(config, dict) else {}
+        self._esl = esl
+        self._members = config.get('members', True)
+        self._max_conferences = config.get('max_conferences', 100)
+        self._max_members = config.get('max_members', 1000)
+
+    async def collect(self):
+        """
+        Collects conference metrics.
+        """
+        (_, body) = await self._esl.send('api conference json_list',
+                                         raw=True)
+        if body.startswith(b'-ERR'):
+            logging.getLogger(__name__).debug(
+                "Conference list not available: %s", body.decode().strip())
+            return []
+
+        room_metrics = _RoomMetrics()
+        member_metrics = _MemberMetrics()
+        rooms = 0
+        members = 0
+        members_skipped = 0
+        for room in iter_array(body):
+            if not isinstance(room, dict):
+                continue
+            rooms += 1
+            if rooms > self._max_conferences:
+                # Callers of rooms left out are not exported either.
+                if self._members:
+                    members_skipped += sum(
+                        1 for member in room.get('members') or []
+                        if member.get('type') == 'caller')
+                continue
+
+            name = str(room.get('conference_name', ''))
+            talking = 0
+            for member in room.get('members') or []:
+                flags = member.get('flags') or {}
+                talking += int(bool(flags.get('talking')))
+                if not self._members or member.get('type') != 'caller':
+                    continue
+                if members >= self._max_members:
+                    members_skipped += 1
+                    continue
+                members += 1
+                member_metrics.add(name, member)
+            room_metrics.add(name, room, talking)
+
+        families = room_metrics.families(
+            rooms, max(0, rooms - self._max_conferences))
+        if self._members:
+            families.extend(member_metrics.families(members_skipped))
+        return families
+
+
+class _RoomMetrics():
+    """
+    Per-room families of the conference collector.
+    """
+
+    def __init__(self):
+        self._members = GaugeMetricFamily(
+            'freeswitch_conference_members',
+            'Number of members in the conference room',
+            labels=['conference'])
+        self._talking = GaugeMetricFamily(
+            'freeswitch_conference_talking_members',
+            'Number of members talking in the conference room',
+            labels=['conference'])
+        self._run_time = GaugeMetricFamily(
+            'freeswitch_conference_run_time_seconds',
+            'Seconds since the conference room was created',
+            labels=['conference'])
+
+    def add(self, conference, room, talking):
+        """
+        Adds the series of one room.
+        """
+        self._members.add_metric([conference], room.get('member_count', 0))
+        self._talking.add_metric([conference], talking)
+        self._run_time.add_metric([conference], room.get('run_time', 0))
+
+    def families(self, rooms, skipped):
+        """
+        Returns the per-room families along with the number of rooms.
+        """
+        rooms_metric = GaugeMetricFamily(
+            'freeswitch_conference_rooms',
+            'Number of conference rooms')
+        rooms_metric.add_metric([], rooms)
+        skipped_metric = GaugeMetricFamily(
+            'freeswitch_conference_rooms_skipped',
+            'Number of conference rooms exported without per-room series '
+            'due to max_conferences')
+        skipped_metric.add_metric([], skipped)
+        return [rooms_metric, self._members, self._talking, self._run_time,
+                skipped_metric]
+
+
+class _MemberMetrics():
+    """
+    Per-member families of the conference collector.
+    """
+
+    def __init__(self):
+        labels = ['conference', 'member', 'uuid']
+        self._talking = GaugeMetricFamily(
+            'freeswitch_conference_member_talking',
+            'Whether the conference member is talking',
+            labels=labels)
+        self._muted = GaugeMetricFamily(
+            'freeswitch_conference_member_muted',
+            'Whether the conference member is muted',
+            labels=labels)
+        self._energy = GaugeMetricFamily(
+            'freeswitch_conference_member_energy_level',
+            'Energy level above which the conference member is heard',
+            labels=labels)
+
+    def add(self, conference, member):
+        """
+        Adds the series of one member of conference.
+        """
+        labelvalues = [conference, str(member.get('id', '')),
+                       str(member.get('uuid', ''))]
+        flags = member.get('flags') or {}
+        self._talking.add_metric(labelvalues, int(bool(flags.get('talking'))))
+        self._muted.add_metric(labelvalues,
+                               int(not flags.get('can_speak', True)))
+        self._energy.add_metric(labelvalues, member.get('energy', 0))
+
+    def families(self, skipped):
+        """
+        Returns the per-member families along with the number of members
+        left out.
+        """
+        skipped_metric = GaugeMetricFamily(
+            'freeswitch_conference_members_skipped',
+            'Number of conference callers exported without per-member '
+            'series due to max_members or max_conferences')
+        skipped_metric.add_metric([], skipped)
+        return [self._talking, self._muted, self._energy, skipped_metric]
@@ -0,0 +1,92 @@
+"""
+Scrape deadlines.
+"""
+
+import asyncio
+import time
+
+from typing import Optional
+
+
+# Header carrying the scrape timeout configured in Prometheus.
+TIMEOUT_HEADER = 'X-Prometheus-Scrape-Timeout-Seconds'
+
+
+def scrape_timeout(config, header=None) -> Optional[float]:
+    """
+    Returns the number of seconds available for a scrape. The timeout sent by
+    Prometheus is reduced by the timeout_offset of the module (0.5 seconds by
+    default) in order to leave time for the response, but by at most half of
+    it. The timeout option of the module caps the result. Returns None if
+    neither is set.
+
+    Raises ValueError if the header is not a number or if the result is not
+    positive.
+    """
+    timeouts = []
+    if header is not None:
+        header = float(header)
+        timeouts.append(max(header - config.get('timeout_offset', 0.5),
+                            header / 2))
+    if config.get('timeout') is not None:
+        timeouts.append(float(config['timeout']))
+
+    if not timeouts:
+        return None
+
+    timeout = min(timeouts)
+    if not timeout > 0:
+        raise ValueError(f"Scrape timeout must be positive, got {timeout}")
+    return timeout
+
+
+class Deadline():
+    """
+    Point in time by which a scrape has to be completed. A deadline without
+    timeout never expires.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, on_exceeded=None):
+        self._expires = None
+        if timeout is not None:
+            self._expires = time.monotonic() + timeout
+        self._on_exceeded = on_exceeded
+        self.exceeded = False
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns the number of seconds left or None if there is no deadline.
+        """
+        if self._expires is None:
+            return None
+        return max(0., self._expires - time.monotonic())
+
+    def expired(self) -> bool:
+        """
+        Returns True if the deadline has passed.
+        """
+        return self._expires is not None and time.monotonic() >= self._expires
+
+    def exceed(self):
+        """
+        Records that work was cut short or failed because of the deadline.
+        Calls on_exceeded the first time.
+        """
+        if not self.exceeded and self._on_exceeded is not None:
+            self._on_exceeded()
+        self.exceeded = True
+
+    async def wait_for(self, awaitable, minimum: Optional[float] = None):
+        """
+        Awaits awaitable and records the deadline as exceeded if it raises
+        asyncio.TimeoutError. Waits at least minimum seconds, if given, even
+        if less time remains.
+        """
+        timeout = self.remaining()
+        if timeout is not None and minimum is not None:
+            timeout = max(timeout, minimum)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.exceed()
+            raise
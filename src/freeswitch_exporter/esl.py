@@ -3,8 +3,25 @@ Simple FreeSWITCH inbound event socket implementation based on asyncio
 """
 
 import asyncio
+import json
 import logging
-from typing import Dict, Tuple
+import time
+import uuid
+from collections import deque
+from typing import (Any, AsyncIterator, Deque, Dict, Iterable, List,
+                    Optional, Tuple, Union)
+
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+# Maximum number of bytes requested from the stream at once. Every read is
+# copied into the parser buffer, hence larger reads raise peak memory without
+# making parsing noticeably faster.
+READ_SIZE = 16384
+
+# Bodies of at least this size are handed out without copying them, by
+# moving any data following them to a new receive buffer instead. Copying is
+# faster for smaller ones.
+COPY_THRESHOLD = 65536
 
 
 class ESLError(Exception):
@@ -25,25 +42,143 @@ class ESLProtocolError(ESLError):
     """
 
 
+def discard(future: Optional[asyncio.Future]):
+    """
+    Cancels a pending command future or retrieves the exception of a failed
+    one, e.g., after the connection was lost.
+    """
+    if future is None:
+        return
+    if future.done() and not future.cancelled():
+        future.exception()
+    else:
+        future.cancel()
+
+
+class ESLFrameParser():
+    """
+    Incremental parser splitting the event socket byte stream into frames.
+
+    Received data is accumulated in a single buffer. The end of a header
+    block is located with one bytearray.find() and the block is decoded once,
+    instead of awaiting and decoding every header line on its own.
+
+    Small bodies are copied out of the buffer as bytes. Large bodies are
+    returned as the bytearray they were received into, without any copy.
+    json.loads() accepts both without decoding them to str first.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+        self._headers: Optional[Dict[str, str]] = None
+
+    def feed(self, data: bytes):
+        """
+        Append received data to the buffer.
+        """
+        # Drop consumed data before growing the buffer. Deleting from the
+        # front of a bytearray only moves its start, it does not copy.
+        if self._offset:
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+        self._buffer += data
+
+    def next_frame(self) -> Optional[Tuple[Dict[str, str], bytes]]:
+        """
+        Returns the next complete frame as a tuple (headers, body) or None if
+        more data is required.
+        """
+        buffer = self._buffer
+
+        if self._headers is None:
+            end = buffer.find(b'\n\n', self._offset)
+            if end < 0:
+                return None
+
+            self._headers = self._parse_headers(buffer, self._offset, end)
+            self._offset = end + 2
+
+        size = int(self._headers.get('Content-Length', 0))
+        start = self._offset
+        if len(buffer) - start < size:
+            return None
+
+        if size < COPY_THRESHOLD:
+            result = (self._headers, bytes(buffer[start:start + size]))
+        else:
+            # Hand out the buffer itself and continue with a copy of the data
+            # received after the body, which is at most READ_SIZE bytes.
+            self._buffer = buffer[start + size:]
+            del buffer[start + size:]
+            del buffer[:start]
+            result = (self._headers, buffer)
+            self._headers = None
+            self._offset = 0
+            return result
+
+        self._headers = None
+        self._offset = start + size
+        if self._offset == len(buffer):
+            buffer.clear()
+            self._offset = 0
+
+        return result
+
+    def pending(self) -> int:
+        """
+        Returns the number of buffered bytes not consumed yet.
+        """
+        return len(self._buffer) - self._offset
+
+    @staticmethod
+    def _parse_headers(buffer: bytearray, start: int, end: int):
+        headers = {}
+        for line in buffer[start:end].decode().split('\n'):
+            (name, _, value) = line.partition(':')
+            headers[name.strip()] = value.strip()
+
+        return headers
+
+
 class ESL():
     """
     Simple FreeSWITCH inbound event socket implementation based on asyncio
     """
 
+    # pylint: disable=too-many-instance-attributes
+
     def __init__(self,
                  reader: asyncio.StreamReader,
-                 writer: asyncio.StreamWriter):
+                 writer: asyncio.StreamWriter,
+                 stats=NULL_STATS):
         self._in = reader
         self._out = writer
         self._log = logging.getLogger('esl')
+        self._parser = ESLFrameParser()
+        self._pending: Deque[Tuple[asyncio.Future, bool, str, float]] = \
+            deque()
+        self.stats = stats
+        # Token bucket rate limiting commands, see admission.TokenBucket.
+        self.limiter = None
+        self._reader: Optional[asyncio.Task] = None
+        self._broken: Optional[BaseException] = None
+
+    @property
+    def broken(self) -> bool:
+        """
+        Returns True if a previous error left the connection unusable, e.g.,
+        because reading responses failed.
+        """
+        return self._broken is not None
 
     async def initialize(self):
         """
         Initialize an ESL connection, wait for auth/request.
         """
         self._log.debug("Expect auth/request")
-        headers = await self._read_all_headers()
-        _ = await self._read_body(headers)
+        (headers, _) = await self._read_frame()
         if headers["Content-Type"] == 'auth/request':
             self._log.debug("Received auth/request")
         else:
@@ -60,14 +195,13 @@ class ESL():
         await self._write(f'auth {password}')
 
         self._log.debug("Expect command/reply")
-        headers = await self._read_all_headers()
-        body = await self._read_body(headers)
+        (headers, body) = await self._read_frame()
         if headers["Content-Type"] == 'command/reply' \
                 and headers["Reply-Text"] == "+OK accepted":
             self._log.debug("Received command/reply")
             result = True
         elif headers["Content-Type"] == "text/rude-rejection":
-            self._log.error("Received text/rude-rejection: %s", body)
+            self._log.error("Received text/rude-rejection: %s", body.decode())
         else:
             raise ESLProtocolError(f"Expected auth response, "
                                    f"but got {headers!r}")
@@ -75,50 +209,169 @@ class ESL():
         self._log.info("Login: %s", "success" if result else "failure")
         return result
 
-    async def send(self, command: str) -> Tuple[Dict[str, str], str]:
+    async def send(self, command: str, raw: bool = False) \
+            -> Tuple[Dict[str, str], Union[str, bytes]]:
         """
-        Send command to FreeSWITCH. Returns a tuple (headers, body).
+        Send command to FreeSWITCH. Returns a tuple (headers, body). The body
+        is returned as bytes if raw is True, e.g., to pass it to json.loads()
+        without decoding it first.
         """
-        body = ""
-        headers = {}
+        return await (await self.submit(command, raw))
+
+    async def send_all(self, commands: Iterable[str], raw: bool = False) \
+            -> List[Tuple[Dict[str, str], Union[str, bytes]]]:
+        """
+        Send all commands to FreeSWITCH at once, see submit(). Returns the
+        tuples (headers, body) in the order of the commands.
+        """
+        futures = []
+        try:
+            for command in commands:
+                futures.append(await self.submit(command, raw))
+        except BaseException:
+            for future in futures:
+                discard(future)
+            raise
+        return await asyncio.gather(*futures)
+
+    async def submit(self, command: str, raw: bool = False) -> asyncio.Future:
+        """
+        Send command to FreeSWITCH without waiting for the response. Returns a
+        future resolving to a tuple (headers, body), see send().
+
+        FreeSWITCH answers api commands in the order they were received.
+        Hence any number of commands can be in flight on one connection,
+        responses are matched to commands in FIFO order.
+        """
+        if self._broken is not None:
+            raise ESLProtocolError("Connection unusable after "
+                                   "previous error") from self._broken
+
+        if self.limiter is not None:
+            waited = await self.limiter.acquire()
+            if waited:
+                self.stats.throttled(waited)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, raw, self._verb(command),
+                              time.perf_counter()))
 
         self._log.debug("Send %s", command)
-        await self._write(command)
+        try:
+            await self._write(command)
+        except BaseException as error:
+            self._fail_pending(error)
+            # The caller gets the error raised instead of the future.
+            if not future.cancelled():
+                future.exception()
+            raise
+
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_responses())
 
-        self._log.debug("Expect api/response")
-        headers = await self._read_all_headers()
-        body = await self._read_body(headers)
+        return future
 
-        if headers["Content-Type"] != 'api/response':
-            raise ESLProtocolError(f"Expected api response, "
+    async def subscribe(self, events: Iterable[str]):
+        """
+        Ask FreeSWITCH to deliver the given events in json format.
+        """
+        command = 'event json ' + ' '.join(events)
+        self._log.debug("Send %s", command)
+        await self._write(command)
+
+        self._log.debug("Expect command/reply")
+        (headers, _) = await self._read_frame()
+        if headers["Content-Type"] != 'command/reply' \
+                or not headers.get("Reply-Text", "").startswith("+OK"):
+            raise ESLProtocolError(f"Expected event subscription reply, "
                                    f"but got {headers!r}")
 
-        return headers, body
+    async def bgapi(self, command: str) -> str:
+        """
+        Send a command to FreeSWITCH for background execution. Returns the
+        Job-UUID of the BACKGROUND_JOB event carrying the result.
 
-    async def _write(self, command: str):
-        self._out.write(f'{command}\n\n'.encode())
-        await self._out.drain()
+        The command/reply acknowledging the job is delivered through events()
+        along with everything else.
+        """
+        job_uuid = str(uuid.uuid4())
+        self._log.debug("Send bgapi %s (%s)", command, job_uuid)
+        await self._write(f'bgapi {command}\nJob-UUID: {job_uuid}')
+        return job_uuid
 
-    async def _read_headers(self):
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields events delivered after subscribe() until FreeSWITCH closes the
+        connection. Command replies are skipped.
+        """
         while True:
-            line = await self._in.readline()
-            if len(line) == 0 or line[-1:] != b"\n":
-                raise ESLHeaderError("Encountered EOF "
-                                     "while reading response headers")
-            if line == b"\n":
+            (headers, body) = await self._read_frame()
+
+            content_type = headers["Content-Type"]
+            if content_type == 'text/event-json':
+                yield json.loads(body)
+            elif content_type == 'text/disconnect-notice':
+                self._log.info("Received text/disconnect-notice")
                 return
+            elif content_type != 'command/reply':
+                raise ESLProtocolError(f"Expected event, "
+                                       f"but got {headers!r}")
 
-            name, value = line.decode().split(":", 1)
-            yield name.strip(), value.strip()
+    async def _read_responses(self):
+        try:
+            while self._pending:
+                self._log.debug("Expect api/response")
+                (headers, body) = await self._read_frame()
 
-    async def _read_all_headers(self) -> Dict[str, str]:
-        return {key: value async for key, value in self._read_headers()}
+                if headers["Content-Type"] != 'api/response':
+                    raise ESLProtocolError(f"Expected api response, "
+                                           f"but got {headers!r}")
 
-    async def _read_body(self, headers: Dict[str, str]) -> str:
-        result = ""
+                (future, raw, verb, start) = self._pending.popleft()
+                self.stats.command(verb, time.perf_counter() - start)
+                if not future.done():
+                    future.set_result((headers, body if raw else body.decode()))
+        except BaseException as error:  # pylint: disable=broad-except
+            self._fail_pending(error)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+        finally:
+            self._reader = None
 
-        if "Content-Length" in headers:
-            size = int(headers["Content-Length"])
-            result = (await self._in.readexactly(size)).decode()
+    def _fail_pending(self, error: BaseException):
+        self._broken = error
+        while self._pending:
+            (future, *_) = self._pending.popleft()
+            if not future.done():
+                if isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
 
-        return result
+    @staticmethod
+    def _verb(command: str) -> str:
+        """
+        Returns the name of an (bg)api command, e.g., uuid_dump.
+        """
+        parts = command.split(' ', 2)
+        if parts[0] in ('api', 'bgapi') and len(parts) > 1:
+            return parts[1]
+        return parts[0]
+
+    async def _write(self, command: str):
+        self._out.write(f'{command}\n\n'.encode())
+        await self._out.drain()
+
+    async def _read_frame(self) -> Tuple[Dict[str, str], bytes]:
+        while True:
+            frame = self._parser.next_frame()
+            if frame is not None:
+                self.stats.frame()
+                return frame
+
+            data = await self._in.read(READ_SIZE)
+            if not data:
+                raise ESLHeaderError("Encountered EOF "
+                                     "while reading response")
+            self.stats.read(len(data))
+            self._parser.feed(data)
@@ -0,0 +1,225 @@
+"""
+Table driven encoding of gauge families in prometheus text format.
+"""
+# pylint: disable=too-few-public-methods
+
+from typing import Iterator, List
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+# Rows of a gauge family encoded at a time when rendering in chunks.
+CHUNK_ROWS = 1000
+
+
+def _escape(value: str) -> str:
+    """
+    Escapes a label value the same way prometheus_client does.
+    """
+    if '\\' in value or '\n' in value or '"' in value:
+        return value.replace('\\', r'\\').replace('\n', r'\n') \
+            .replace('"', r'\"')
+    return value
+
+
+def _format(value) -> str:
+    """
+    Formats a sample value the same way as floatToGoString().
+    """
+    text = repr(float(value))
+    # Leave exponents and special values to prometheus_client.
+    if text.find('.') > 6 or text[-1] in 'fn':
+        return floatToGoString(value)
+    return text
+
+
+class GaugeDefinition():
+    """
+    Static part of a gauge family. The HELP and TYPE header is encoded once
+    when the definition is created.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: List[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+        doc = documentation.replace('\\', r'\\').replace('\n', r'\n')
+        self.header = f'# HELP {name} {doc}\n# TYPE {name} gauge\n'.encode()
+
+        # Samples are rendered with label names in sorted order.
+        self._order = sorted(range(len(self.labels)),
+                             key=lambda index: self.labels[index])
+        self._prefixes = [
+            ('{' if position == 0 else '",') + self.labels[index] + '="'
+            for position, index in enumerate(self._order)]
+
+    def family(self) -> 'GaugeRows':
+        """
+        Returns an empty family collecting the rows of one scrape.
+        """
+        return GaugeRows(self)
+
+    def encode(self, rows) -> bytes:
+        """
+        Encodes the header followed by a sample line for every row.
+        """
+        return self.header + self._lines(rows)
+
+    def iter_encode(self, rows, size: int) -> Iterator[bytes]:
+        """
+        Yields the header followed by the sample lines of size rows at a
+        time.
+        """
+        yield self.header
+        for start in range(0, len(rows), size):
+            yield self._lines(rows[start:start + size])
+
+    def _lines(self, rows) -> bytes:
+        name = self.name
+        if not self._order:
+            lines = [f'{name} {_format(value)}\n' for (_, value) in rows]
+        elif len(self._order) == 1:
+            prefix = name + self._prefixes[0]
+            lines = [f'{prefix}{_escape(labelvalues[0])}"}} {_format(value)}\n'
+                     for (labelvalues, value) in rows]
+        else:
+            pairs = list(zip(self._prefixes, self._order))
+            lines = [
+                name + ''.join(prefix + _escape(labelvalues[index])
+                               for prefix, index in pairs) +
+                f'"}} {_format(value)}\n'
+                for (labelvalues, value) in rows]
+
+        return ''.join(lines).encode()
+
+
+class GaugeRows():
+    """
+    Rows of a gauge family collected during one scrape. Provides the
+    attributes of a prometheus_client metric family, but only keeps tuples
+    (label values, value) and builds Sample objects on demand.
+    """
+
+    type = 'gauge'
+    unit = ''
+
+    def __init__(self, definition: GaugeDefinition):
+        self._definition = definition
+        self._rows = []
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the family name.
+        """
+        return self._definition.name
+
+    @property
+    def documentation(self) -> str:
+        """
+        Returns the family help text.
+        """
+        return self._definition.documentation
+
+    @property
+    def labels(self) -> List[str]:
+        """
+        Returns the label names.
+        """
+        return self._definition.labels
+
+    @property
+    def rows(self) -> list:
+        """
+        Returns the tuples (label values, value) added so far.
+        """
+        return self._rows
+
+    @property
+    def samples(self) -> List[Sample]:
+        """
+        Returns the rows as Sample objects.
+        """
+        labels = self._definition.labels
+        return [Sample(self.name, dict(zip(labels, labelvalues)), value, None)
+                for (labelvalues, value) in self._rows]
+
+    def add_metric(self, labelvalues, value):
+        """
+        Adds a row.
+        """
+        self._rows.append((labelvalues, value))
+
+    def encode(self) -> bytes:
+        """
+        Returns the family in prometheus text format.
+        """
+        return self._definition.encode(self._rows)
+
+    def iter_encode(self, size: int) -> Iterator[bytes]:
+        """
+        Yields the family in prometheus text format, size rows at a time.
+        """
+        return self._definition.iter_encode(self._rows, size)
+
+
+class _StaticCollector():
+    """
+    Exposes metric families collected beforehand.
+    """
+
+    def __init__(self, families):
+        self._families = list(families)
+
+    def collect(self):  # pylint: disable=missing-docstring
+        return self._families
+
+
+def _generate(families) -> bytes:
+    registry = CollectorRegistry()
+    registry.register(_StaticCollector(families))
+    return generate_latest(registry)
+
+
+def iter_render(families, size: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Yields metric families in prometheus text format chunk by chunk. Families
+    of type GaugeRows are encoded directly, size rows at a time. Consecutive
+    other families are rendered together by prometheus_client.
+    """
+    pending = []
+    for family in families:
+        if isinstance(family, GaugeRows):
+            if pending:
+                yield _generate(pending)
+                pending = []
+            yield from family.iter_encode(size)
+        else:
+            pending.append(family)
+
+    if pending:
+        yield _generate(pending)
+
+
+def render(families) -> bytes:
+    """
+    Renders metric families in prometheus text format. Families of type
+    GaugeRows are encoded directly, all others by prometheus_client.
+    """
+    output = []
+    pending = []
+    for family in families:
+        if isinstance(family, GaugeRows):
+            if pending:
+                output.append(_generate(pending))
+                pending = []
+            output.append(family.encode())
+        else:
+            pending.append(family)
+
+    if pending:
+        output.append(_generate(pending))
+
+    return b''.join(output)
@@ -0,0 +1,89 @@
+"""
+Selective extraction of values from flat JSON objects.
+"""
+
+import functools
+import json
+
+from typing import Dict, Iterable, Optional
+
+_WHITESPACE = b' \t\r\n'
+
+
+def extract_json_keys(document: bytes,
+                      keys: Iterable[str]) -> Optional[Dict[str, str]]:
+    """
+    Returns the values of the given keys from a flat JSON object, such as the
+    output of `uuid_dump <uuid> json`, without decoding the whole document.
+
+    Keys are located with bytes.find(), which runs in C, and only the values
+    found are decoded. Missing keys are left out of the result. Returns None
+    if the document does not look like a flat object, callers should fall
+    back to json.loads() in that case.
+    """
+    if not document.lstrip(_WHITESPACE).startswith(b'{'):
+        return None
+
+    result = {}
+    for key in keys:
+        needle = _needle(key)
+        pos = document.find(needle)
+        while pos > 0 and not _is_key(document, pos):
+            pos = document.find(needle, pos + 1)
+        if pos < 0:
+            continue
+
+        start = pos + len(needle)
+        while start < len(document) and document[start] in _WHITESPACE:
+            start += 1
+
+        end = _value_end(document, start)
+        if end < 0:
+            return None
+
+        try:
+            result[key] = json.loads(document[start:end])
+        except ValueError:
+            return None
+
+    return result
+
+
+@functools.lru_cache(maxsize=1024)
+def _needle(key: str) -> bytes:
+    return json.dumps(key).encode() + b':'
+
+
+def _is_key(document: bytes, pos: int) -> bool:
+    """
+    Returns True if the string starting at pos is preceded by the start of
+    the object or by a comma, i.e., it is a key and not part of a value.
+    """
+    pos -= 1
+    while pos >= 0 and document[pos] in _WHITESPACE:
+        pos -= 1
+    return pos >= 0 and document[pos] in b'{,'
+
+
+def _value_end(document: bytes, start: int) -> int:
+    """
+    Returns the offset just past the scalar value starting at start.
+    """
+    if document[start:start + 1] == b'"':
+        end = start + 1
+        while True:
+            end = document.find(b'"', end)
+            if end < 0:
+                return -1
+
+            # A quote is escaped if preceded by an odd number of backslashes.
+            backslashes = 0
+            while document[end - backslashes - 1] == 0x5c:
+                backslashes += 1
+            end += 1
+            if backslashes % 2 == 0:
+                return end
+
+    ends = [pos for pos in (document.find(b',', start),
+                            document.find(b'}', start)) if pos >= 0]
+    return min(ends) if ends else -1
@@ -2,17 +2,31 @@
 HTTP API for FreeSWITCH prometheus collector.
 """
 
+import asyncio
 import logging
 import time
 import yaml
 
 from prometheus_client import CONTENT_TYPE_LATEST, Summary, Counter, generate_latest
-from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import HTTPException, InternalServerError
 from werkzeug.routing import Map, Rule
 from werkzeug.serving import run_simple
 from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import ClosingIterator
 
-from freeswitch_exporter.collector import collect_esl
+from freeswitch_exporter.admission import AdmissionError
+from freeswitch_exporter.collector import (
+    ChannelCollector, collect_esl, collect_esl_async, collect_esl_many,
+    collect_esl_many_async, stream_esl)
+from freeswitch_exporter.compression import aiter_compress, compress, \
+    iter_compress, negotiate
+from freeswitch_exporter.deadline import TIMEOUT_HEADER, Deadline, \
+    scrape_timeout
+from freeswitch_exporter.profiling import ProfileInProgress, profile_esl
+from freeswitch_exporter.server import serve
+from freeswitch_exporter.singleflight import AsyncSingleFlight, SingleFlight
+from freeswitch_exporter.snapshot import SnapshotScheduler
+from freeswitch_exporter.target import TargetRegistry
 
 
 class FreeswitchExporterApplication():
@@ -20,12 +34,20 @@ class FreeswitchExporterApplication():
     FreeSWITCH prometheus collector HTTP handler.
     """
 
-    # pylint: disable=no-self-use
+    # pylint: disable=no-self-use,too-many-instance-attributes
 
-    def __init__(self, config, duration, errors):
+    # pylint: disable=too-many-arguments
+    def __init__(self, config, duration, errors, *, targets=None,
+                 snapshots=None, coalesced=None, deadline_exceeded=None):
         self._config = config
         self._duration = duration
         self._errors = errors
+        self._targets = targets
+        self._snapshots = snapshots
+        self._coalesced = coalesced
+        self._deadline_exceeded = deadline_exceeded
+        self._inflight = SingleFlight()
+        self._inflight_async = AsyncSingleFlight()
 
         self._log = logging.getLogger(__name__)
 
@@ -33,32 +55,341 @@ class FreeswitchExporterApplication():
             Rule('/', endpoint='index'),
             Rule('/metrics', endpoint='metrics'),
             Rule('/esl', endpoint='esl'),
+            Rule('/debug/profile', endpoint='profile'),
         ])
 
         self._args = {
-            'esl': ['module', 'target']
+            'esl': ['module', 'target', 'max_age', 'group'],
+            'profile': ['module', 'target', 'top'],
+        }
+
+        self._headers = {
+            'esl': {TIMEOUT_HEADER: 'timeout_header'}
         }
 
         self._views = {
             'index': self.on_index,
             'metrics': self.on_metrics,
             'esl': self.on_esl,
+            'profile': self.on_profile,
         }
 
-    def on_esl(self, module='default', target='localhost'):
+        self._async_views = {
+            'esl': self.on_esl_async,
+            'profile': self.on_profile_async,
+        }
+
+    def on_esl(self, module='default', target='localhost', max_age=None,
+               group=None, timeout_header=None):
         """
         Request handler for /esl route
         """
 
-        if module in self._config:
+        hosts = self._hosts(module, target, group)
+        deadline = self._deadline(module, timeout_header)
+
+        if module not in self._config:
+            response = Response(f"Module '{module}' not found in config")
+            response.status_code = 400
+        elif hosts is None:
+            response = Response(f"Group '{group}' not found in module "
+                                f"'{module}'")
+            response.status_code = 400
+        elif isinstance(deadline, Response):
+            response = deadline
+        elif len(hosts) > 1 or group is not None:
             start = time.time()
-            output = collect_esl(self._config[module], target)
-            response = Response(output)
-            response.headers['content-type'] = CONTENT_TYPE_LATEST
-            self._duration.labels(module).observe(time.time() - start)
+            (output, shared) = self._inflight.call(
+                (module, tuple(hosts)),
+                lambda: collect_esl_many(self._config[module], hosts,
+                                         self._targets, module, deadline),
+                deadline)
+            response = self._on_collected(module, output, shared, start)
+        elif self._snapshots is not None \
+                and self._snapshots.manages(module, hosts[0]):
+            response = self._on_snapshot(module, hosts[0], max_age)
+        elif self._targets is not None and self._config[module].get('stream'):
+            response = self._on_streamed(module, stream_esl(
+                self._config[module], hosts[0], self._targets, module,
+                deadline))
         else:
+            start = time.time()
+            (output, shared) = self._inflight.call(
+                (module, hosts[0]),
+                lambda: collect_esl(self._config[module], hosts[0],
+                                    self._targets, module, deadline),
+                deadline)
+            response = self._on_collected(module, output, shared, start)
+
+        return response
+
+    async def on_esl_async(self, module='default', target='localhost',
+                           max_age=None, group=None, timeout_header=None):
+        """
+        Request handler for /esl route when running on an asyncio server.
+        Collectors are awaited directly on the server loop.
+        """
+
+        hosts = self._hosts(module, target, group)
+        deadline = self._deadline(module, timeout_header)
+
+        if module not in self._config:
+            response = Response(f"Module '{module}' not found in config")
+            response.status_code = 400
+        elif hosts is None:
+            response = Response(f"Group '{group}' not found in module "
+                                f"'{module}'")
+            response.status_code = 400
+        elif isinstance(deadline, Response):
+            response = deadline
+        elif len(hosts) > 1 or group is not None:
+            start = time.time()
+            (output, shared) = await self._inflight_async.call(
+                (module, tuple(hosts)),
+                lambda: collect_esl_many_async(self._config[module], hosts,
+                                               self._targets, module,
+                                               deadline),
+                deadline)
+            response = self._on_collected(module, output, shared, start)
+        elif self._snapshots is not None \
+                and self._snapshots.manages(module, hosts[0]):
+            response = self._on_snapshot(module, hosts[0], max_age)
+        else:
+            config = self._config[module]
+            state = None
+            if self._targets is not None:
+                state = self._targets.get(module, hosts[0], config)
+
+            if config.get('stream'):
+                response = await self._on_streamed_async(
+                    module, ChannelCollector(hosts[0], config, state)
+                    .stream_async(deadline))
+            else:
+                start = time.time()
+                (output, shared) = await self._inflight_async.call(
+                    (module, hosts[0]),
+                    lambda: collect_esl_async(config, hosts[0], state,
+                                              deadline),
+                    deadline)
+                response = self._on_collected(module, output, shared, start)
+
+        return response
+
+    def on_profile(self, module='default', target='localhost', top='25'):
+        """
+        Request handler for /debug/profile route
+        """
+
+        profile = self._profile(module, target, top)
+        if isinstance(profile, Response):
+            return profile
+
+        run = self._targets.run if self._targets is not None else asyncio.run
+        try:
+            return Response(run(profile))
+        except ProfileInProgress as error:
+            return self._on_profile_busy(error)
+
+    async def on_profile_async(self, module='default', target='localhost',
+                               top='25'):
+        """
+        Request handler for /debug/profile route when running on an asyncio
+        server.
+        """
+
+        profile = self._profile(module, target, top)
+        if isinstance(profile, Response):
+            return profile
+
+        try:
+            return Response(await profile)
+        except ProfileInProgress as error:
+            return self._on_profile_busy(error)
+
+    def _profile(self, module, target, top):
+        """
+        Returns the coroutine profiling a collection or an error response.
+        """
+        repeated = [name for (name, value) in (('module', module),
+                                                ('target', target),
+                                                ('top', top))
+                    if isinstance(value, list)]
+        if repeated:
+            response = Response(f"Parameter '{repeated[0]}' given more than "
+                                f"once")
+            response.status_code = 400
+            return response
+        if module not in self._config:
             response = Response(f"Module '{module}' not found in config")
             response.status_code = 400
+            return response
+        if not self._config[module].get('profiling'):
+            response = Response(f"Profiling not enabled for module '{module}'")
+            response.status_code = 404
+            return response
+        if not top.isdigit():
+            response = Response(f"Invalid top '{top}'")
+            response.status_code = 400
+            return response
+
+        config = self._config[module]
+        try:
+            deadline = Deadline(scrape_timeout(config))
+        except ValueError as error:
+            response = Response(f"Invalid scrape timeout: {error}")
+            response.status_code = 400
+            return response
+
+        state = None
+        if self._targets is not None:
+            state = self._targets.get(module, target, config)
+        return profile_esl(config, target, state, deadline, int(top))
+
+    @staticmethod
+    def _on_profile_busy(error):
+        response = Response(str(error))
+        response.status_code = 503
+        return response
+
+    def _hosts(self, module, target, group):
+        if group is not None:
+            return self._config.get(module, {}).get('groups', {}).get(group)
+
+        return target if isinstance(target, list) else [target]
+
+    def _deadline(self, module, timeout_header):
+        """
+        Returns the deadline of a scrape or an error response if the timeout
+        is invalid.
+        """
+        try:
+            timeout = scrape_timeout(self._config.get(module) or {},
+                                     timeout_header)
+        except ValueError as error:
+            response = Response(f"Invalid scrape timeout "
+                                f"'{timeout_header}': {error}")
+            response.status_code = 400
+            return response
+
+        on_exceeded = None
+        if self._deadline_exceeded is not None:
+            on_exceeded = self._deadline_exceeded.labels(module).inc
+        return Deadline(timeout, on_exceeded)
+
+    def _on_collected(self, module, output, shared, start):
+        response = Response(output)
+        response.headers['content-type'] = CONTENT_TYPE_LATEST
+        if not shared:
+            self._duration.labels(module).observe(time.time() - start)
+        elif self._coalesced is not None:
+            self._coalesced.labels(module).inc()
+
+        return response
+
+    def _on_streamed(self, module, chunks):
+        """
+        Returns a response streaming the chunks of a collection. The first
+        chunk is collected before the response starts, hence failures to
+        connect are answered with an error status. Failures after the
+        response started abort the connection.
+
+        The server closes the response when done or when the client went
+        away, which closes chunks and releases the connection of the
+        collection right away. Even if the body was never started.
+        """
+        start = time.time()
+        first = next(chunks)
+
+        def body():
+            try:
+                yield first
+                yield from chunks
+            except Exception:
+                self._log.exception("Exception thrown while streaming")
+                self._errors.labels(module).inc()
+                raise
+            self._duration.labels(module).observe(time.time() - start)
+
+        response = Response(ClosingIterator(body(), chunks.close))
+        response.headers['content-type'] = CONTENT_TYPE_LATEST
+        return response
+
+    async def _on_streamed_async(self, module, chunks):
+        """
+        Returns a response streaming the chunks of a collection from an
+        async iterator, see _on_streamed(). Only supported by the asyncio
+        server.
+        """
+        start = time.time()
+        # pylint: disable-next=unnecessary-dunder-call
+        first = await chunks.__anext__()
+
+        async def body():
+            try:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+            except Exception:
+                self._log.exception("Exception thrown while streaming")
+                self._errors.labels(module).inc()
+                raise
+            finally:
+                await chunks.aclose()
+            self._duration.labels(module).observe(time.time() - start)
+
+        response = Response(body())
+        response.headers['content-type'] = CONTENT_TYPE_LATEST
+        return response
+
+    @staticmethod
+    def _on_rejected(error):
+        response = Response(str(error))
+        response.status_code = error.status
+        return response
+
+    def _encode(self, response, headers):
+        """
+        Compresses exposition responses with the encoding negotiated from
+        the Accept-Encoding request header.
+        """
+        if response.headers.get('content-type') != CONTENT_TYPE_LATEST or \
+                response.status_code != 200:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = None
+        if headers is not None:
+            encoding = negotiate(headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if hasattr(response.response, '__aiter__'):
+            response.response = aiter_compress(response.response, encoding)
+        elif response.is_streamed:
+            chunks = response.response
+            response.response = ClosingIterator(
+                iter_compress(chunks, encoding), getattr(chunks, 'close', None))
+        else:
+            response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _on_snapshot(self, module, target, max_age):
+        try:
+            max_age = float(max_age or self._snapshots.max_age(module))
+        except ValueError:
+            response = Response(f"Invalid max_age '{max_age}'")
+            response.status_code = 400
+            return response
+
+        snapshot = self._snapshots.get(module, target)
+        if snapshot is None or snapshot.age() > max_age:
+            response = Response(f"No snapshot of '{target}' younger than "
+                                f"{max_age}s available")
+            response.status_code = 503
+        else:
+            response = Response(snapshot.render())
+            response.headers['content-type'] = CONTENT_TYPE_LATEST
 
         return response
 
@@ -90,33 +421,84 @@ class FreeswitchExporterApplication():
 
         return response
 
-    def view(self, endpoint, values, args):
+    def view(self, endpoint, values, args, headers=None):
         """
         Werkzeug views mapping method.
         """
 
-        params = dict(values)
-        if endpoint in self._args:
-            params.update({key: args[key] for key in self._args[endpoint] if key in args})
+        params = self._params(endpoint, values, args, headers)
 
         try:
-            return self._views[endpoint](**params)
+            return self._encode(self._views[endpoint](**params), headers)
+        except AdmissionError as error:
+            return self._on_rejected(error)
         except Exception as error:  # pylint: disable=broad-except
             self._log.exception("Exception thrown while rendering view")
             self._errors.labels(args.get('module', 'default')).inc()
             raise InternalServerError from error
 
+    async def view_async(self, endpoint, values, args, headers=None):
+        """
+        Asyncio views mapping method.
+        """
+
+        params = self._params(endpoint, values, args, headers)
+
+        try:
+            if endpoint in self._async_views:
+                response = await self._async_views[endpoint](**params)
+            else:
+                response = self._views[endpoint](**params)
+            return self._encode(response, headers)
+        except AdmissionError as error:
+            return self._on_rejected(error)
+        except Exception as error:  # pylint: disable=broad-except
+            self._log.exception("Exception thrown while rendering view")
+            self._errors.labels(args.get('module', 'default')).inc()
+            raise InternalServerError from error
+
+    async def dispatch_async(self, path, args, headers=None):
+        """
+        Routes a request received by the asyncio server. Returns a werkzeug
+        Response.
+        """
+
+        urls = self._url_map.bind('localhost')
+        try:
+            endpoint, values = urls.match(path)
+            return await self.view_async(endpoint, values, args, headers)
+        except HTTPException as error:
+            return error.get_response()
+
+    def _params(self, endpoint, values, args, headers=None):
+        params = dict(values)
+        for key in self._args.get(endpoint, []):
+            # Repeated parameters are passed as a list.
+            value = args.getlist(key)
+            if len(value) == 1:
+                params[key] = value[0]
+            elif len(value) > 1:
+                params[key] = value
+
+        for (header, key) in self._headers.get(endpoint, {}).items():
+            if headers is not None and header in headers:
+                params[key] = headers[header]
+
+        return params
+
 
     @Request.application
     def __call__(self, request):
         urls = self._url_map.bind_to_environ(request.environ)
-        view_func = lambda endpoint, values: self.view(endpoint, values, request.args)
+        view_func = lambda endpoint, values: self.view(endpoint, values, request.args,
+                                                       request.headers)
         return urls.dispatch(view_func, catch_http_exceptions=True)
 
 
-def start_http_server(config_path, port, address=''):
+def create_application(config_path, loop=None):
     """
-    Start a HTTP API server for FreeSWITCH prometheus collector.
+    Load configuration and set up a FreeSWITCH exporter application. Pass the
+    running loop if the application is served by the asyncio server.
     """
 
     duration = Summary(
@@ -129,6 +511,16 @@ def start_http_server(config_path, port, address=''):
         'Errors in requests to FreeSWITCH exporter',
         ['module'],
     )
+    coalesced = Counter(
+        'freeswitch_coalesced_requests_total',
+        'Requests served from a collection already in flight',
+        ['module'],
+    )
+    deadline_exceeded = Counter(
+        'freeswitch_exporter_deadline_exceeded_total',
+        'Collections cut short or failed because of the scrape deadline',
+        ['module'],
+    )
 
     # Load configuration.
     with open(config_path) as handle:
@@ -140,6 +532,37 @@ def start_http_server(config_path, port, address=''):
         errors.labels(module)
         # pylint: disable=no-member
         duration.labels(module)
+        # pylint: disable=no-member
+        coalesced.labels(module)
+        # pylint: disable=no-member
+        deadline_exceeded.labels(module)
+
+    targets = TargetRegistry(loop=loop)
+    snapshots = SnapshotScheduler(config, targets, duration)
+    snapshots.start()
+
+    return FreeswitchExporterApplication(config, duration, errors,
+                                         targets=targets,
+                                         snapshots=snapshots,
+                                         coalesced=coalesced,
+                                         deadline_exceeded=deadline_exceeded)
+
+
+def start_http_server(config_path, port, address='', server='werkzeug'):
+    """
+    Start a HTTP API server for FreeSWITCH prometheus collector.
+
+    With server='asyncio' all requests and collections are handled on a
+    single event loop instead of one werkzeug thread per request.
+    """
+
+    if server == 'asyncio':
+        asyncio.run(_serve_async(config_path, port, address))
+    else:
+        app = create_application(config_path)
+        run_simple(address, port, app, threaded=True)
+
 
-    app = FreeswitchExporterApplication(config, duration, errors)
-    run_simple(address, port, app, threaded=True)
+async def _serve_async(config_path, port, address):
+    app = create_application(config_path, asyncio.get_running_loop())
+    await serve(app, address, port)
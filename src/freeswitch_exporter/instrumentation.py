@@ -0,0 +1,201 @@
+"""
+Latency histograms and throughput counters of scrapes.
+"""
+# pylint: disable=too-few-public-methods
+
+from contextlib import nullcontext
+
+from prometheus_client import REGISTRY, Counter, Histogram
+
+# ESL commands usually complete within milliseconds.
+COMMAND_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1., 2.5, float('inf'))
+
+
+class ScrapeStats():
+    """
+    Scrape instrumentation, labelled by module.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, registry=REGISTRY):
+        self.phases = Histogram(
+            'freeswitch_exporter_phase_duration_seconds',
+            'Duration of the phases of a collection',
+            ['module', 'phase'],
+            registry=registry,
+        )
+        self.commands = Histogram(
+            'freeswitch_exporter_esl_command_duration_seconds',
+            'Duration of ESL commands from submission until the response '
+            'was read, by command verb',
+            ['module', 'command'],
+            buckets=COMMAND_BUCKETS,
+            registry=registry,
+        )
+        self.read_bytes = Counter(
+            'freeswitch_exporter_esl_read_bytes_total',
+            'Bytes read from ESL connections',
+            ['module'],
+            registry=registry,
+        )
+        self.frames = Counter(
+            'freeswitch_exporter_esl_frames_total',
+            'Frames parsed from ESL connections',
+            ['module'],
+            registry=registry,
+        )
+        self.channels_scraped = Counter(
+            'freeswitch_exporter_channels_scraped_total',
+            'Channels whose variables were collected',
+            ['module'],
+            registry=registry,
+        )
+        self.channels_skipped = Counter(
+            'freeswitch_exporter_channels_skipped_total',
+            'Channels skipped because FreeSWITCH answered with -ERR, '
+            'e.g., because the call ended while being scraped',
+            ['module'],
+            registry=registry,
+        )
+        self.cache_hits = Counter(
+            'freeswitch_exporter_cache_hits_total',
+            'Collection results served from the cache, by command class',
+            ['module', 'cache'],
+            registry=registry,
+        )
+        self.cache_misses = Counter(
+            'freeswitch_exporter_cache_misses_total',
+            'Collection results missing from the cache or expired, by '
+            'command class',
+            ['module', 'cache'],
+            registry=registry,
+        )
+
+        self.admission_rejected = Counter(
+            'freeswitch_exporter_admission_rejected_total',
+            'Collections rejected by admission control, because the queue '
+            'of a target was full or the wait for a session timed out',
+            ['module', 'reason'],
+            registry=registry,
+        )
+        self.throttled = Counter(
+            'freeswitch_exporter_esl_throttled_seconds_total',
+            'Time ESL commands waited for the command rate limit',
+            ['module'],
+            registry=registry,
+        )
+
+    def labels(self, module) -> '_ModuleStats':
+        """
+        Returns the instrumentation bound to the given module.
+        """
+        return _ModuleStats(self, module)
+
+
+class _ModuleStats():
+    """
+    Scrape instrumentation bound to a module.
+    """
+
+    def __init__(self, stats: ScrapeStats, module):
+        self._stats = stats
+        self._module = module
+        self._commands = {}
+
+        self.read = stats.read_bytes.labels(module).inc
+        self.frame = stats.frames.labels(module).inc
+        self.channel_scraped = stats.channels_scraped.labels(module).inc
+        self.channel_skipped = stats.channels_skipped.labels(module).inc
+
+    def phase(self, name):
+        """
+        Returns a context manager timing the named phase.
+        """
+        return self._stats.phases.labels(self._module, name).time()
+
+    def observe_phase(self, name, seconds):
+        """
+        Records the duration of a phase measured by the caller.
+        """
+        self._stats.phases.labels(self._module, name).observe(seconds)
+
+    def command(self, verb, seconds):
+        """
+        Records the duration of an ESL command.
+        """
+        observe = self._commands.get(verb)
+        if observe is None:
+            observe = self._stats.commands.labels(self._module, verb).observe
+            self._commands[verb] = observe
+        observe(seconds)
+
+    def cache_hit(self, name, amount=1):
+        """
+        Counts results served from the named cache.
+        """
+        self._stats.cache_hits.labels(self._module, name).inc(amount)
+
+    def cache_miss(self, name, amount=1):
+        """
+        Counts results missing from the named cache.
+        """
+        self._stats.cache_misses.labels(self._module, name).inc(amount)
+
+    def rejected(self, reason):
+        """
+        Counts a collection rejected by admission control.
+        """
+        self._stats.admission_rejected.labels(self._module, reason).inc()
+
+    def throttled(self, seconds):
+        """
+        Records the time an ESL command waited for the rate limit.
+        """
+        self._stats.throttled.labels(self._module).inc(seconds)
+
+
+class _NullStats():
+    """
+    Instrumentation discarding everything.
+    """
+
+    # pylint: disable=missing-docstring
+
+    def read(self, _size):
+        pass
+
+    def frame(self):
+        pass
+
+    def channel_scraped(self):
+        pass
+
+    def channel_skipped(self):
+        pass
+
+    def phase(self, _name):
+        return nullcontext()
+
+    def observe_phase(self, _name, _seconds):
+        pass
+
+    def command(self, _verb, _seconds):
+        pass
+
+    def cache_hit(self, _name, _amount=1):
+        pass
+
+    def cache_miss(self, _name, _amount=1):
+        pass
+
+    def rejected(self, _reason):
+        pass
+
+    def throttled(self, _seconds):
+        pass
+
+
+# Used where no module is known, e.g., outside of a TargetRegistry.
+NULL_STATS = _NullStats()
@@ -0,0 +1,56 @@
+"""
+Shared asyncio event loop running in a background thread.
+"""
+
+import asyncio
+import threading
+
+
+class BackgroundLoop():
+    """
+    Event loop running in a daemon thread. Long lived state such as pooled
+    connections and event subscriptions is bound to this loop.
+
+    Pass an already running loop in order to share it instead of starting a
+    thread. In that case run() must not be called from the loop itself.
+    """
+
+    def __init__(self, name='freeswitch-exporter', loop=None):
+        self._name = name
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Returns the event loop, starting the background thread if necessary.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever,
+                                          name=self._name, daemon=True)
+                thread.start()
+
+            return self._loop
+
+    def run(self, coro):
+        """
+        Runs a coroutine on the background loop and waits for the result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def spawn(self, coro):
+        """
+        Schedules a coroutine on the background loop without waiting for it.
+        Returns a concurrent.futures.Future.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+        # The event loop only keeps weak references to tasks. Hold on to the
+        # future (and through it the task) until the coroutine is done.
+        self._tasks.add(future)
+        future.add_done_callback(self._tasks.discard)
+
+        return future
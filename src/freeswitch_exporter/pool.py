@@ -0,0 +1,259 @@
+"""
+Pool of persistent, authenticated ESL connections.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import logging
+import time
+
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+from prometheus_client import REGISTRY, Counter
+
+from freeswitch_exporter.esl import ESL, ESLError
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+
+class ESLPoolError(ESLError):
+    """
+    Error thrown if the pool cannot provide a connection.
+    """
+
+
+class ESLPoolBusyError(ESLPoolError):
+    """
+    Error thrown if all connections are in use and the caller does not wait.
+    """
+
+
+class _PooledConnection():
+    """
+    Logged-in ESL connection owned by a pool.
+    """
+
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 stats=NULL_STATS):
+        self.esl = ESL(reader, writer, stats)
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+
+    def is_closed(self):
+        """
+        Returns True if either side of the connection went away.
+        """
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    async def close(self):
+        """
+        Closes the underlying stream, ignoring errors on the way.
+        """
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+class ESLPool():
+    """
+    Pool of logged-in ESL connections to a single FreeSWITCH target.
+
+    Connections are bound to the event loop they were opened on. Hence a pool
+    must only ever be used from one loop, see TargetRegistry.run().
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, host, config, stats, esl_stats=NULL_STATS):
+        pool_config = config.get('pool') or {}
+
+        self._host = host
+        self._port = config.get('port', 8021)
+        self._password = config.get('password', 'ClueCon')
+        self._stats = stats
+        self._esl_stats = esl_stats
+
+        # Sharded collections borrow several connections at once.
+        self._max_connections = pool_config.get(
+            'max_connections', config.get('connections', 1))
+        self._idle_timeout = pool_config.get('idle_timeout', 300)
+        self._check_interval = pool_config.get('check_interval', 30)
+        self._check_timeout = pool_config.get('check_timeout', 2)
+        self._backoff_min = pool_config.get('backoff', 1)
+        self._backoff_max = pool_config.get('max_backoff', 60)
+
+        self._idle = []
+        self._closed = False
+        self._slots = None
+        self._backoff = 0
+        self._retry_at = 0
+        self._log = logging.getLogger(__name__)
+
+    @asynccontextmanager
+    async def connection(self, wait=True):
+        """
+        Borrows a logged-in ESL connection and returns it to the pool when
+        done. Connections are discarded if the body raises or if an error
+        left them unusable.
+
+        If wait is False, raises ESLPoolBusyError instead of waiting for a
+        connection to be returned when max_connections are borrowed.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_connections)
+
+        if not wait and self._slots.locked():
+            raise ESLPoolBusyError(f"All {self._max_connections} connections "
+                                   f"to {self._host}:{self._port} are in use")
+
+        async with self._slots:
+            conn = await self._acquire()
+            try:
+                yield conn.esl
+            except BaseException:
+                await conn.close()
+                raise
+            if conn.esl.broken or self._closed:
+                await conn.close()
+                return
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+
+    async def evict(self, idle_timeout=None):
+        """
+        Closes idle connections which have not been used for longer than
+        idle_timeout seconds (defaults to the configured idle timeout).
+        """
+        if idle_timeout is None:
+            idle_timeout = self._idle_timeout
+
+        deadline = time.monotonic() - idle_timeout
+        expired = [conn for conn in self._idle if conn.last_used <= deadline]
+        self._idle = [conn for conn in self._idle if conn.last_used > deadline]
+        for conn in expired:
+            self._log.debug("Evicting idle connection to %s:%s",
+                            self._host, self._port)
+            await conn.close()
+
+    async def close(self):
+        """
+        Closes all idle connections. Connections borrowed at the time are
+        closed when returned.
+        """
+        self._closed = True
+        await self.evict(idle_timeout=0)
+
+    async def _acquire(self):
+        await self.evict()
+
+        reconnect = False
+        while self._idle:
+            conn = self._idle.pop()
+            if await self._is_alive(conn):
+                self._stats.hit()
+                return conn
+            await conn.close()
+            reconnect = True
+
+        self._stats.miss()
+        if reconnect:
+            self._stats.reconnect()
+        return await self._open()
+
+    async def _is_alive(self, conn):
+        if conn.is_closed() or conn.esl.broken:
+            return False
+
+        if time.monotonic() - conn.last_used < self._check_interval:
+            return True
+
+        try:
+            await asyncio.wait_for(conn.esl.send('api version'),
+                                   self._check_timeout)
+        except (ESLError, OSError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError):
+            return False
+
+        return True
+
+    async def _open(self):
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise ESLPoolError(f"Backing off connection to "
+                               f"{self._host}:{self._port} for "
+                               f"{self._retry_at - now:.1f}s")
+
+        try:
+            reader, writer = await asyncio.open_connection(
+                self._host, self._port)
+        except OSError:
+            self._fail()
+            raise
+
+        conn = _PooledConnection(reader, writer, self._esl_stats)
+        try:
+            await conn.esl.initialize()
+            if not await conn.esl.login(self._password):
+                raise ESLPoolError(f"Login to {self._host}:{self._port} "
+                                   f"failed")
+        except asyncio.CancelledError:
+            # The caller gave up, e.g., its deadline expired. That says
+            # nothing about the target, hence no backoff.
+            await conn.close()
+            raise
+        except BaseException:
+            await conn.close()
+            self._fail()
+            raise
+
+        self._backoff = 0
+        self._retry_at = 0
+        return conn
+
+    def _fail(self):
+        self._backoff = min(self._backoff_max,
+                            max(self._backoff_min, self._backoff * 2))
+        self._retry_at = time.monotonic() + self._backoff
+
+
+class ESLPoolStats():
+    """
+    Pool usage counters, labelled by module.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self._hits = Counter(
+            'freeswitch_pool_hits_total',
+            'ESL connections reused from the pool',
+            ['module'],
+            registry=registry,
+        )
+        self._misses = Counter(
+            'freeswitch_pool_misses_total',
+            'ESL connections opened because the pool had none available',
+            ['module'],
+            registry=registry,
+        )
+        self._reconnects = Counter(
+            'freeswitch_pool_reconnects_total',
+            'ESL connections reopened after a dead connection was discarded',
+            ['module'],
+            registry=registry,
+        )
+
+    def labels(self, module):
+        """
+        Returns the counters bound to the given module.
+        """
+        return _PoolStats(
+            self._hits.labels(module).inc,
+            self._misses.labels(module).inc,
+            self._reconnects.labels(module).inc)
+
+
+_PoolStats = namedtuple('_PoolStats', ['hit', 'miss', 'reconnect'])
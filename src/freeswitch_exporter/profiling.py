@@ -0,0 +1,168 @@
+"""
+Profiling of a single collection on demand.
+"""
+# pylint: disable=too-few-public-methods
+
+import collections
+import copy
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+from freeswitch_exporter.collector import collect_esl_async
+from freeswitch_exporter.instrumentation import NULL_STATS
+
+# Frames excluded from allocation sites.
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+class ProfileInProgress(Exception):
+    """
+    Error thrown if another collection is being profiled.
+    """
+
+
+class _RecordingStats():
+    """
+    Scrape instrumentation recording the phases and ESL commands of one
+    collection, in addition to passing them on.
+    """
+
+    def __init__(self, stats):
+        self._stats = stats
+        # name -> [wall seconds, cpu seconds]
+        self.phases = collections.defaultdict(lambda: [0., 0.])
+        # verb -> list of seconds
+        self.commands = collections.defaultdict(list)
+
+    def __getattr__(self, name):
+        return getattr(self._stats, name)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the named phase by wall clock and by CPU time of the thread.
+        """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            with self._stats.phase(name):
+                yield
+        finally:
+            self.phases[name][0] += time.perf_counter() - wall
+            self.phases[name][1] += time.thread_time() - cpu
+
+    def observe_phase(self, name, seconds):
+        """
+        Records a phase measured by the caller, which is CPU bound.
+        """
+        self._stats.observe_phase(name, seconds)
+        self.phases[name][0] += seconds
+        self.phases[name][1] += seconds
+
+    def command(self, verb, seconds):
+        """
+        Records the duration of an ESL command.
+        """
+        self._stats.command(verb, seconds)
+        self.commands[verb].append(seconds)
+
+
+class _Profiler():
+    """
+    Allows one profile at a time, cProfile and tracemalloc are process wide.
+    """
+
+    active = False
+
+
+async def profile_esl(config, host, target=None, deadline=None, top=25):
+    """
+    Collects a host once under cProfile and tracemalloc. Returns a plain
+    text report listing the phases with the time spent awaiting, the ESL
+    commands, the top functions and the top allocation sites.
+
+    The profile covers everything running on the event loop meanwhile.
+    Raises ProfileInProgress if another profile is running.
+    """
+    if _Profiler.active:
+        raise ProfileInProgress("Another collection is being profiled")
+    _Profiler.active = True
+
+    # State is shared with regular scrapes, only the stats are recorded.
+    stats = _RecordingStats(target.stats if target is not None
+                            else NULL_STATS)
+    if target is not None:
+        target = copy.copy(target)
+        target.stats = stats
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        profiler.enable()
+        try:
+            output = await collect_esl_async(config, host, target, deadline)
+        finally:
+            profiler.disable()
+        wall = time.perf_counter() - wall
+        cpu = time.thread_time() - cpu
+        allocations = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+        _Profiler.active = False
+
+    report = io.StringIO()
+    report.write(
+        f"Collection of {host}: {wall * 1000:.1f} ms wall clock, "
+        f"{cpu * 1000:.1f} ms CPU, {len(output)} bytes, peak traced memory "
+        f"{peak / 1024:.0f} KiB. Timings are inflated by the profilers.\n")
+    _report_phases(report, stats.phases)
+    _report_commands(report, stats.commands)
+    _report_profile(report, profiler, allocations, top)
+    return report.getvalue()
+
+
+def _report_phases(report, phases):
+    report.write(f"\n{'phase':<16} {'wall ms':>10} {'cpu ms':>10} "
+                 f"{'awaiting ms':>12}\n")
+    for name, (wall, cpu) in phases.items():
+        report.write(f"{name:<16} {wall * 1000:>10.1f} {cpu * 1000:>10.1f} "
+                     f"{max(0., wall - cpu) * 1000:>12.1f}\n")
+
+
+def _report_commands(report, commands):
+    report.write(f"\n{'command':<24} {'count':>8} {'total ms':>10} "
+                 f"{'mean ms':>10} {'max ms':>10}\n")
+    for verb, durations in sorted(commands.items(),
+                                  key=lambda item: -sum(item[1])):
+        total = sum(durations)
+        report.write(f"{verb:<24} {len(durations):>8} {total * 1000:>10.1f} "
+                     f"{total / len(durations) * 1000:>10.3f} "
+                     f"{max(durations) * 1000:>10.3f}\n")
+
+
+def _report_profile(report, profiler, allocations, top):
+    for (sort, title) in (('cumulative', 'cumulative'), ('tottime', 'own')):
+        report.write(f"\nTop functions by {title} time:\n")
+        pstats.Stats(profiler, stream=report).sort_stats(sort) \
+            .print_stats(top)
+
+    report.write("\nTop allocation sites of memory still held:\n")
+    for statistic in allocations.statistics('lineno')[:top]:
+        report.write(f"{statistic}\n")
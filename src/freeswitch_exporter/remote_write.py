@@ -0,0 +1,434 @@
+"""
+Push mode sending collections to a Prometheus remote write endpoint.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import struct
+import time
+
+from typing import Iterable, Tuple
+
+import requests
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+from freeswitch_exporter.collector import ChannelCollector
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.exposition import GaugeRows
+from freeswitch_exporter.target import TargetRegistry
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# Headers of remote write 1.0 requests.
+HEADERS = {
+    'Content-Encoding': 'snappy',
+    'Content-Type': 'application/x-protobuf',
+    'User-Agent': 'freeswitch_exporter',
+    'X-Prometheus-Remote-Write-Version': '0.1.0',
+}
+
+# Value of the samples marking a series as gone, a NaN with a payload only
+# Prometheus gives a meaning to. Kept as bytes since NaN payloads do not
+# survive arithmetic.
+STALE_NAN = struct.pack('<Q', 0x7ff0000000000002)
+
+# Largest literal of the uncompressed snappy fallback.
+SNAPPY_LITERAL = 65536
+
+_DOUBLE = struct.Struct('<d')
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# Varints of lengths up to 16383, which take up to two bytes.
+_VARINTS = [_encode_varint(value) for value in range(1 << 14)]
+
+
+def _varint(value: int) -> bytes:
+    if value < len(_VARINTS):
+        return _VARINTS[value]
+    return _encode_varint(value)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """
+    Returns a length delimited protobuf field.
+    """
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_labels(labels: Iterable[Tuple[str, str]]) -> bytes:
+    """
+    Returns the label fields of a prometheus.TimeSeries message. Labels must
+    be sorted by name.
+    """
+    fields = []
+    for (name, value) in labels:
+        value = value.encode()
+        label = _label_name(name) + b'\x12' + _varint(len(value)) + value
+        fields.append(b'\x0a' + _varint(len(label)) + label)
+    return b''.join(fields)
+
+
+@functools.lru_cache(maxsize=1024)
+def _label_name(name: str) -> bytes:
+    return _field(1, name.encode())
+
+
+def series_prefix(labels: bytes, timestamp_size: int) -> bytes:
+    """
+    Returns the start of the field of a prometheus.WriteRequest holding one
+    TimeSeries with a single sample, up to the sample value. The field is
+    completed by the value as little endian double, b'\\x10' and the
+    varint of the timestamp in milliseconds since the epoch.
+
+    The prefix only depends on the labels and the size of the timestamp,
+    hence it is kept along with every series. WriteRequest only has
+    repeated fields, the message of a batch is the concatenation of the
+    fields of its series.
+    """
+    sample = _DOUBLE.size + timestamp_size + 2
+    series = labels + b'\x12' + _varint(sample) + b'\x09'
+    return b'\x0a' + _varint(len(series) + sample - 1) + series
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """
+    Returns data in the snappy block format of remote write. Without the
+    python-snappy package, data is framed as uncompressed literals, which
+    every decoder accepts, but which are not any smaller.
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+
+    chunks = [_varint(len(data))]
+    for offset in range(0, len(data), SNAPPY_LITERAL):
+        literal = data[offset:offset + SNAPPY_LITERAL]
+        # Tag 61: the literal length minus one follows in two bytes.
+        chunks.append(struct.pack('<BH', 61 << 2, len(literal) - 1))
+        chunks.append(literal)
+    return b''.join(chunks)
+
+
+class RemoteWriteStats():
+    """
+    Instrumentation of the remote write push mode.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, registry=REGISTRY):
+        self.samples = Counter(
+            'freeswitch_exporter_remote_write_samples_total',
+            'Samples sent to the remote write endpoint',
+            registry=registry,
+        )
+        self.sent_bytes = Counter(
+            'freeswitch_exporter_remote_write_sent_bytes_total',
+            'Compressed bytes sent to the remote write endpoint',
+            registry=registry,
+        )
+        self.requests = Counter(
+            'freeswitch_exporter_remote_write_requests_total',
+            'Remote write requests by response status class, error if no '
+            'response was received',
+            ['status'],
+            registry=registry,
+        )
+        self.retries = Counter(
+            'freeswitch_exporter_remote_write_retries_total',
+            'Remote write requests retried after a failure',
+            registry=registry,
+        )
+        self.dropped = Counter(
+            'freeswitch_exporter_remote_write_dropped_samples_total',
+            'Samples dropped because the queue was full or the endpoint '
+            'rejected them',
+            ['reason'],
+            registry=registry,
+        )
+        self.pending = Gauge(
+            'freeswitch_exporter_remote_write_pending_samples',
+            'Samples queued for sending',
+            registry=registry,
+        )
+        self.duration = Histogram(
+            'freeswitch_exporter_remote_write_request_duration_seconds',
+            'Duration of remote write requests',
+            registry=registry,
+        )
+        self.collection_errors = Counter(
+            'freeswitch_exporter_remote_write_collection_errors_total',
+            'Failed collections of the push mode',
+            registry=registry,
+        )
+
+
+class _Shard():
+    """
+    Queue of encoded series of one sender, dropping the oldest ones beyond
+    capacity.
+    """
+
+    def __init__(self, capacity):
+        self.pending = collections.deque(maxlen=capacity)
+        self.ready = asyncio.Event()
+        self.session = requests.Session()
+
+    def extend(self, entries) -> int:
+        """
+        Queues entries. Returns the number of entries dropped.
+        """
+        dropped = max(0, len(self.pending) + len(entries) -
+                      self.pending.maxlen)
+        self.pending.extend(entries)
+        return dropped
+
+    def take(self, count):
+        """
+        Removes and returns up to count of the oldest entries.
+        """
+        count = min(count, len(self.pending))
+        return [self.pending.popleft() for _ in range(count)]
+
+
+class RemoteWriter():
+    """
+    Sends samples to a remote write endpoint.
+
+    Series are spread over shards by hash, every shard queues up to
+    capacity / shards samples and one sender coroutine posts them in batches
+    of up to max_samples_per_send, or whatever is queued after
+    batch_timeout seconds. Samples of a series are sent in order. Full
+    queues drop their oldest samples. Failed requests are retried with
+    exponential backoff while new samples keep queueing, unless the endpoint
+    rejects the batch with a 4xx status other than 429.
+
+    Must only be used from one event loop.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, url, config=None, stats=None):
+        config = config if isinstance(config, dict) else {}
+        self._url = url
+        self._stats = stats if stats is not None else RemoteWriteStats()
+        self._max_samples = config.get('max_samples_per_send', 2000)
+        self._batch_timeout = config.get('batch_timeout', 5)
+        self._backoff = (config.get('min_backoff', .03),
+                         config.get('max_backoff', 5))
+        self._request = {
+            'headers': dict(HEADERS, **config.get('headers', {})),
+            'timeout': config.get('timeout', 30),
+        }
+        if 'basic_auth' in config:
+            self._request['auth'] = (config['basic_auth']['username'],
+                                     config['basic_auth']['password'])
+
+        shards = config.get('shards', 4)
+        capacity = max(1, config.get('capacity', 100000) // shards)
+        self._shards = [_Shard(capacity) for _ in range(shards)]
+        self._stats.pending.set_function(
+            lambda: sum(len(shard.pending) for shard in self._shards))
+        # source -> (timestamp size, {series key: (prefix, shard)})
+        self._series = {}
+        self._executor = None
+        self._senders = []
+
+    def add(self, source, families, labels, timestamp=None):
+        """
+        Queues the samples of families, adding labels to every series
+        unless already present. Series of the previous call with the same
+        source which are missing now are sent as stale.
+        """
+        timestamp = _varint(int((timestamp or time.time()) * 1000))
+        suffix = b'\x10' + timestamp
+        (size, previous) = self._series.get(source, (0, {}))
+        if size != len(timestamp):
+            # Prefixes depend on the size of the timestamp.
+            previous = {}
+        current = {}
+        batches = [[] for _ in self._shards]
+
+        for (key, names, value) in _iter_samples(families):
+            entry = previous.get(key)
+            if entry is None:
+                entry = self._entry(key, names, labels, len(timestamp))
+            current[key] = entry
+            batches[entry[1]].append(
+                entry[0] + _DOUBLE.pack(float(value)) + suffix)
+
+        for key in previous.keys() - current.keys():
+            entry = previous[key]
+            batches[entry[1]].append(entry[0] + STALE_NAN + suffix)
+        self._series[source] = (len(timestamp), current)
+        self._enqueue(batches)
+
+    def _enqueue(self, batches):
+        for shard, batch in zip(self._shards, batches):
+            dropped = shard.extend(batch)
+            if dropped:
+                self._stats.dropped.labels('queue_full').inc(dropped)
+            if len(shard.pending) >= self._max_samples:
+                shard.ready.set()
+
+    def _entry(self, key, names, labels, timestamp_size):
+        """
+        Returns a tuple (prefix, shard) for a new series.
+        """
+        merged = dict(labels, **dict(zip(names, key[1])))
+        merged['__name__'] = key[0]
+        merged = tuple(sorted(merged.items()))
+        return (series_prefix(encode_labels(merged), timestamp_size),
+                hash(merged) % len(self._shards))
+
+    def start(self):
+        """
+        Starts the sender coroutines.
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            len(self._shards), thread_name_prefix='remote-write')
+        self._senders = [asyncio.ensure_future(self._send(shard))
+                         for shard in self._shards]
+
+    async def close(self):
+        """
+        Stops the sender coroutines, samples still queued are discarded.
+        """
+        for sender in self._senders:
+            sender.cancel()
+        await asyncio.gather(*self._senders, return_exceptions=True)
+        self._senders = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        for shard in self._shards:
+            shard.session.close()
+
+    async def _send(self, shard):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(shard.pending) < self._max_samples:
+                try:
+                    await asyncio.wait_for(shard.ready.wait(),
+                                           self._batch_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                shard.ready.clear()
+
+            batch = shard.take(self._max_samples)
+            if not batch:
+                continue
+            payload = snappy_compress(b''.join(batch))
+
+            backoff = self._backoff[0]
+            while not await self._post(loop, shard, payload, len(batch)):
+                self._stats.retries.inc()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self._backoff[1])
+
+    async def _post(self, loop, shard, payload, count) -> bool:
+        """
+        Posts one batch. Returns False if it is to be retried.
+        """
+        start = time.perf_counter()
+        try:
+            response = await loop.run_in_executor(
+                self._executor, lambda: shard.session.post(
+                    self._url, data=payload, **self._request))
+        except requests.RequestException as error:
+            logging.getLogger(__name__).warning(
+                "Remote write to %s failed: %s", self._url, error)
+            self._stats.requests.labels('error').inc()
+            return False
+        finally:
+            self._stats.duration.observe(time.perf_counter() - start)
+
+        status = response.status_code
+        self._stats.requests.labels(f'{status // 100}xx').inc()
+        if status < 300:
+            self._stats.samples.inc(count)
+            self._stats.sent_bytes.inc(len(payload))
+            return True
+
+        logging.getLogger(__name__).warning(
+            "Remote write to %s failed with status %d: %s", self._url,
+            status, response.text[:200].strip())
+        if 400 <= status < 500 and status != 429:
+            self._stats.dropped.labels('rejected').inc(count)
+            return True
+        return False
+
+
+def _iter_samples(families):
+    """
+    Yields tuples (key, label names, value) for the samples of families,
+    key is a tuple (name, label values). The rows of GaugeRows are read
+    directly rather than through Sample objects.
+    """
+    for family in families:
+        if isinstance(family, GaugeRows):
+            (name, names) = (family.name, family.labels)
+            for (labelvalues, value) in family.rows:
+                yield (name, tuple(labelvalues)), names, value
+            continue
+        for sample in family.samples:
+            yield ((sample.name, tuple(sample.labels.values())),
+                   tuple(sample.labels), sample.value)
+
+
+async def push(config, host, url, module='default', interval=15):
+    """
+    Collects a target every interval seconds and sends the samples to the
+    remote write endpoint at url until cancelled. The instrumentation of the
+    exporter is sent along unless self_metrics is disabled in the
+    remote_write section of the module. Failures are logged.
+    """
+    remote_config = config.get('remote_write')
+    remote_config = remote_config if isinstance(remote_config, dict) else {}
+    labels = dict({'instance': host, 'job': 'freeswitch'},
+                  **remote_config.get('labels', {}))
+
+    loop = asyncio.get_running_loop()
+    target = TargetRegistry(loop=loop).get(module, host, config)
+    stats = RemoteWriteStats()
+    writer = RemoteWriter(url, remote_config, stats)
+    writer.start()
+    log = logging.getLogger(__name__)
+
+    try:
+        next_run = loop.time()
+        while True:
+            try:
+                families = await ChannelCollector(
+                    host, config, target).collect_async(
+                        Deadline(config.get('timeout')))
+                writer.add('target', families, labels)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Exception thrown while collecting %s", host)
+                stats.collection_errors.inc()
+            if remote_config.get('self_metrics', True):
+                writer.add('exporter', REGISTRY.collect(), labels)
+
+            # Skip slots missed due to slow collections rather than trying
+            # to catch up.
+            next_run += interval
+            while next_run < loop.time():
+                next_run += interval
+            await asyncio.sleep(next_run - loop.time())
+    finally:
+        await writer.close()
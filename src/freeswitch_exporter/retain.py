@@ -0,0 +1,171 @@
+"""
+Cumulative RTP counters retained across call lifetimes.
+"""
+
+import collections
+import time
+
+from typing import Dict, List
+
+from prometheus_client.core import CounterMetricFamily
+
+from freeswitch_exporter.aggregate import LABEL_VARIABLES, label_value
+from freeswitch_exporter.collector import CHANNEL_METRICS
+
+DEFAULT_LABELS = ['profile', 'gateway', 'direction']
+
+# Per-channel gauges counting up over the lifetime of a call, retained as
+# counters prefixed with retained_.
+RETAINED_METRICS = {
+    key: definition.name
+    for key, definition in CHANNEL_METRICS.items()
+    if definition.name.endswith('_total')
+}
+
+
+class RetainedCounters():
+    """
+    Sums of the per-channel RTP counters of all calls by low cardinality
+    labels. The last values of a call are kept once it ended, either from
+    its CHANNEL_HANGUP_COMPLETE event or from the last scrape which listed
+    it. Hence the totals keep counting up while calls come and go.
+
+    Label sets without calls for ttl seconds are evicted, as well as the
+    least recently updated ones beyond max_series. Must only be used from
+    the event loop of the target.
+    """
+
+    def __init__(self, config=None):
+        config = config if isinstance(config, dict) else {}
+        self._labels = list(config.get('labels', DEFAULT_LABELS))
+        for label in self._labels:
+            if label not in LABEL_VARIABLES:
+                raise ValueError(f"Unknown retained counter label: {label}")
+        self._ttl = config.get('ttl', 86400)
+        self._max_series = config.get('max_series', 1000)
+
+        # uuid -> (labelvalues, last values) of calls seen by a scrape.
+        self._live = {}
+        # uuids of calls which ended while a scrape may still report them.
+        self._ended = set()
+        # labelvalues -> [ended calls, totals, last update], oldest first.
+        self._totals = collections.OrderedDict()
+
+    @property
+    def variables(self) -> List[str]:
+        """
+        Returns the channel variables required from uuid_dump.
+        """
+        return list(RETAINED_METRICS) + \
+            [LABEL_VARIABLES[label] for label in self._labels]
+
+    def observe(self, row, channelvars):
+        """
+        Records the current values of a live call.
+        """
+        uuid = row['uuid']
+        if uuid in self._ended:
+            return
+
+        labelvalues = self._labelvalues(row, channelvars)
+        self._live[uuid] = (labelvalues, self._values(channelvars))
+        self._touch(labelvalues)
+
+    def hangup(self, event):
+        """
+        Retains the final values of a call from its CHANNEL_HANGUP_COMPLETE
+        event. Other events are ignored.
+        """
+        uuid = event.get('Unique-ID')
+        if event.get('Event-Name') != 'CHANNEL_HANGUP_COMPLETE' or not uuid \
+                or event.get('Channel-Call-UUID', uuid) != uuid:
+            return
+
+        values = self._values(event)
+        (_, last) = self._live.pop(uuid, (None, {}))
+        for key, value in last.items():
+            values[key] = max(value, values.get(key, 0.))
+
+        row = {'name': event.get('Channel-Name', '')}
+        self._retain(self._labelvalues(row, event), values)
+        self._ended.add(uuid)
+
+    def sweep(self, uuids):
+        """
+        Retains the last values of calls missing from a complete listing of
+        live calls and evicts stale label sets.
+        """
+        uuids = set(uuids)
+        for uuid in [uuid for uuid in self._live if uuid not in uuids]:
+            self._retain(*self._live.pop(uuid))
+        self._ended &= uuids
+
+        expires = time.monotonic() - self._ttl
+        while self._totals:
+            (labelvalues, (_, _, updated)) = next(iter(self._totals.items()))
+            if updated >= expires and len(self._totals) <= self._max_series:
+                break
+            del self._totals[labelvalues]
+
+    def families(self, enabled=None):
+        """
+        Returns the retained counter families, optionally only those whose
+        name is accepted by enabled.
+        """
+        totals = {labelvalues: dict(values)
+                  for labelvalues, (_, values, _) in self._totals.items()}
+        for labelvalues, values in self._live.values():
+            if labelvalues not in totals:
+                continue
+            for key, value in values.items():
+                totals[labelvalues][key] = \
+                    totals[labelvalues].get(key, 0.) + value
+
+        result = []
+        if enabled is None or enabled('retained_rtp_calls_total'):
+            family = CounterMetricFamily(
+                'retained_rtp_calls_total',
+                'Number of ended calls.', labels=self._labels)
+            for labelvalues, (calls, _, _) in sorted(self._totals.items()):
+                family.add_metric(labelvalues, calls)
+            result.append(family)
+
+        for key, name in RETAINED_METRICS.items():
+            if enabled is not None and not enabled('retained_' + name):
+                continue
+            family = CounterMetricFamily(
+                'retained_' + name, f'Sum of {name} over live and ended calls.',
+                labels=self._labels)
+            for labelvalues, values in sorted(totals.items()):
+                family.add_metric(labelvalues, values.get(key, 0.))
+            result.append(family)
+
+        return result
+
+    def _labelvalues(self, row, channelvars):
+        return tuple(label_value(label, row, channelvars)
+                     for label in self._labels)
+
+    @staticmethod
+    def _values(channelvars) -> Dict[str, float]:
+        values = {}
+        for key in RETAINED_METRICS:
+            try:
+                values[key] = float(channelvars[key])
+            except (KeyError, ValueError):
+                continue
+        return values
+
+    def _touch(self, labelvalues):
+        entry = self._totals.get(labelvalues)
+        if entry is None:
+            entry = self._totals[labelvalues] = [0, {}, 0.]
+        entry[2] = time.monotonic()
+        self._totals.move_to_end(labelvalues)
+        return entry
+
+    def _retain(self, labelvalues, values):
+        entry = self._touch(labelvalues)
+        entry[0] += 1
+        for key, value in values.items():
+            entry[1][key] = entry[1].get(key, 0.) + value
@@ -0,0 +1,84 @@
+"""
+Round robin sampling of channel statistics.
+"""
+
+import heapq
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+# Channel variables by the column of `show calls` or of the channel table
+# providing them. Channels not refreshed yet are served with these only.
+ROW_VARIABLES = {
+    'direction': 'Call-Direction',
+    'user_agent': 'variable_sip_user_agent',
+}
+
+
+def row_variables(row) -> dict:
+    """
+    Returns the channel variables which can be taken from the listing of a
+    call without dumping it.
+    """
+    return {variable: row[column]
+            for column, variable in ROW_VARIABLES.items() if row.get(column)}
+
+
+class ChannelSampler():
+    """
+    Refreshes at most budget channels per scrape and serves the others from
+    the values recorded when they were refreshed last. Channels never
+    refreshed come first, followed by the ones refreshed longest ago. Hence
+    every channel is refreshed in turn. Channels not refreshed yet which do
+    not fit into the budget are served with the variables of their listing,
+    such that every channel is exported from the first scrape on.
+
+    Must only be used from the event loop of the target.
+    """
+
+    def __init__(self, budget: int):
+        self._budget = budget
+        # uuid -> (time of refresh, channel variables)
+        self._known = {}
+
+    def select(self, rows) \
+            -> Tuple[List[dict], Dict[str, Tuple[dict, Optional[float]]]]:
+        """
+        Returns a tuple (rows, stale). Rows lists the calls to serve, stale
+        maps the uuids of calls which are not due for a refresh to tuples
+        (channel variables, age in seconds). The age is None for calls never
+        refreshed.
+        """
+        known = self._known
+        due = heapq.nsmallest(
+            self._budget, rows,
+            key=lambda row: known.get(row['uuid'], (float('-inf'),))[0])
+        due = {row['uuid'] for row in due}
+
+        now = time.monotonic()
+        stale = {}
+        for row in rows:
+            uuid = row['uuid']
+            if uuid in due:
+                continue
+            if uuid in known:
+                (refreshed, channelvars) = known[uuid]
+                stale[uuid] = (channelvars, now - refreshed)
+            else:
+                stale[uuid] = (row_variables(row), None)
+
+        return rows, stale
+
+    def update(self, uuid, channelvars):
+        """
+        Records freshly collected channel variables.
+        """
+        self._known[uuid] = (time.monotonic(), channelvars)
+
+    def retain(self, uuids):
+        """
+        Forgets all channels except the given ones.
+        """
+        uuids = set(uuids)
+        for uuid in [uuid for uuid in self._known if uuid not in uuids]:
+            del self._known[uuid]
@@ -0,0 +1,153 @@
+"""
+Minimal HTTP/1.1 server based on asyncio streams.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import logging
+
+from urllib.parse import parse_qsl, urlsplit
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import BadRequest
+
+
+# Seconds an idle keep-alive connection is held open.
+KEEPALIVE_TIMEOUT = 75
+
+
+class AsyncHTTPServer():
+    """
+    Serves an application exposing dispatch_async(path, args) on
+    asyncio streams. Supports persistent connections, but neither request
+    bodies nor chunked requests, which are not needed for scraping.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._log = logging.getLogger(__name__)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        """
+        Connection callback for asyncio.start_server().
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = await asyncio.wait_for(
+                    self._read_request(reader), KEEPALIVE_TIMEOUT)
+                if request is None:
+                    break
+
+                (method, target, version, headers) = request
+                keep_alive = version == 'HTTP/1.1' and \
+                    headers.get('Connection', '').lower() != 'close'
+
+                url = urlsplit(target)
+                args = MultiDict(parse_qsl(url.query, keep_blank_values=True))
+                response = await self._app.dispatch_async(url.path, args,
+                                                          headers)
+
+                keep_alive = await self._write_response(
+                    writer, response, method != 'HEAD', keep_alive)
+        except asyncio.TimeoutError:
+            pass
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as error:
+            self._log.debug("Connection error: %s", error)
+        except ValueError as error:
+            self._log.debug("Malformed request: %s", error)
+            await self._write_response(writer, BadRequest().get_response(),
+                                       True, False)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+
+        (method, target, version) = line.decode('latin-1').split()
+
+        headers = Headers()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (name, value) = line.decode('latin-1').split(':', 1)
+            headers.add(name.strip(), value.strip())
+
+        # Requests to a metrics exporter do not carry a payload, drop it.
+        length = int(headers.get('Content-Length', 0))
+        if length > 0:
+            await reader.readexactly(length)
+
+        return method, target, version, headers
+
+    async def _write_response(self, writer, response, with_body,
+                              keep_alive):
+        """
+        Writes a response and returns whether the connection can be kept
+        alive. Bodies streamed from an async iterator are sent with chunked
+        transfer encoding.
+        """
+        body = response.response
+        streamed = hasattr(body, '__aiter__')
+
+        lines = [f'HTTP/1.1 {response.status}']
+        for (name, value) in response.headers.items():
+            if name.lower() not in ('content-length', 'connection',
+                                    'transfer-encoding'):
+                lines.append(f'{name}: {value}')
+        if streamed:
+            lines.append('Transfer-Encoding: chunked')
+        else:
+            body = response.get_data()
+            lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not streamed:
+            if with_body:
+                writer.write(body)
+        elif not with_body:
+            await body.aclose()
+        else:
+            return await self._write_chunks(writer, body) and keep_alive
+        await writer.drain()
+        return keep_alive
+
+    async def _write_chunks(self, writer, body):
+        """
+        Writes the chunks of a streamed body. Returns False if producing the
+        body failed, the response is then left incomplete.
+        """
+        try:
+            async for chunk in body:
+                if chunk:
+                    writer.write(f'{len(chunk):x}\r\n'.encode() + chunk +
+                                 b'\r\n')
+                    await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            self._log.debug("Streamed response aborted: %s", error)
+            return False
+        finally:
+            await body.aclose()
+
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return True
+
+
+async def serve(app, address, port):
+    """
+    Serves app on the given address and port until cancelled.
+    """
+    server = await asyncio.start_server(AsyncHTTPServer(app).handle,
+                                        address or None, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,105 @@
+"""
+Coalescing of concurrent calls for the same key.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import threading
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class SingleFlight():
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    for the same key is in flight wait for it and share its result.
+
+    Callers pass their own deadline. A follower waits for the shared result
+    only until its own deadline expires, and runs the call itself if the
+    result was cut short by the deadline of the leader while the follower
+    still has time left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, key, func, deadline=None):
+        """
+        Calls func() unless a call for key is already in flight. Returns a
+        tuple (result, shared) where shared is True if the result was
+        produced by another caller. Exceptions are shared as well.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            try:
+                (result, partial) = future.result(_remaining(deadline))
+            except FutureTimeoutError:
+                return func(), False
+            if partial and not _expired(deadline):
+                return func(), False
+            return result, True
+
+        try:
+            result = func()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        future.set_result((result, _exceeded(deadline)))
+        return result, False
+
+
+class AsyncSingleFlight():
+    """
+    SingleFlight for coroutines running on a single event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def call(self, key, func, deadline=None):
+        """
+        Awaits func() unless a call for key is already in flight. Returns a
+        tuple (result, shared) like SingleFlight.call().
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            try:
+                (result, partial) = await asyncio.wait_for(
+                    asyncio.shield(task), _remaining(deadline))
+            except asyncio.TimeoutError:
+                return await func(), False
+            if partial and not _expired(deadline):
+                return await func(), False
+            return result, True
+
+        async def lead():
+            return await func(), _exceeded(deadline)
+
+        task = asyncio.ensure_future(lead())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        (result, _) = await asyncio.shield(task)
+        return result, False
+
+
+def _remaining(deadline):
+    return deadline.remaining() if deadline is not None else None
+
+
+def _expired(deadline):
+    return deadline is not None and deadline.expired()
+
+
+def _exceeded(deadline):
+    return deadline is not None and deadline.exceeded
@@ -0,0 +1,131 @@
+"""
+Background collection of configured targets into pre-rendered snapshots.
+"""
+
+import asyncio
+import logging
+import time
+
+from prometheus_client import REGISTRY, Counter
+from prometheus_client.core import GaugeMetricFamily
+
+from freeswitch_exporter.collector import collect_esl_async
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.exposition import render
+
+
+class Snapshot():
+    """
+    Exposition rendered by a background collection.
+    """
+
+    def __init__(self, output: bytes):
+        self.output = output
+        self.timestamp = time.monotonic()
+
+    def age(self) -> float:
+        """
+        Returns the number of seconds since the snapshot was taken.
+        """
+        return time.monotonic() - self.timestamp
+
+    def render(self) -> bytes:
+        """
+        Returns the exposition along with the snapshot age.
+        """
+        age_metric = GaugeMetricFamily(
+            'freeswitch_snapshot_age_seconds',
+            'Seconds since the served metrics were collected',
+        )
+        age_metric.add_metric([], self.age())
+        return self.output + render([age_metric])
+
+
+class SnapshotScheduler():
+    """
+    Collects targets listed in the snapshot section of a module on a fixed
+    interval and keeps the last rendered exposition for each of them.
+    """
+
+    def __init__(self, config, targets, duration, registry=REGISTRY):
+        self._config = config
+        self._targets = targets
+        self._duration = duration
+        self._snapshots = {}
+        self._log = logging.getLogger(__name__)
+
+        self._errors = Counter(
+            'freeswitch_snapshot_errors_total',
+            'Failed background collections by the FreeSWITCH exporter',
+            ['module'],
+            registry=registry,
+        )
+
+    def start(self):
+        """
+        Spawns one collection task per configured module and target on the
+        background loop.
+        """
+        for module, module_config in self._config.items():
+            snapshot_config = module_config.get('snapshot')
+            if not snapshot_config:
+                continue
+
+            # pylint: disable=no-member
+            self._errors.labels(module)
+
+            hosts = snapshot_config.get('targets', ['localhost'])
+            interval = snapshot_config.get('interval', 15)
+            for index, host in enumerate(hosts):
+                self._snapshots[(module, host)] = None
+                offset = interval * index / len(hosts)
+                self._targets.spawn(self._run(module, host, interval, offset))
+
+    def manages(self, module, host) -> bool:
+        """
+        Returns True if the given module and target are collected in the
+        background.
+        """
+        return (module, host) in self._snapshots
+
+    def get(self, module, host):
+        """
+        Returns the most recent snapshot or None if the first collection did
+        not finish yet.
+        """
+        return self._snapshots.get((module, host))
+
+    def max_age(self, module) -> float:
+        """
+        Returns the configured maximum age of snapshots served for a module.
+        """
+        snapshot_config = self._config[module].get('snapshot', {})
+        interval = snapshot_config.get('interval', 15)
+        return snapshot_config.get('max_age', interval * 2)
+
+    async def _run(self, module, host, interval, offset):
+        config = self._config[module]
+        loop = asyncio.get_running_loop()
+
+        await asyncio.sleep(offset)
+        next_run = loop.time()
+        while True:
+            start = time.time()
+            try:
+                target = self._targets.get(module, host, config)
+                deadline = Deadline(config.get('timeout'))
+                output = await collect_esl_async(config, host, target,
+                                                 deadline)
+                self._snapshots[(module, host)] = Snapshot(output)
+                self._duration.labels(module).observe(time.time() - start)
+            except Exception:  # pylint: disable=broad-except
+                self._log.exception("Exception thrown while collecting "
+                                    "snapshot of %s", host)
+                self._errors.labels(module).inc()
+
+            # Skip slots missed due to slow collections rather than trying to
+            # catch up.
+            next_run += interval
+            while next_run < loop.time():
+                next_run += interval
+            await asyncio.sleep(next_run - loop.time())
@@ -0,0 +1,195 @@
+"""
+Collection of Sofia SIP profile, gateway and registration metrics.
+"""
+# pylint: disable=too-few-public-methods
+
+import logging
+import re
+
+from typing import Dict, Iterable, Iterator, Tuple
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from freeswitch_exporter.esl import ESL
+
+# Size of the chunks fed to the XML parser.
+FEED_SIZE = 16384
+
+# Registration states of sofia gateways, see sofia_reg.c.
+GATEWAY_STATES = [
+    'UNREGED', 'TRYING', 'REGISTER', 'REGED', 'UNREGISTER', 'FAILED',
+    'FAIL_WAIT', 'EXPIRED', 'NOREG', 'DOWN', 'TIMEOUT',
+]
+
+# Cumulative call counters of gateways by xmlstatus element.
+GATEWAY_CALLS = {
+    'calls-in': ('freeswitch_sofia_gateway_calls_in_total',
+                 'Inbound calls through the gateway'),
+    'calls-out': ('freeswitch_sofia_gateway_calls_out_total',
+                  'Outbound calls through the gateway'),
+    'failed-calls-in': ('freeswitch_sofia_gateway_failed_calls_in_total',
+                        'Failed inbound calls through the gateway'),
+    'failed-calls-out': ('freeswitch_sofia_gateway_failed_calls_out_total',
+                         'Failed outbound calls through the gateway'),
+}
+
+_PROFILE_STATE = re.compile(r'(\w+)(?: \((\d+)\))?')
+_REGISTRATIONS = re.compile(rb'(\d+) total')
+
+
+def iter_records(document: bytes, tags: Iterable[str]) \
+        -> Iterator[Tuple[str, Dict[str, str]]]:
+    """
+    Yields tuples (tag, fields) for every child of the root element with one
+    of the given tags, fields maps the tags of its children to their text.
+
+    The document is parsed incrementally and every record is discarded once
+    yielded. Hence memory use does not depend on the number of records.
+    Stops at the first syntax error.
+    """
+    tags = set(tags)
+    parser = XMLPullParser(events=('start', 'end'))
+    depth = 0
+    root = None
+    try:
+        for offset in range(0, len(document), FEED_SIZE):
+            parser.feed(document[offset:offset + FEED_SIZE])
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if root is None:
+                        root = element
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    if element.tag in tags:
+                        yield element.tag, {child.tag: child.text or ''
+                                            for child in element}
+                    root.clear()
+    except ParseError as error:
+        logging.getLogger(__name__).warning(
+            "Failed to parse sofia status: %s", error)
+
+
+class ESLSofiaInfo():
+    """
+    Sofia async collector. Profiles, gateways and registrations are fetched
+    with one bulk command each, pipelined on the connection.
+    """
+
+    def __init__(self, esl: ESL, config=None):
+        config = config if isinstance(config, dict) else {}
+        self._esl = esl
+        self._profiles = config.get('profiles', True)
+        self._gateways = config.get('gateways', True)
+        self._registrations = config.get('registrations', True)
+
+    async def collect(self):
+        """
+        Collects Sofia metrics.
+        """
+        commands = []
+        if self._profiles:
+            commands.append((self._collect_profiles, 'api sofia xmlstatus'))
+        if self._gateways:
+            commands.append((self._collect_gateways,
+                             'api sofia xmlstatus gateway'))
+        if self._registrations:
+            commands.append((self._collect_registrations,
+                             'api show registrations count'))
+
+        results = await self._esl.send_all(
+            [command for (_, command) in commands], raw=True)
+
+        families = []
+        for (parse, _), (_, body) in zip(commands, results):
+            if body.startswith(b'-ERR'):
+                logging.getLogger(__name__).debug(
+                    "Sofia status not available: %s", body.decode().strip())
+                continue
+            families.extend(parse(body))
+
+        return families
+
+    @staticmethod
+    def _collect_profiles(body):
+        up_metric = GaugeMetricFamily(
+            'freeswitch_sofia_profile_up',
+            'Whether the sofia profile is running',
+            labels=['profile'])
+        calls_metric = GaugeMetricFamily(
+            'freeswitch_sofia_profile_calls',
+            'Calls in use on the sofia profile',
+            labels=['profile'])
+
+        seen = set()
+        for (_, fields) in iter_records(body, ['profile']):
+            name = fields.get('name', '')
+            # Profiles with TLS are listed twice.
+            if name in seen:
+                continue
+            seen.add(name)
+
+            match = _PROFILE_STATE.match(fields.get('state', ''))
+            if match is None:
+                continue
+            up_metric.add_metric([name], int(match.group(1) == 'RUNNING'))
+            if match.group(2) is not None:
+                calls_metric.add_metric([name], int(match.group(2)))
+
+        return [up_metric, calls_metric]
+
+    @staticmethod
+    def _collect_gateways(body):
+        labels = ['gateway', 'profile']
+        up_metric = GaugeMetricFamily(
+            'freeswitch_sofia_gateway_up',
+            'Whether the gateway is considered up, e.g., by options pings',
+            labels=labels)
+        state_metric = GaugeMetricFamily(
+            'freeswitch_sofia_gateway_state',
+            'Registration state of the gateway',
+            labels=labels + ['state'])
+        ping_metric = GaugeMetricFamily(
+            'freeswitch_sofia_gateway_ping_seconds',
+            'Round trip time of the last options ping to the gateway',
+            labels=labels)
+        calls_metrics = {
+            key: CounterMetricFamily(name, documentation, labels=labels)
+            for key, (name, documentation) in GATEWAY_CALLS.items()
+        }
+
+        for (_, fields) in iter_records(body, ['gateway']):
+            labelvalues = [fields.get('name', ''), fields.get('profile', '')]
+            up_metric.add_metric(labelvalues,
+                                 int(fields.get('status') == 'UP'))
+
+            state = fields.get('state')
+            for known in GATEWAY_STATES:
+                state_metric.add_metric(labelvalues + [known],
+                                        int(known == state))
+
+            try:
+                if float(fields.get('ping', 0)) > 0:
+                    ping_metric.add_metric(
+                        labelvalues, float(fields['pingtime']) / 1000.)
+                for key, metric in calls_metrics.items():
+                    metric.add_metric(labelvalues, float(fields[key]))
+            except (KeyError, ValueError):
+                continue
+
+        return [up_metric, state_metric, ping_metric] + \
+            list(calls_metrics.values())
+
+    @staticmethod
+    def _collect_registrations(body):
+        registrations_metric = GaugeMetricFamily(
+            'freeswitch_sofia_registrations',
+            'Number of SIP registrations')
+        match = _REGISTRATIONS.search(body)
+        if match is not None:
+            registrations_metric.add_metric([], int(match.group(1)))
+
+        return [registrations_metric]
@@ -0,0 +1,166 @@
+"""
+Long lived state kept per module and FreeSWITCH target.
+"""
+# pylint: disable=too-few-public-methods
+
+import asyncio
+import threading
+import time
+
+from prometheus_client import REGISTRY
+
+from freeswitch_exporter.admission import Admission
+from freeswitch_exporter.cache import CollectionCache
+from freeswitch_exporter.channels import ChannelSubscriber
+from freeswitch_exporter.instrumentation import NULL_STATS, ScrapeStats
+from freeswitch_exporter.loop import BackgroundLoop
+from freeswitch_exporter.pool import ESLPool, ESLPoolStats
+from freeswitch_exporter.retain import RetainedCounters
+from freeswitch_exporter.sampling import ChannelSampler
+
+# Seconds between sweeps closing idle pooled connections of all targets.
+SWEEP_INTERVAL = 30
+
+# Seconds after the last scrape after which a target is dropped.
+TARGET_IDLE_TIMEOUT = 3600
+
+# Number of targets kept at most, the least recently scraped is dropped.
+MAX_TARGETS = 1000
+
+
+class Target():
+    """
+    State shared by all scrapes of one FreeSWITCH target through one module.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, module, host, config):
+        self.module = module
+        self.host = host
+        self.config = config
+        self.pool = None
+        self.channels = None
+        self.retained = None
+        self.cache = None
+        self.sampler = None
+        self.admission = None
+        self.stats = NULL_STATS
+        self.subscriber = None
+        self.last_used = time.monotonic()
+
+    async def close(self):
+        """
+        Stops the channel event subscription and closes pooled connections.
+        """
+        if self.subscriber is not None:
+            self.subscriber.cancel()
+        if self.pool is not None:
+            await self.pool.close()
+
+
+class TargetRegistry():
+    """
+    Keeps one Target per (module, target) along with the background event
+    loop all of their connections live on.
+
+    Targets not scraped for idle_timeout seconds are dropped, as is the least
+    recently scraped one once there are more than max_targets. Hence
+    arbitrary target parameters cannot pile up connections and event
+    subscriptions.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, registry=REGISTRY, loop=None,
+                 idle_timeout=TARGET_IDLE_TIMEOUT, max_targets=MAX_TARGETS):
+        # pylint: disable=too-many-arguments
+        self._targets = {}
+        self._idle_timeout = idle_timeout
+        self._max_targets = max_targets
+        self._lock = threading.Lock()
+        self._loop = BackgroundLoop(loop=loop)
+        self._pool_stats = ESLPoolStats(registry)
+        self._scrape_stats = ScrapeStats(registry)
+        self._sweeper = None
+
+    def get(self, module, host, config) -> Target:
+        """
+        Returns the target state for a given module and host.
+        """
+        key = (module, host)
+        with self._lock:
+            target = self._targets.pop(key, None)
+            if target is None:
+                target = self._create(module, host, config)
+            target.last_used = time.monotonic()
+            # Keep the dict ordered by last use, oldest first.
+            self._targets[key] = target
+
+            if len(self._targets) > self._max_targets:
+                oldest = next(iter(self._targets))
+                self._drop([self._targets.pop(oldest)])
+
+            if self._sweeper is None:
+                self._sweeper = self._loop.spawn(self._sweep(SWEEP_INTERVAL))
+
+            return target
+
+    def run(self, coro):
+        """
+        Runs a coroutine on the background loop and waits for the result.
+        """
+        return self._loop.run(coro)
+
+    def spawn(self, coro):
+        """
+        Schedules a coroutine on the background loop without waiting for it.
+        """
+        return self._loop.spawn(coro)
+
+    async def _sweep(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+
+            deadline = time.monotonic() - self._idle_timeout
+            with self._lock:
+                expired = [key for (key, target) in self._targets.items()
+                           if target.last_used <= deadline]
+                self._drop([self._targets.pop(key) for key in expired])
+                pools = [target.pool for target in self._targets.values()
+                         if target.pool is not None]
+
+            for pool in pools:
+                await pool.evict()
+
+    def _drop(self, targets):
+        for target in targets:
+            self._loop.spawn(target.close())
+
+    def _create(self, module, host, config):
+        target = Target(module, host, config)
+        target.stats = self._scrape_stats.labels(module)
+
+        if config.get('admission'):
+            target.admission = Admission(config['admission'], target.stats)
+
+        if 'pool' in config:
+            target.pool = ESLPool(host, config, self._pool_stats.labels(module),
+                                  target.stats)
+
+        if config.get('cache'):
+            target.cache = CollectionCache(config['cache'], target.stats)
+
+        if config.get('max_channels_per_scrape'):
+            target.sampler = ChannelSampler(config['max_channels_per_scrape'])
+
+        if config.get('retained_counters'):
+            target.retained = RetainedCounters(config['retained_counters'])
+
+        if config.get('channel_events', False):
+            subscriber = ChannelSubscriber(host, config, target.stats,
+                                           target.retained)
+            target.channels = subscriber.table
+            target.subscriber = self._loop.spawn(subscriber.run())
+
+        return target
@@ -0,0 +1,72 @@
+"""
+Collection into files read by the node_exporter textfile collector.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+
+from freeswitch_exporter.collector import collect_esl_async
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.target import TargetRegistry
+
+
+def write_atomic(path, data: bytes):
+    """
+    Replaces the file at path with data. The data is written to a hidden
+    file in the same directory first, which node_exporter ignores because
+    it does not end with .prom, and then renamed over path. Hence readers
+    never see a partially written file.
+    """
+    directory = os.path.dirname(path) or '.'
+    temp = os.path.join(directory,
+                        f'.{os.path.basename(path)}.{os.getpid()}')
+    try:
+        with open(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                          0o644), 'wb') as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp)
+        raise
+
+
+async def write_textfile(config, host, path, module='default',
+                         interval=None):
+    """
+    Collects a target and writes the result to path. Raises if the
+    collection fails, the previous file is left in place then.
+
+    With an interval, keeps rewriting the file every interval seconds until
+    cancelled. State such as pooled connections and retained counters is
+    kept between collections, failures are logged.
+    """
+    if interval is None:
+        output = await collect_esl_async(config, host, None,
+                                         Deadline(config.get('timeout')))
+        write_atomic(path, output)
+        return
+
+    loop = asyncio.get_running_loop()
+    target = TargetRegistry(loop=loop).get(module, host, config)
+    log = logging.getLogger(__name__)
+
+    next_run = loop.time()
+    while True:
+        try:
+            output = await collect_esl_async(config, host, target,
+                                             Deadline(config.get('timeout')))
+            write_atomic(path, output)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Exception thrown while collecting %s", host)
+
+        # Skip slots missed due to slow collections rather than trying to
+        # catch up.
+        next_run += interval
+        while next_run < loop.time():
+            next_run += interval
+        await asyncio.sleep(next_run - loop.time())
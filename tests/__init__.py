@@ -0,0 +1,74 @@
+"""
+Tests of the FreeSWITCH exporter, driven through the fake event socket of
+the benchmarks.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from freeswitch_exporter.channels import ChannelTable
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'benchmarks'))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+from fakeswitch import FakeSwitch, frame
+
+__all__ = ['FakeSwitch', 'FakeSwitchTestCase', 'frame', 'samples', 'seeded']
+
+
+class FakeSwitchTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case serving a fake event socket on the loop of the test.
+    """
+
+    async def serve(self, calls=10, **options):
+        """
+        Starts a fake switch with the given number of calls and returns a
+        tuple (switch, module config) pointing to it.
+        """
+        switch = FakeSwitch(calls, **options)
+        ready = asyncio.get_running_loop().create_future()
+        server = asyncio.ensure_future(
+            switch.serve('127.0.0.1', 0, ready.set_result))
+        self.addAsyncCleanup(_cancel, server)
+        port = await asyncio.wait_for(ready, 5)
+        return switch, {'port': port}
+
+
+async def _cancel(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def samples(output):
+    """
+    Returns the samples of prometheus text format output as a dict mapping
+    metric names to lists of (labels, value) tuples.
+    """
+    if isinstance(output, bytes):
+        output = output.decode()
+    result = {}
+    for family in text_string_to_metric_families(output):
+        for sample in family.samples:
+            result.setdefault(sample.name, []).append(
+                (sample.labels, sample.value))
+    return result
+
+
+def seeded(calls):
+    """
+    Returns a channel table seeded with the given fake calls.
+    """
+    table = ChannelTable()
+    table.reset('job')
+    table.apply({'Event-Name': 'BACKGROUND_JOB', 'Job-UUID': 'job',
+                 '_body': json.dumps({'rows': [call.row()
+                                               for call in calls]})})
+    return table
@@ -0,0 +1,78 @@
+"""
+Tests of the event driven channel table.
+"""
+# pylint: disable=missing-function-docstring
+
+import json
+import unittest
+
+from freeswitch_exporter.channels import ChannelTable
+from freeswitch_exporter.collector import collect_esl_async
+from freeswitch_exporter.target import Target
+
+from tests import FakeSwitchTestCase, samples, seeded
+
+
+class ChannelTableTest(unittest.TestCase):
+    """
+    The table records the user agent of channels from events and dumps.
+    """
+
+    def test_user_agent(self):
+        table = ChannelTable()
+        table.reset('job')
+        table.apply({'Event-Name': 'BACKGROUND_JOB', 'Job-UUID': 'job',
+                     '_body': json.dumps({'rows': [
+                         {'uuid': 'a', 'name': 'sofia/a'}]})})
+        table.apply({'Event-Name': 'CHANNEL_CREATE', 'Unique-ID': 'b',
+                     'Channel-Name': 'sofia/b',
+                     'variable_sip_user_agent': 'Phone B'})
+        table.apply({'Event-Name': 'CHANNEL_ANSWER', 'Unique-ID': 'b'})
+
+        rows = {row['uuid']: row for row in table.rows()}
+        self.assertNotIn('user_agent', rows['a'])
+        self.assertEqual(rows['b']['user_agent'], 'Phone B')
+
+        table.learn('a', 'Phone A')
+        table.learn('b', 'Other')
+        table.learn('gone', 'Phone')
+        rows = {row['uuid']: row for row in table.rows()}
+        self.assertEqual(rows['a']['user_agent'], 'Phone A')
+        self.assertEqual(rows['b']['user_agent'], 'Phone B')
+        self.assertEqual(len(rows), 2)
+
+
+class ChannelInfoTest(FakeSwitchTestCase):
+    """
+    Channel info is served from the table without dumping channels.
+    """
+
+    async def test_info_from_table(self):
+        (switch, config) = await self.serve(5)
+        config = dict(config,
+                      channel_metrics={'include': ['rtp_channel_info']})
+        calls = list(switch.calls.values())
+        table = seeded(calls)
+        for call in calls[:3]:
+            table.apply({'Event-Name': 'CHANNEL_ANSWER',
+                         'Unique-ID': call.uuid, 'Channel-Name': call.name,
+                         'variable_sip_user_agent': 'Event Phone'})
+        target = Target('default', '127.0.0.1', config)
+        target.channels = table
+
+        for dumps in (2, 0):
+            commands = switch.commands
+            result = samples(await collect_esl_async(config, '127.0.0.1',
+                                                     target))
+            # Login and status, plus a dump per channel without user agent.
+            self.assertEqual(switch.commands - commands, 2 + dumps)
+
+            user_agents = {labels['id']: labels['user_agent']
+                           for labels, _ in result['rtp_channel_info']}
+            self.assertEqual(user_agents, dict(
+                [(call.uuid, 'Event Phone') for call in calls[:3]] +
+                [(call.uuid, 'Example Phone 1.0') for call in calls[3:]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
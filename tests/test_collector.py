@@ -0,0 +1,215 @@
+"""
+Tests of collections against the fake event socket.
+"""
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import time
+import unittest
+
+from freeswitch_exporter.admission import Admission
+from freeswitch_exporter.cache import CollectionCache
+from freeswitch_exporter.collector import collect_esl_async
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.pool import ESLPool
+from freeswitch_exporter.sampling import ChannelSampler
+from freeswitch_exporter.target import Target
+
+from tests import FakeSwitchTestCase, samples, seeded
+
+
+class CollectTest(FakeSwitchTestCase):
+    """
+    Collections export process info and all channels in time.
+    """
+
+    async def test_complete(self):
+        (_, config) = await self.serve(5)
+
+        result = samples(await collect_esl_async(config, '127.0.0.1'))
+
+        self.assertEqual(result['freeswitch_up'], [({}, 1.)])
+        self.assertEqual(len(result['rtp_channel_info']), 5)
+        self.assertEqual(result['freeswitch_scrape_partial'], [({}, 0.)])
+
+
+class SamplingTest(FakeSwitchTestCase):
+    """
+    Channels beyond the sampling budget are exported without placeholders.
+    """
+
+    async def collect_info(self, config, target):
+        """
+        Collects and returns the user agents of rtp_channel_info by uuid.
+        """
+        result = samples(await collect_esl_async(config, '127.0.0.1',
+                                                 target))
+        return {labels['id']: labels['user_agent']
+                for labels, _ in result['rtp_channel_info']}
+
+    async def test_never_dumped_left_out(self):
+        (switch, config) = await self.serve(5)
+        config = dict(config, max_channels_per_scrape=2)
+        target = Target('default', '127.0.0.1', config)
+        target.sampler = ChannelSampler(2)
+
+        for count in (2, 4, 5, 5):
+            user_agents = await self.collect_info(config, target)
+            self.assertEqual(len(user_agents), count)
+            self.assertLessEqual(set(user_agents), set(switch.calls))
+            self.assertEqual(set(user_agents.values()),
+                             {'Example Phone 1.0'})
+
+    async def test_user_agent_from_table(self):
+        (switch, config) = await self.serve(5)
+        config = dict(config, max_channels_per_scrape=2)
+        target = Target('default', '127.0.0.1', config)
+        target.sampler = ChannelSampler(2)
+        target.channels = seeded(switch.calls.values())
+        for call in switch.calls.values():
+            target.channels.learn(call.uuid, 'Table Phone')
+
+        user_agents = await self.collect_info(config, target)
+
+        self.assertEqual(user_agents, dict.fromkeys(switch.calls,
+                                                    'Table Phone'))
+
+
+class DeadlineTest(FakeSwitchTestCase):
+    """
+    Collections cut short by the deadline return partial results.
+    """
+
+    async def test_partial(self):
+        (_, config) = await self.serve(20, latency=0.05)
+        deadline = Deadline(0.5)
+
+        start = time.monotonic()
+        result = samples(await collect_esl_async(config, '127.0.0.1',
+                                                 deadline=deadline))
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(result['freeswitch_up'], [({}, 1.)])
+        self.assertEqual(result['freeswitch_scrape_partial'], [({}, 1.)])
+        (_, skipped) = result['freeswitch_channels_skipped'][0]
+        self.assertGreater(skipped, 0)
+        self.assertEqual(len(result.get('rtp_channel_info', [])) + skipped,
+                         20)
+
+    async def test_optional_families(self):
+        (_, config) = await self.serve(5, latency=0.2)
+        config = dict(config, sofia=True)
+        deadline = Deadline(0.5)
+
+        result = samples(await collect_esl_async(config, '127.0.0.1',
+                                                 deadline=deadline))
+
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(result['freeswitch_up'], [({}, 1.)])
+        self.assertEqual(result['freeswitch_scrape_partial'], [({}, 1.)])
+        self.assertFalse([name for name in result
+                          if name.startswith('freeswitch_sofia_')])
+
+    async def test_conference_and_callcenter(self):
+        for option in ('conference', 'callcenter'):
+            (_, config) = await self.serve(5, latency=0.3, conferences=2,
+                                           queues=2)
+            config = dict(config, **{option: True})
+            deadline = Deadline(0.5)
+
+            result = samples(await collect_esl_async(config, '127.0.0.1',
+                                                     deadline=deadline))
+
+            self.assertTrue(deadline.exceeded)
+            self.assertEqual(result['freeswitch_up'], [({}, 1.)])
+            self.assertEqual(result['freeswitch_scrape_partial'], [({}, 1.)])
+            self.assertFalse([name for name in result
+                              if name.startswith(f'freeswitch_{option}_')])
+
+
+class CacheTest(FakeSwitchTestCase):
+    """
+    Cached targets reuse Sofia status but query process info on every scrape.
+    """
+
+    async def test_status_current(self):
+        (switch, config) = await self.serve(5)
+        config = dict(config, sofia=True, cache={'sofia': 300})
+        target = Target('default', '127.0.0.1', config)
+        target.cache = CollectionCache(config['cache'])
+
+        first = samples(await collect_esl_async(config, '127.0.0.1', target))
+        switch.calls.popitem()
+        second = samples(await collect_esl_async(config, '127.0.0.1', target))
+
+        self.assertEqual(first['freeswitch_session_active'], [({}, 5.)])
+        self.assertEqual(second['freeswitch_session_active'], [({}, 4.)])
+        self.assertEqual(first['freeswitch_sofia_profile_calls'],
+                         second['freeswitch_sofia_profile_calls'])
+
+
+class ShardTest(FakeSwitchTestCase):
+    """
+    Sharded collections borrow additional connections from the pool only if
+    it has some to spare.
+    """
+
+    async def test_no_deadlock(self):
+        (_, config) = await self.serve(10, latency=0.01)
+        config = dict(config, connections=2, pool={'max_connections': 1})
+        target = Target('default', '127.0.0.1', config)
+        target.pool = ESLPool('127.0.0.1', config, _PoolStats())
+        self.addAsyncCleanup(target.close)
+
+        results = await asyncio.wait_for(asyncio.gather(*(
+            collect_esl_async(config, '127.0.0.1', target, Deadline(5))
+            for _ in range(2))), 3)
+
+        for output in results:
+            result = samples(output)
+            self.assertEqual(len(result['rtp_channel_info']), 10)
+            self.assertEqual(result['freeswitch_scrape_partial'], [({}, 0.)])
+
+    async def test_admission(self):
+        (switch, config) = await self.serve(10, latency=0.01)
+        config = dict(config, connections=4, pool={},
+                      admission={'max_sessions': 2})
+        target = Target('default', '127.0.0.1', config)
+        target.pool = ESLPool('127.0.0.1', config, _PoolStats())
+        target.admission = Admission(config['admission'])
+        self.addAsyncCleanup(target.close)
+
+        results = await asyncio.wait_for(asyncio.gather(*(
+            collect_esl_async(config, '127.0.0.1', target, Deadline(5))
+            for _ in range(2))), 3)
+
+        for output in results:
+            self.assertEqual(len(samples(output)['rtp_channel_info']), 10)
+        # One session for the primary connection and one for a shard.
+        self.assertEqual(switch.connections, 2)
+
+
+class _PoolStats():
+    """
+    Pool counters doing nothing.
+    """
+
+    def hit(self):
+        """
+        Counts a connection reused.
+        """
+
+    def miss(self):
+        """
+        Counts a connection opened.
+        """
+
+    def reconnect(self):
+        """
+        Counts a dead connection replaced.
+        """
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+Tests of the ESL frame parser and command pipelining.
+"""
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import random
+import unittest
+
+from freeswitch_exporter.esl import COPY_THRESHOLD, ESL, ESLError, \
+    ESLFrameParser, ESLProtocolError
+
+from tests import FakeSwitchTestCase, frame
+
+
+class ESLFrameParserTest(unittest.TestCase):
+    """
+    Frames are reassembled whatever the reads they are split into.
+    """
+
+    FRAMES = [
+        ({'Content-Type': 'auth/request'}, b''),
+        ({'Content-Type': 'api/response'}, b'+OK\n'),
+        ({'Content-Type': 'api/response'}, b'x' * (COPY_THRESHOLD + 17)),
+        ({'Content-Type': 'command/reply', 'Reply-Text': '+OK accepted'},
+         b''),
+        ({'Content-Type': 'api/response'}, b'{"a": "\\n\\n"}\n\n'),
+    ]
+
+    def stream(self):
+        """
+        Returns the frames encoded as one byte stream.
+        """
+        return b''.join(
+            frame(headers['Content-Type'], body,
+                  **{name.replace('-', '_'): value
+                     for name, value in headers.items()
+                     if name != 'Content-Type'})
+            for headers, body in self.FRAMES)
+
+    def parse(self, chunks):
+        """
+        Feeds chunks to a parser and returns all frames, bodies as bytes.
+        """
+        parser = ESLFrameParser()
+        frames = []
+        for chunk in chunks:
+            parser.feed(chunk)
+            while True:
+                result = parser.next_frame()
+                if result is None:
+                    break
+                (headers, body) = result
+                headers.pop('Content-Length', None)
+                frames.append((headers, bytes(body)))
+        self.assertEqual(parser.pending(), 0)
+        return frames
+
+    def test_single_read(self):
+        self.assertEqual(self.parse([self.stream()]), self.FRAMES)
+
+    def test_byte_by_byte(self):
+        stream = self.stream()
+        self.assertEqual(
+            self.parse(stream[pos:pos + 1] for pos in range(len(stream))),
+            self.FRAMES)
+
+    def test_random_splits(self):
+        stream = self.stream()
+        rand = random.Random(0)
+        for _ in range(20):
+            cuts = sorted(rand.sample(range(1, len(stream)), 8))
+            chunks = [stream[start:end] for start, end
+                      in zip([0] + cuts, cuts + [len(stream)])]
+            self.assertEqual(self.parse(chunks), self.FRAMES)
+
+
+class ESLPipelineTest(FakeSwitchTestCase):
+    """
+    Pipelined commands are answered in FIFO order, all of them fail if the
+    connection is lost.
+    """
+
+    async def connect(self, port):
+        """
+        Returns a logged-in ESL connection along with its writer.
+        """
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+        self.addCleanup(writer.close)
+        esl = ESL(reader, writer)
+        await esl.initialize()
+        self.assertTrue(await esl.login('ClueCon'))
+        return esl
+
+    async def test_responses_in_order(self):
+        (switch, config) = await self.serve(5, latency=0.01, jitter=0.01)
+        esl = await self.connect(config['port'])
+
+        uuids = list(switch.calls)
+        futures = [await esl.submit(f'api uuid_dump {uuid} json', raw=True)
+                   for uuid in uuids]
+        futures.append(await esl.submit('api version'))
+        results = await asyncio.gather(*futures)
+
+        for uuid, (_, body) in zip(uuids, results):
+            self.assertIn(uuid.encode(), body)
+        self.assertTrue(results[-1][1].startswith('FreeSWITCH Version'))
+
+    async def test_connection_lost(self):
+        async def handle(reader, writer):
+            writer.write(frame('auth/request'))
+            await reader.readuntil(b'\n\n')
+            writer.write(frame('command/reply', Reply_Text='+OK accepted'))
+            # Answer the first command only, then hang up.
+            await reader.readuntil(b'\n\n')
+            writer.write(frame('api/response', b'first'))
+            await writer.drain()
+            await reader.readuntil(b'\n\n')
+            writer.close()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        esl = await self.connect(server.sockets[0].getsockname()[1])
+
+        futures = [await esl.submit(f'api command {index}')
+                   for index in range(3)]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        self.assertEqual(results[0][1], 'first')
+        for result in results[1:]:
+            self.assertIsInstance(result, ESLError)
+        self.assertTrue(esl.broken)
+        with self.assertRaises(ESLProtocolError):
+            await esl.submit('api version')
+
+
+if __name__ == '__main__':
+    unittest.main()
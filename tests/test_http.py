@@ -0,0 +1,57 @@
+"""
+Tests of the HTTP API.
+"""
+# pylint: disable=missing-function-docstring
+
+import unittest
+
+from prometheus_client import CollectorRegistry, Counter, Summary
+from werkzeug.test import Client
+
+from freeswitch_exporter.http import FreeswitchExporterApplication
+
+
+class ProfileTest(unittest.TestCase):
+    """
+    Invalid profiling requests are rejected with 400.
+    """
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+
+    def client(self, **options):
+        """
+        Returns a client of an application with profiling enabled.
+        """
+        app = FreeswitchExporterApplication(
+            {'default': dict(options, profiling=True)},
+            Summary('duration', 'Duration', ['module'],
+                    registry=self.registry),
+            Counter('errors', 'Errors', ['module'], registry=self.registry))
+        return Client(app)
+
+    def assertBadRequest(self, response, message):  # pylint: disable=invalid-name
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.get_data(as_text=True))
+        self.assertIsNone(self.registry.get_sample_value(
+            'errors_total', {'module': 'default'}))
+
+    def test_repeated(self):
+        client = self.client()
+        for query in ('top=1&top=2', 'target=a&target=b',
+                      'module=default&module=default'):
+            self.assertBadRequest(client.get(f'/debug/profile?{query}'),
+                                  'given more than once')
+
+    def test_invalid_top(self):
+        self.assertBadRequest(self.client().get('/debug/profile?top=x'),
+                              "Invalid top 'x'")
+
+    def test_invalid_timeout(self):
+        self.assertBadRequest(
+            self.client(timeout=0).get('/debug/profile?top=1'),
+            'Invalid scrape timeout')
+
+
+if __name__ == '__main__':
+    unittest.main()
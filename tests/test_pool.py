@@ -0,0 +1,136 @@
+"""
+Tests of the ESL connection pool.
+"""
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from freeswitch_exporter.esl import ESLError
+from freeswitch_exporter.pool import (ESLPool, ESLPoolBusyError,
+                                      ESLPoolError, ESLPoolStats)
+
+from tests import FakeSwitchTestCase
+
+
+async def borrow(pool):
+    """
+    Borrows a connection from the pool and returns it right away.
+    """
+    async with pool.connection():
+        pass
+
+
+class ESLPoolTest(FakeSwitchTestCase):
+    """
+    Connections are reused across borrows unless they broke.
+    """
+
+    def pool(self, config, **options):
+        """
+        Returns a pool for the module config and its registry.
+        """
+        registry = CollectorRegistry()
+        pool = ESLPool('127.0.0.1', dict(config, pool=options),
+                       ESLPoolStats(registry).labels('test'))
+        self.addAsyncCleanup(pool.close)
+        return pool, registry
+
+    @staticmethod
+    def count(registry, name):
+        """
+        Returns the value of a pool counter.
+        """
+        return registry.get_sample_value(f'freeswitch_pool_{name}_total',
+                                         {'module': 'test'})
+
+    async def test_reuse(self):
+        (switch, config) = await self.serve(1)
+        (pool, registry) = self.pool(config)
+
+        for _ in range(3):
+            async with pool.connection() as esl:
+                (_, body) = await esl.send('api version')
+                self.assertTrue(body.startswith('FreeSWITCH Version'))
+
+        self.assertEqual(switch.connections, 1)
+        self.assertEqual(self.count(registry, 'misses'), 1)
+        self.assertEqual(self.count(registry, 'hits'), 2)
+
+    async def test_discard_broken(self):
+        (switch, config) = await self.serve(1, disconnect_rate=1.)
+        (pool, registry) = self.pool(config)
+
+        for _ in range(2):
+            async with pool.connection() as esl:
+                with self.assertRaises(ESLError):
+                    await esl.send('api version')
+                self.assertTrue(esl.broken)
+
+        self.assertEqual(switch.connections, 2)
+        self.assertEqual(self.count(registry, 'misses'), 2)
+        self.assertEqual(self.count(registry, 'hits'), 0)
+
+    async def test_discard_on_error(self):
+        (switch, config) = await self.serve(1)
+        (pool, _) = self.pool(config)
+
+        with self.assertRaises(RuntimeError):
+            async with pool.connection():
+                raise RuntimeError('failed')
+        async with pool.connection():
+            pass
+
+        self.assertEqual(switch.connections, 2)
+
+    async def test_discard_unresponsive(self):
+        (switch, config) = await self.serve(1, latency=5)
+        (pool, registry) = self.pool(config, check_interval=0,
+                                     check_timeout=0.1)
+
+        for _ in range(2):
+            await asyncio.wait_for(borrow(pool), 1)
+
+        self.assertEqual(switch.connections, 2)
+        self.assertEqual(self.count(registry, 'reconnects'), 1)
+
+    async def test_cancelled_login(self):
+        # Accepts connections but never sends the auth request.
+        writers = []
+        server = await asyncio.start_server(
+            lambda reader, writer: writers.append(writer), '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        self.addCleanup(lambda: [writer.close() for writer in writers])
+        (pool, _) = self.pool({'port': server.sockets[0].getsockname()[1]})
+
+        for _ in range(2):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(borrow(pool), 0.1)
+
+    async def test_backoff(self):
+        server = await asyncio.start_server(
+            lambda reader, writer: writer.close(), '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        (pool, _) = self.pool({'port': server.sockets[0].getsockname()[1]})
+
+        with self.assertRaises(ESLError):
+            await borrow(pool)
+        with self.assertRaisesRegex(ESLPoolError, 'Backing off'):
+            await borrow(pool)
+
+    async def test_busy(self):
+        (_, config) = await self.serve(1)
+        (pool, _) = self.pool(dict(config, connections=1))
+
+        async with pool.connection():
+            with self.assertRaises(ESLPoolBusyError):
+                async with pool.connection(wait=False):
+                    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
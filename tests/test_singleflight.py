@@ -0,0 +1,129 @@
+"""
+Tests of the coalescing of concurrent collections.
+"""
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import threading
+import time
+import unittest
+
+from freeswitch_exporter.deadline import Deadline
+from freeswitch_exporter.singleflight import AsyncSingleFlight, SingleFlight
+
+
+class AsyncSingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Followers share the result of the leader within their own deadline.
+    """
+
+    async def test_shared(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def collect():
+            calls.append(None)
+            await asyncio.sleep(0.1)
+            return 'result'
+
+        results = await asyncio.gather(
+            flight.call('key', collect), flight.call('key', collect))
+
+        self.assertEqual(results, [('result', False), ('result', True)])
+        self.assertEqual(len(calls), 1)
+
+    async def test_follower_deadline(self):
+        flight = AsyncSingleFlight()
+
+        async def slow():
+            await asyncio.sleep(1)
+            return 'leader'
+
+        async def fast():
+            return 'follower'
+
+        leader = asyncio.ensure_future(flight.call('key', slow))
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        result = await flight.call('key', fast, Deadline(0.1))
+
+        self.assertEqual(result, ('follower', False))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(await leader, ('leader', False))
+
+    async def test_partial_result_not_shared(self):
+        flight = AsyncSingleFlight()
+        exceeded = Deadline(0)
+
+        async def partial():
+            await asyncio.sleep(0.1)
+            exceeded.exceed()
+            return 'partial'
+
+        async def complete():
+            return 'complete'
+
+        results = await asyncio.gather(
+            flight.call('key', partial, exceeded),
+            flight.call('key', complete, Deadline(5)))
+
+        self.assertEqual(results, [('partial', False), ('complete', False)])
+
+
+class SingleFlightTest(unittest.TestCase):
+    """
+    Threads waiting for a call in flight give up at their own deadline.
+    """
+
+    def test_follower_deadline(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        results = []
+
+        def slow():
+            started.set()
+            time.sleep(1)
+            return 'leader'
+
+        leader = threading.Thread(
+            target=lambda: results.append(flight.call('key', slow)))
+        leader.start()
+        started.wait()
+        start = time.monotonic()
+        result = flight.call('key', lambda: 'follower', Deadline(0.1))
+        elapsed = time.monotonic() - start
+        leader.join()
+
+        self.assertEqual(result, ('follower', False))
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(results, [('leader', False)])
+
+    def test_shared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def collect():
+            started.set()
+            release.wait()
+            return 'result'
+
+        leader = threading.Thread(
+            target=lambda: results.append(flight.call('key', collect)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(flight.call('key', collect)))
+        follower.start()
+        # Give the follower time to start waiting for the leader.
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertCountEqual(results, [('result', False), ('result', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()